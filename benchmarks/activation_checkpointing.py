@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+"""
+    Memory and speed of Paraphraser training with activation checkpointing.
+
+    Every (mode, batch size) pair trains for --steps optimizer steps on random
+    embedded batches in a fresh subprocess, which reports its step time and
+    peak resident memory. Batch sizes double from --min-batch-size until the
+    peak exceeds --memory-limit or --max-batch-size is reached, the largest
+    batch size that fit is reported per mode.
+
+    Usage: python -m benchmarks.activation_checkpointing --memory-limit 4096
+"""
+import argparse
+import json
+import resource
+import subprocess
+import sys
+import time
+
+import torch as t
+from torch.optim import Adam
+
+from benchmarks.ddp_scaling import RandomBatches
+from model.parameters import Parameters
+from model.paraphraser import Paraphraser
+
+
+MODES = {'none': (False, False),
+         'decoder': (False, True),
+         'encoder+decoder': (True, True)}
+
+
+def run(mode, batch_size, args):
+    '''
+        Train in this process and print step time and peak memory as json.
+    '''
+    t.manual_seed(0)
+    checkpoint_encoder, checkpoint_decoder = MODES[mode]
+    parameters = Parameters(args.seq_len, args.vocab_size, args.use_two_path_loss,
+                            checkpoint_encoder=checkpoint_encoder,
+                            checkpoint_decoder=checkpoint_decoder)
+    paraphraser = Paraphraser(parameters)
+    optimizer = Adam(paraphraser.learnable_parameters(), 0.00005)
+    train_step = paraphraser.trainer(optimizer, RandomBatches(args.seq_len, args.vocab_size))
+
+    for i in range(args.warmup):
+        train_step(i, batch_size, False, 0.3)
+
+    start = time.perf_counter()
+    for i in range(args.steps):
+        train_step(i, batch_size, False, 0.3)
+    elapsed = time.perf_counter() - start
+
+    # ru_maxrss is in kilobytes on linux
+    print(json.dumps({'step_time': elapsed / args.steps,
+                      'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.}))
+
+
+def measure(mode, batch_size, args):
+    command = [sys.executable, '-m', 'benchmarks.activation_checkpointing',
+               '--run', mode, str(batch_size),
+               '--steps', str(args.steps), '--warmup', str(args.warmup),
+               '--seq-len', str(args.seq_len), '--vocab-size', str(args.vocab_size)]
+    if args.use_two_path_loss:
+        command += ['-tpl']
+    output = subprocess.run(command, stdout=subprocess.PIPE, check=True).stdout
+    return json.loads(output.decode('utf-8').strip().splitlines()[-1])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Activation checkpointing benchmark')
+    parser.add_argument('--memory-limit', type=float, default=4096, help='peak memory budget in MB (default: 4096)')
+    parser.add_argument('--min-batch-size', type=int, default=8, help='first batch size (default: 8)')
+    parser.add_argument('--max-batch-size', type=int, default=512, help='largest batch size tried (default: 512)')
+    parser.add_argument('--steps', type=int, default=3, help='timed steps per run (default: 3)')
+    parser.add_argument('--warmup', type=int, default=1, help='untimed steps per run (default: 1)')
+    parser.add_argument('--seq-len', type=int, default=20, help='sentence length (default: 20)')
+    parser.add_argument('--vocab-size', type=int, default=20000, help='output vocabulary size (default: 20000)')
+    parser.add_argument('-tpl', '--use-two-path-loss', action='store_true', help='train with the two path loss')
+    parser.add_argument('--run', nargs=2, metavar=('MODE', 'BATCH_SIZE'), help=argparse.SUPPRESS)
+    parser.add_argument('--output', default='', help='optional path of a JSON report')
+    args = parser.parse_args()
+
+    if args.run:
+        run(args.run[0], int(args.run[1]), args)
+        sys.exit(0)
+
+    report = []
+    for mode in MODES:
+        runs, max_batch_size = [], 0
+        batch_size = args.min_batch_size
+        while batch_size <= args.max_batch_size:
+            result = measure(mode, batch_size, args)
+            result['batch_size'] = batch_size
+            runs.append(result)
+            print(json.dumps(dict(mode=mode, **result)))
+            if result['peak_rss_mb'] > args.memory_limit:
+                break
+            max_batch_size = batch_size
+            batch_size *= 2
+        report.append({'mode': mode, 'max_batch_size': max_batch_size, 'runs': runs})
+
+    for entry in report:
+        same_batch = [r for r in entry['runs'] if r['batch_size'] == report[0]['max_batch_size']]
+        print('{:>16}: max batch size {:>5}, step time at batch {}: {}'.format(
+            entry['mode'], entry['max_batch_size'], report[0]['max_batch_size'],
+            '{:.3f}s'.format(same_batch[0]['step_time']) if same_batch else '-'))
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
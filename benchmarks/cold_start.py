@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+"""
+    Cold-start time of BatchLoader, rebuilt from the corpus or loaded from a
+    vocabulary artifact.
+
+    A synthetic corpus is written to a temporary directory in the layout of
+    the real data, datasets/train140k.csv, datasets/test.csv and a cached
+    word_vec.pkl, together with its vocabulary artifact. Every start runs in
+    a fresh subprocess, which reports the time from constructing the loader
+    until the first test batch is embedded, its peak resident memory and a
+    checksum of that batch so both modes can be checked for equal output.
+
+    Usage: python -m benchmarks.cold_start --pairs 140000 --repeat 3
+"""
+import argparse
+import hashlib
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pickle5 as pickle
+
+from utils.batch_loader import BatchLoader
+from utils.synthetic import SyntheticCorpus
+from utils.vocab import save_vocab
+
+
+ARTIFACT = 'saved_models/vocab_cold_start'
+
+
+def prepare(directory, args):
+    corpus = SyntheticCorpus(args.pairs, args.test_pairs, args.num_words)
+    os.makedirs(os.path.join(directory, 'datasets'))
+    corpus.data[0].to_csv(os.path.join(directory, 'datasets/train140k.csv'))
+    corpus.data[1].to_csv(os.path.join(directory, 'datasets/test.csv'))
+
+    batch_loader = BatchLoader(synthetic=corpus)
+    with open(os.path.join(directory, 'word_vec.pkl'), 'wb') as f:
+        pickle.dump(batch_loader.word_vec, f, pickle.HIGHEST_PROTOCOL)
+    save_vocab(batch_loader, os.path.join(directory, ARTIFACT))
+
+
+def peak_rss_mb():
+    # ru_maxrss survives exec and would include the memory of the parent
+    with open('/proc/self/status') as f:
+        for line in f:
+            if line.startswith('VmHWM:'):
+                return int(line.split()[1]) / 1024.
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.
+
+
+def run(mode):
+    '''
+        Start a BatchLoader in the working directory and print timing,
+        peak memory and output checksum as json.
+    '''
+    start = time.perf_counter()
+    batch_loader = BatchLoader() if mode == 'rebuild' else BatchLoader.from_artifact(ARTIFACT)
+    input = batch_loader.next_batch_from_file(32)
+    elapsed = time.perf_counter() - start
+
+    checksum = hashlib.sha256()
+    for var in input:
+        checksum.update(var.numpy().tobytes())
+    checksum.update(json.dumps(list(batch_loader.idx_to_word)).encode('utf-8'))
+    print(json.dumps({'seconds': elapsed,
+                      'peak_rss_mb': peak_rss_mb(),
+                      'checksum': checksum.hexdigest()}))
+
+
+def measure(mode, directory):
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join([root, os.environ.get('PYTHONPATH', '')]))
+    output = subprocess.run([sys.executable, '-m', 'benchmarks.cold_start', '--run', mode],
+                            cwd=directory, env=env, stdout=subprocess.PIPE, check=True).stdout
+    return json.loads(output.decode('utf-8').strip().splitlines()[-1])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Cold start benchmark')
+    parser.add_argument('--pairs', type=int, default=140000, help='train pairs of the corpus (default: 140000)')
+    parser.add_argument('--test-pairs', type=int, default=4000, help='test pairs of the corpus (default: 4000)')
+    parser.add_argument('--num-words', type=int, default=40000, help='distinct words of the corpus (default: 40000)')
+    parser.add_argument('--repeat', type=int, default=3, help='starts per mode (default: 3)')
+    parser.add_argument('--run', choices=['rebuild', 'artifact'], help=argparse.SUPPRESS)
+    parser.add_argument('--output', default='', help='optional path of a JSON report')
+    args = parser.parse_args()
+
+    if args.run:
+        np.random.seed(0)
+        run(args.run)
+        sys.exit(0)
+
+    report = {}
+    with tempfile.TemporaryDirectory() as directory:
+        prepare(directory, args)
+        for mode in ['rebuild', 'artifact']:
+            runs = [measure(mode, directory) for _ in range(args.repeat)]
+            report[mode] = {'seconds': float(np.median([r['seconds'] for r in runs])),
+                            'peak_rss_mb': float(np.median([r['peak_rss_mb'] for r in runs])),
+                            'checksum': runs[0]['checksum']}
+            print(json.dumps(dict(mode=mode, **report[mode])))
+
+    print('------------------------------')
+    print('speedup:        {:.1f}x'.format(report['rebuild']['seconds'] / report['artifact']['seconds']))
+    print('memory saved:   {:.0f} MB'.format(report['rebuild']['peak_rss_mb'] - report['artifact']['peak_rss_mb']))
+    print('same output:    {}'.format(report['rebuild']['checksum'] == report['artifact']['checksum']))
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+"""
+    Data-parallel scaling of Paraphraser training on CPU (gloo backend).
+
+    For every process count from 1 to --max-procs the real Paraphraser.trainer
+    is run for --steps optimizer steps on random embedded batches, with the
+    available cores split evenly between processes. Reported throughput is
+    the global number of sentence pairs per second.
+
+    Usage: python -m benchmarks.ddp_scaling --max-procs 4 --steps 20
+"""
+import argparse
+import json
+import os
+import time
+
+import torch as t
+import torch.distributed as dist
+import torch.multiprocessing as mp
+from torch.optim import Adam
+
+from model.parameters import Parameters
+from model.paraphraser import Paraphraser
+from utils import distributed
+
+
+class RandomBatches:
+    def __init__(self, seq_len, vocab_size, embed_size=300):
+        self.seq_len = seq_len
+        self.vocab_size = vocab_size
+        self.embed_size = embed_size
+
+    def next_batch(self, batch_size, type):
+        embedded = [t.randn(batch_size, self.seq_len, self.embed_size) for _ in range(4)]
+        target = t.randint(self.vocab_size, (batch_size, self.seq_len))
+        return embedded + [target]
+
+
+def worker(rank, world_size, args, port, results):
+    os.environ['MASTER_ADDR'] = '127.0.0.1'
+    os.environ['MASTER_PORT'] = str(port)
+    dist.init_process_group('gloo', rank=rank, world_size=world_size)
+    t.set_num_threads(max(1, args.cores // world_size))
+    t.manual_seed(rank)
+
+    parameters = Parameters(args.seq_len, args.vocab_size, args.use_two_path_loss)
+    paraphraser = Paraphraser(parameters)
+    optimizer = Adam(paraphraser.learnable_parameters(), 0.00005)
+    train_step = paraphraser.trainer(optimizer, RandomBatches(args.seq_len, args.vocab_size),
+                                     distributed.wrap(paraphraser, False))
+
+    for i in range(args.warmup):
+        train_step(i, args.batch_size, False, 0.3)
+
+    dist.barrier()
+    start = time.perf_counter()
+    for i in range(args.steps):
+        train_step(i, args.batch_size, False, 0.3)
+    dist.barrier()
+    elapsed = time.perf_counter() - start
+
+    if rank == 0:
+        results[world_size] = elapsed
+    dist.destroy_process_group()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='DDP scaling benchmark')
+    parser.add_argument('--max-procs', type=int, default=4, help='largest number of processes (default: 4)')
+    parser.add_argument('--cores', type=int, default=os.cpu_count(), help='cores shared by all processes (default: all)')
+    parser.add_argument('--steps', type=int, default=20, help='timed steps per run (default: 20)')
+    parser.add_argument('--warmup', type=int, default=2, help='untimed steps per run (default: 2)')
+    parser.add_argument('--batch-size', type=int, default=32, help='per-process batch size (default: 32)')
+    parser.add_argument('--seq-len', type=int, default=20, help='sentence length (default: 20)')
+    parser.add_argument('--vocab-size', type=int, default=20000, help='output vocabulary size (default: 20000)')
+    parser.add_argument('-tpl', '--use-two-path-loss', action='store_true', help='train with the two path loss')
+    parser.add_argument('--output', default='', help='optional path of a JSON report')
+    args = parser.parse_args()
+
+    manager = mp.Manager()
+    results = manager.dict()
+    report = []
+    for world_size in range(1, args.max_procs + 1):
+        mp.spawn(worker, args=(world_size, args, 29500 + world_size, results), nprocs=world_size)
+        throughput = world_size * args.batch_size * args.steps / results[world_size]
+        report.append({'processes': world_size,
+                       'threads_per_process': max(1, args.cores // world_size),
+                       'sentences_per_sec': throughput,
+                       'speedup': throughput / report[0]['sentences_per_sec'] if report else 1.0})
+        print(json.dumps(report[-1]))
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
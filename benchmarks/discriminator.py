@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+"""
+    Compare the LSTM and CNN discriminators on CPU.
+
+    Real sentences are drawn from a fixed random Markov chain over a small
+    embedded vocabulary, fake sentences from the same vocabulary with the
+    same unigram distribution but without the transition structure. For each
+    discriminator we report training throughput, rollout-style inference
+    latency and held-out reward quality (accuracy and mean reward gap).
+
+    Usage: python -m benchmarks.discriminator --steps 200 --batch-size 32
+"""
+import argparse
+import json
+import time
+
+import numpy as np
+import torch as t
+import torch.nn.functional as F
+from torch.optim import Adam
+
+from model.parametersGAN import Parameters
+from model.discriminator import build_discriminator
+
+
+class ToyCorpus:
+    def __init__(self, num_words, seq_len, embed_size, seed):
+        rng = np.random.RandomState(seed)
+        self.rng = rng
+        self.seq_len = seq_len
+        self.embeddings = rng.randn(num_words, embed_size).astype(np.float32)
+        self.embeddings /= np.linalg.norm(self.embeddings, axis=1, keepdims=True)
+        # sparse transition matrix: every word has a handful of successors
+        self.transitions = np.zeros((num_words, num_words))
+        for i in range(num_words):
+            successors = rng.choice(num_words, 4, replace=False)
+            self.transitions[i, successors] = rng.dirichlet(np.ones(4))
+        self.num_words = num_words
+
+    def real(self, batch_size):
+        ids = np.zeros((batch_size, self.seq_len), dtype=np.int64)
+        ids[:, 0] = self.rng.randint(self.num_words, size=batch_size)
+        for j in range(1, self.seq_len):
+            for i in range(batch_size):
+                ids[i, j] = self.rng.choice(self.num_words, p=self.transitions[ids[i, j - 1]])
+        return t.from_numpy(self.embeddings[ids])
+
+    def fake(self, batch_size):
+        ids = self.rng.randint(self.num_words, size=(batch_size, self.seq_len))
+        return t.from_numpy(self.embeddings[ids])
+
+
+def benchmark(discriminator_type, corpus, args):
+    t.manual_seed(args.seed)
+    parameters = Parameters(args.seq_len, 20000, discriminator_type=discriminator_type)
+    discriminator = build_discriminator(parameters)
+    optimizer = Adam(discriminator.learnable_parameters(), args.learning_rate)
+
+    labels = t.zeros(2 * args.batch_size)
+    labels[:args.batch_size] = 1
+    batches = [t.cat([corpus.real(args.batch_size), corpus.fake(args.batch_size)], dim=0)
+               for _ in range(args.num_batches)]
+
+    discriminator.train()
+    start = time.perf_counter()
+    for step in range(args.steps):
+        data = batches[step % len(batches)]
+        optimizer.zero_grad()
+        loss = F.binary_cross_entropy_with_logits(discriminator(data), labels)
+        loss.backward()
+        t.nn.utils.clip_grad_norm_(discriminator.learnable_parameters(), 5)
+        optimizer.step()
+    train_time = time.perf_counter() - start
+
+    discriminator.eval()
+    real, fake = corpus.real(args.eval_size), corpus.fake(args.eval_size)
+    with t.no_grad():
+        # one rollout scores batch_size sentences once per prefix length
+        start = time.perf_counter()
+        for _ in range(args.seq_len):
+            t.sigmoid(discriminator(real[:args.batch_size]))
+        reward_time = (time.perf_counter() - start) / args.seq_len
+
+        real_reward = t.sigmoid(discriminator(real)).numpy()
+        fake_reward = t.sigmoid(discriminator(fake)).numpy()
+
+    accuracy = (np.sum(real_reward > 0.5) + np.sum(fake_reward <= 0.5)) / (2. * args.eval_size)
+    return {
+        'discriminator': discriminator_type,
+        'parameters': sum(p.numel() for p in discriminator.learnable_parameters()),
+        'train_sentences_per_sec': 2 * args.batch_size * args.steps / train_time,
+        'reward_ms_per_batch': reward_time * 1000,
+        'final_loss': float(loss.item()),
+        'heldout_accuracy': float(accuracy),
+        'reward_gap': float(np.mean(real_reward) - np.mean(fake_reward)),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Discriminator benchmark')
+    parser.add_argument('--steps', type=int, default=200, help='training steps per discriminator (default: 200)')
+    parser.add_argument('--batch-size', type=int, default=32, help='batch size (default: 32)')
+    parser.add_argument('--seq-len', type=int, default=20, help='sentence length (default: 20)')
+    parser.add_argument('--num-words', type=int, default=500, help='toy vocabulary size (default: 500)')
+    parser.add_argument('--num-batches', type=int, default=20, help='distinct training batches (default: 20)')
+    parser.add_argument('--eval-size', type=int, default=256, help='held-out sentences per class (default: 256)')
+    parser.add_argument('--learning-rate', type=float, default=0.0001, help='learning rate (default: 0.0001)')
+    parser.add_argument('--threads', type=int, default=0, help='torch intra-op threads, 0 keeps the default')
+    parser.add_argument('--seed', type=int, default=0, help='random seed (default: 0)')
+    parser.add_argument('--output', default='', help='optional path of a JSON report')
+    args = parser.parse_args()
+
+    if args.threads > 0:
+        t.set_num_threads(args.threads)
+
+    results = []
+    for discriminator_type in ['lstm', 'cnn']:
+        corpus = ToyCorpus(args.num_words, args.seq_len, 300, args.seed)
+        results.append(benchmark(discriminator_type, corpus, args))
+        print(json.dumps(results[-1], indent=2))
+
+    lstm, cnn = results
+    print('------------------------------')
+    print('training speedup:  {:.2f}x'.format(cnn['train_sentences_per_sec'] / lstm['train_sentences_per_sec']))
+    print('reward speedup:    {:.2f}x'.format(lstm['reward_ms_per_batch'] / cnn['reward_ms_per_batch']))
+    print('accuracy delta:    {:+.3f}'.format(cnn['heldout_accuracy'] - lstm['heldout_accuracy']))
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
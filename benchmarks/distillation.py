@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+"""
+    Latency and quality of distilled students against their teacher for
+    greedy decoding on the cpu.
+
+    Every model decodes the same test pairs with the same seed. Reported per
+    model are its architecture sizes, the number of parameters and the size
+    of its weights, the batch-1 latency percentiles, the throughput of
+    batched decoding, the BLEU of the decoded sentences against the targets
+    and against the sentences of the teacher, which measures how closely a
+    student imitates it.
+
+    The students are trained with python train.py --teacher-name TEACHER and
+    must share its vocabulary, loaded as in sample.py.
+
+    Usage: python -m benchmarks.distillation --teacher NAME --students SMALL TINY --model C-VAE*
+"""
+import argparse
+import io
+import json
+import time
+
+import numpy as np
+import pandas as pd
+import torch as t
+
+from model.parameters import Parameters
+from model.paraphraser import Paraphraser
+from utils.batch_loader import clean_str, load_batch_loader
+from utils.bleu import compute_bleu
+from utils.decoding import decode_sentences, output_embedding
+from utils.distillation import load_sizes
+from utils.tensorfile import load_weights
+
+
+def load(model_name, batch_loader, use_two_path_loss):
+    path = 'saved_models/trained_paraphraser_' + model_name
+    model = Paraphraser(Parameters(batch_loader.max_seq_len, batch_loader.vocab_size,
+                                   use_two_path_loss, **load_sizes(path)))
+    return load_weights(model, path, map_location='cpu').eval()
+
+
+def test_pairs(batch_loader, sentences):
+    if getattr(batch_loader, 'data', None) is not None:
+        question1, question2 = batch_loader.pairs(1)
+    else:
+        df = pd.read_csv(batch_loader.quora_data_files[1])
+        question1, question2 = df['question1'].values, df['question2'].values
+    source = [' '.join(clean_str(s).split()) for s in question1[:sentences]]
+    target = [' '.join(clean_str(s).split()) for s in question2[:sentences]]
+    return source, target
+
+
+def measure(model, batch_loader, source, target, args):
+    from_normal = args.model == 'C-VAE'
+    buffer = io.BytesIO()
+    t.save(model.state_dict(), buffer)
+
+    embedding = output_embedding(batch_loader)
+    with t.no_grad():
+        latency = []
+        for sentence in source[:args.latency_sentences]:
+            start = time.perf_counter()
+            decode_sentences(model, batch_loader, [sentence], args.seq_len, False, 1, from_normal, embedding=embedding)
+            latency.append(time.perf_counter() - start)
+
+        t.manual_seed(args.seed)
+        start = time.perf_counter()
+        sampled = decode_sentences(model, batch_loader, source, args.seq_len, False, args.batch_size, from_normal,
+                                   embedding=embedding)
+        elapsed = time.perf_counter() - start
+
+    return dict(model.params.sizes(),
+                parameters=sum(p.numel() for p in model.parameters()),
+                weights_mb=len(buffer.getvalue()) / 2 ** 20,
+                p50_ms=1000 * float(np.percentile(latency, 50)),
+                p95_ms=1000 * float(np.percentile(latency, 95)),
+                sentences_per_second=len(source) / elapsed,
+                bleu=compute_bleu([[s.split()] for s in target], [s.split() for s in sampled])[0],
+                sampled=sampled)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Distillation benchmark')
+    parser.add_argument('--teacher', required=True, help='name of the trained teacher')
+    parser.add_argument('--students', nargs='+', default=[], help='names of the trained students (default: none)')
+    parser.add_argument('--model', default='C-VAE*', choices=['C-VAE', 'C-VAE*'], help='decode from the source or from the prior (default: C-VAE*)')
+    parser.add_argument('--sentences', type=int, default=500, help='test pairs decoded (default: 500)')
+    parser.add_argument('--latency-sentences', type=int, default=100, help='test pairs decoded one at a time (default: 100)')
+    parser.add_argument('--batch-size', type=int, default=64, help='batch size of the throughput run (default: 64)')
+    parser.add_argument('--seq-len', type=int, default=30, help='max length of the decoded sentences (default: 30)')
+    parser.add_argument('--threads', type=int, default=1, help='torch threads (default: 1)')
+    parser.add_argument('--seed', type=int, default=0, help='random seed (default: 0)')
+    parser.add_argument('--output', default='', help='optional path of a JSON report')
+    args = parser.parse_args()
+
+    t.set_num_threads(args.threads)
+    batch_loader = load_batch_loader(args.teacher)
+    source, target = test_pairs(batch_loader, args.sentences)
+
+    report = {}
+    for name in [args.teacher] + args.students:
+        t.manual_seed(args.seed)
+        report[name] = measure(load(name, batch_loader, args.model == 'C-VAE*'), batch_loader, source, target, args)
+        report[name]['bleu_vs_teacher'] = compute_bleu([[s.split()] for s in report[args.teacher]['sampled']],
+                                                       [s.split() for s in report[name]['sampled']])[0]
+        print(json.dumps(dict(model=name, **{k: v for k, v in report[name].items() if k != 'sampled'})))
+
+    teacher = report[args.teacher]
+    print('------------------------------')
+    print('{:<16} {:>10} {:>8} {:>9} {:>8} {:>8} {:>10}'.format(
+        'model', 'params', 'p50 ms', 'speedup', 'sent/s', 'BLEU', 'vs teacher'))
+    for name, result in report.items():
+        print('{:<16} {:>9.1f}M {:>8.1f} {:>8.2f}x {:>8.1f} {:>8.4f} {:>10.4f}'.format(
+            name, result['parameters'] / 1e6, result['p50_ms'], teacher['p50_ms'] / result['p50_ms'],
+            result['sentences_per_second'], result['bleu'], result['bleu_vs_teacher']))
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
@@ -0,0 +1,252 @@
+# -*- coding: utf-8 -*-
+"""
+    Microbenchmarks of the data and model hot paths on CPU.
+
+    Every case is timed for each combination of --batch-sizes and --seq-lens
+    on deterministic random inputs over the vocabulary of a synthetic corpus,
+    so the suite runs offline without the datasets or the fastText vectors. Forward passes are
+    timed without autograd. A case is repeated until it ran for --min-time
+    seconds and at least --min-runs times, the median is the reported time.
+
+    The results are written as json with --output, a previous output can be
+    passed as --baseline, cases whose median is more than --tolerance slower
+    than the baseline are reported and make the run exit with status 1.
+
+    Usage: python -m benchmarks.microbench --output microbench.json
+           python -m benchmarks.microbench --baseline microbench.json
+"""
+import argparse
+import json
+import platform
+import sys
+import time
+
+import numpy as np
+import torch as t
+
+from model.discriminator import build_discriminator
+from model.generator import Generator
+from model.parameters import Parameters
+from model.parametersGAN import Parameters as ParametersGAN
+from model.paraphraser import Paraphraser
+from utils.batch_loader import BatchLoader, clean_str
+from utils.bleu import compute_bleu
+from utils.rollout import Rollout
+from utils.synthetic import SyntheticCorpus
+
+
+class Inputs:
+    """
+        Random sentences of one (batch size, sequence length) point of the grid.
+    """
+    def __init__(self, batch_loader, batch_size, seq_len, seed=0):
+        rng = np.random.RandomState(seed)
+        vocab = len(batch_loader.idx_to_word) - 2
+        self.batch_loader = batch_loader
+        self.batch_size = batch_size
+        self.seq_len = seq_len
+        self.ids = [rng.randint(vocab, size=(batch_size, seq_len)) for _ in range(2)]
+        self.sentences = [[[batch_loader.idx_to_word[i] for i in row] for row in ids] for ids in self.ids]
+        punctuation = np.array(['', ',', '?', "'s", '.'])
+        self.raw = [' '.join(w + punctuation[rng.randint(len(punctuation))] for w in s).capitalize()
+                    for s in self.sentences[0]]
+
+        generator = t.Generator().manual_seed(seed)
+        self.embedded = [t.randn(batch_size, seq_len, 300, generator=generator) for _ in range(2)]
+
+
+def case_clean_str(inputs, state):
+    return lambda: [clean_str(s) for s in inputs.raw]
+
+
+def case_embed_batch(inputs, state):
+    return lambda: inputs.batch_loader.embed_batch(inputs.sentences[0])
+
+
+def case_embed_batch_from_index(inputs, state):
+    ids = inputs.ids[0].tolist()
+    return lambda: inputs.batch_loader.embed_batch_from_index(ids)
+
+
+def case_get_target(inputs, state):
+    return lambda: inputs.batch_loader.get_target(inputs.sentences)
+
+
+def case_highway_forward(inputs, state):
+    highway = state['paraphraser'].highway
+    x = inputs.embedded[0].view(-1, 300)
+    return lambda: highway(x)
+
+
+def case_encoder_forward(inputs, state):
+    encoder = state['paraphraser'].encoder
+    return lambda: encoder(inputs.embedded[0], inputs.embedded[1])
+
+
+def case_decoder_step(inputs, state):
+    paraphraser = state['paraphraser']
+    z = t.randn(inputs.batch_size, paraphraser.params.latent_variable_size)
+    initial_state = paraphraser.decoder.build_initial_state(inputs.embedded[0])
+    step_input = inputs.embedded[1][:, :1]
+    return lambda: paraphraser.decoder(None, step_input, z, 0., initial_state)
+
+
+def case_decoder_teacher_forcing(inputs, state):
+    paraphraser = state['paraphraser']
+    z = t.randn(inputs.batch_size, paraphraser.params.latent_variable_size)
+    return lambda: paraphraser.decoder(inputs.embedded[0], inputs.embedded[1], z, 0.)
+
+
+def case_beam_search(inputs, state):
+    if inputs.batch_size != 1:
+        return None
+    input = [inputs.embedded[0], inputs.embedded[1], inputs.embedded[0], None, None]
+    # decoding length is capped, every step embeds the whole vocabulary per beam
+    return lambda: state['paraphraser'].beam_search(inputs.batch_loader, state['beam_seq_len'], False,
+                                                     input, state['beam_size'], False)
+
+
+def case_rollout_reward(inputs, state):
+    x = inputs.batch_loader.embed_batch_from_index(inputs.ids[1].tolist())
+    encoder_input = [inputs.embedded[0], inputs.embedded[1]]
+    return lambda: state['rollout'].reward(x, encoder_input, inputs.embedded[0], False, inputs.batch_loader)
+
+
+def case_discriminator_forward(inputs, state):
+    return lambda: state['discriminator'](inputs.embedded[0])
+
+
+def case_compute_bleu(inputs, state):
+    references = [[s] for s in inputs.sentences[0]]
+    return lambda: compute_bleu(references, inputs.sentences[1])
+
+
+CASES = [('clean_str', case_clean_str),
+         ('embed_batch', case_embed_batch),
+         ('embed_batch_from_index', case_embed_batch_from_index),
+         ('get_target', case_get_target),
+         ('highway_forward', case_highway_forward),
+         ('encoder_forward', case_encoder_forward),
+         ('decoder_step', case_decoder_step),
+         ('decoder_teacher_forcing', case_decoder_teacher_forcing),
+         ('beam_search', case_beam_search),
+         ('rollout_reward', case_rollout_reward),
+         ('discriminator_forward', case_discriminator_forward),
+         ('compute_bleu', case_compute_bleu)]
+
+
+def measure(function, args):
+    for _ in range(args.warmup):
+        function()
+    times = []
+    start = time.perf_counter()
+    while len(times) < args.min_runs or (time.perf_counter() - start < args.min_time
+                                         and len(times) < args.max_runs):
+        run_start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - run_start)
+    times = 1000. * np.array(times)
+    return {'median_ms': float(np.median(times)),
+            'mean_ms': float(np.mean(times)),
+            'min_ms': float(np.min(times)),
+            'std_ms': float(np.std(times)),
+            'runs': len(times)}
+
+
+def key(result):
+    return '{}[batch_size={},seq_len={}]'.format(result['case'], result['batch_size'], result['seq_len'])
+
+
+def compare(results, baseline, tolerance):
+    '''
+    :return: list of (key, baseline median, median, ratio) of the cases
+             more than tolerance slower than the baseline
+    '''
+    baseline = {key(result): result for result in baseline['results']}
+    regressions = []
+    print('------------------------------')
+    print('{:<52}{:>12}{:>12}{:>8}'.format('case', 'baseline ms', 'ms', 'ratio'))
+    for result in results:
+        if key(result) not in baseline:
+            continue
+        before = baseline[key(result)]['median_ms']
+        ratio = result['median_ms'] / before
+        flag = ' <-- regression' if ratio > 1. + tolerance else ''
+        print('{:<52}{:>12.3f}{:>12.3f}{:>8.2f}{}'.format(key(result), before, result['median_ms'], ratio, flag))
+        if flag:
+            regressions.append((key(result), before, result['median_ms'], ratio))
+    print('------------------------------')
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Microbenchmarks')
+    parser.add_argument('--batch-sizes', type=int, nargs='+', default=[1, 32], help='batch sizes (default: 1 32)')
+    parser.add_argument('--seq-lens', type=int, nargs='+', default=[10, 30], help='sentence lengths (default: 10 30)')
+    parser.add_argument('--cases', nargs='+', default=[name for name, _ in CASES],
+                        help='cases to run (default: all)')
+    parser.add_argument('--vocab-size', type=int, default=20000, help='output vocabulary size (default: 20000)')
+    parser.add_argument('--beam-size', type=int, default=2, help='beam_search width (default: 2)')
+    parser.add_argument('--beam-seq-len', type=int, default=5, help='beam_search decoding length (default: 5)')
+    parser.add_argument('--rollout-num', type=int, default=1, help='rollout_reward rollouts (default: 1)')
+    parser.add_argument('--warmup', type=int, default=1, help='untimed runs per case (default: 1)')
+    parser.add_argument('--min-runs', type=int, default=3, help='least timed runs per case (default: 3)')
+    parser.add_argument('--max-runs', type=int, default=1000, help='most timed runs per case (default: 1000)')
+    parser.add_argument('--min-time', type=float, default=0.5, help='least seconds timed per case (default: 0.5)')
+    parser.add_argument('--threads', type=int, default=0, help='torch intra-op threads, 0 keeps the default')
+    parser.add_argument('--seed', type=int, default=0, help='random seed (default: 0)')
+    parser.add_argument('--output', default='', help='optional path of a JSON report')
+    parser.add_argument('--baseline', default='', help='optional JSON report to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help='relative slowdown over the baseline reported as regression (default: 0.25)')
+    args = parser.parse_args()
+
+    unknown = set(args.cases) - set(name for name, _ in CASES)
+    if unknown:
+        parser.error('unknown cases: {}'.format(', '.join(sorted(unknown))))
+    if args.threads > 0:
+        t.set_num_threads(args.threads)
+
+    t.manual_seed(args.seed)
+    batch_loader = BatchLoader(args.vocab_size, synthetic=SyntheticCorpus(num_words=2 * args.vocab_size, seed=args.seed))
+    generator = Generator(ParametersGAN(max(args.seq_lens), args.vocab_size)).eval()
+    discriminator = build_discriminator(ParametersGAN(max(args.seq_lens), args.vocab_size)).eval()
+    state = {'paraphraser': Paraphraser(Parameters(max(args.seq_lens), args.vocab_size)).eval(),
+             'discriminator': discriminator,
+             'rollout': Rollout(generator, discriminator, 0.8, args.rollout_num),
+             'beam_size': args.beam_size,
+             'beam_seq_len': args.beam_seq_len}
+
+    results = []
+    with t.no_grad():
+        for name, case in CASES:
+            if name not in args.cases:
+                continue
+            for batch_size in args.batch_sizes:
+                for seq_len in args.seq_lens:
+                    function = case(Inputs(batch_loader, batch_size, seq_len, args.seed), state)
+                    if function is None:
+                        continue
+                    t.manual_seed(args.seed)
+                    np.random.seed(args.seed)
+                    result = dict(case=name, batch_size=batch_size, seq_len=seq_len, **measure(function, args))
+                    results.append(result)
+                    print('{:<52}{:>12.3f} ms x {}'.format(key(result), result['median_ms'], result['runs']))
+
+    report = {'environment': {'torch': t.__version__,
+                              'python': platform.python_version(),
+                              'machine': platform.machine(),
+                              'threads': t.get_num_threads(),
+                              'vocab_size': args.vocab_size},
+              'results': results}
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        if regressions:
+            print('{} regression(s) over {:.0%}'.format(len(regressions), args.tolerance))
+            sys.exit(1)
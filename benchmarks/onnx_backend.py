@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+"""
+    Parity and throughput of greedy decoding on onnxruntime against the eager
+    PyTorch model, on the cpu with random weights.
+
+    The model is exported with utils.onnx_export to a temporary directory.
+    Reported are the largest absolute difference of every exported graph to
+    its PyTorch module, the share of test sentences both backends decode to
+    the same words from the same z, and the sentences per second of both
+    backends with batch size 1 and --batch-size.
+
+    Usage: python -m benchmarks.onnx_backend --sentences 64 --batch-size 32
+"""
+import argparse
+import copy
+import json
+import tempfile
+import time
+
+import numpy as np
+import torch as t
+
+from model.parameters import Parameters
+from model.paraphraser import Paraphraser
+from utils.batch_loader import BatchLoader, clean_str
+from utils.decoding import greedy_decode, output_embedding
+from utils.onnx_export import OnnxSampler, export_onnx
+from utils.quantization import fuse_highway
+from utils.synthetic import SyntheticCorpus
+
+
+def torch_sample(model, batch_loader, embedding, sentences, seq_len, noise):
+    source = batch_loader.embed_batch([s.split() + [batch_loader.end_label] for s in sentences])
+    with t.no_grad():
+        return greedy_decode(model, batch_loader, t.from_numpy(source).float(), seq_len, False, embedding, noise=noise)
+
+
+def throughput(sample, sentences, batch_size):
+    start = time.perf_counter()
+    for i in range(0, len(sentences), batch_size):
+        sample(sentences[i:i + batch_size])
+    return len(sentences) / (time.perf_counter() - start)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='ONNX backend benchmark')
+    parser.add_argument('--sentences', type=int, default=64, help='test sentences decoded (default: 64)')
+    parser.add_argument('--batch-size', type=int, default=32, help='batch size of the batched runs (default: 32)')
+    parser.add_argument('--seq-len', type=int, default=20, help='decoded tokens per sentence (default: 20)')
+    parser.add_argument('--vocab-size', type=int, default=20000, help='output vocabulary size (default: 20000)')
+    parser.add_argument('--threads', type=int, default=1, help='intra-op threads of both backends (default: 1)')
+    parser.add_argument('--seed', type=int, default=0, help='random seed (default: 0)')
+    parser.add_argument('--output', default='', help='optional path of a JSON report')
+    args = parser.parse_args()
+
+    t.manual_seed(args.seed)
+    t.set_num_threads(args.threads)
+    batch_loader = BatchLoader(args.vocab_size, synthetic=SyntheticCorpus(num_words=2 * args.vocab_size, seed=args.seed))
+    model = Paraphraser(Parameters(batch_loader.max_seq_len, batch_loader.vocab_size, use_two_path_loss=True)).eval()
+    sentences = [' '.join(clean_str(s).split()) for s in batch_loader.pairs(1)[0][:args.sentences]]
+
+    with tempfile.TemporaryDirectory() as directory:
+        differences = export_onnx(model, batch_loader, directory)
+        sampler = OnnxSampler(directory, num_threads=args.threads)
+
+        # the graphs are exported with the fused highway
+        fused = fuse_highway(copy.deepcopy(model))
+        embedding = output_embedding(batch_loader)
+        noise = np.random.RandomState(args.seed).randn(len(sentences), model.params.latent_variable_size).astype(np.float32)
+
+        same = 0
+        for i, sentence in enumerate(sentences):
+            expected = torch_sample(fused, batch_loader, embedding, [sentence], args.seq_len, noise[i:i + 1])
+            same += expected == sampler.sample([sentence], args.seq_len, noise=noise[i:i + 1])
+
+        report = {'max_abs_difference': differences, 'same_output': same / len(sentences)}
+        for batch_size in [1, args.batch_size]:
+            report['torch_{}'.format(batch_size)] = throughput(
+                lambda s: torch_sample(fused, batch_loader, embedding, s, args.seq_len, noise[:len(s)]), sentences, batch_size)
+            report['onnx_{}'.format(batch_size)] = throughput(
+                lambda s: sampler.sample(s, args.seq_len, noise=noise[:len(s)]), sentences, batch_size)
+
+    print(json.dumps(report))
+    print('------------------------------')
+    print('max difference: {:.2e}'.format(max(d for graph in differences.values() for d in graph.values())))
+    print('same output:    {:.1%}'.format(report['same_output']))
+    for batch_size in [1, args.batch_size]:
+        torch_rate, onnx_rate = report['torch_{}'.format(batch_size)], report['onnx_{}'.format(batch_size)]
+        print('batch {:<3}      {:.2f}x ({:.1f} -> {:.1f} sentences/s)'.format(
+            batch_size, onnx_rate / torch_rate, torch_rate, onnx_rate))
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
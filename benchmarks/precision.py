@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+"""
+    Step time and loss-curve parity of Paraphraser training per precision.
+
+    Every policy trains the same initial weights on the same cycle of
+    --num-batches fixed random batches, so the loss curves are directly
+    comparable. Reported are the mean step time, the speedup over fp32 and
+    the largest absolute and relative deviation of the reconstruction loss
+    from the fp32 curve. fp16 is only run when a GPU is available.
+
+    Usage: python -m benchmarks.precision --steps 50 --batch-size 32
+"""
+import argparse
+import json
+import time
+
+import numpy as np
+import torch as t
+from torch.optim import Adam
+
+from model.parameters import Parameters
+from model.paraphraser import Paraphraser
+from utils.precision import PrecisionPolicy
+
+
+class FixedBatches:
+    def __init__(self, num_batches, batch_size, seq_len, vocab_size, use_cuda, embed_size=300):
+        generator = t.Generator().manual_seed(0)
+        self.batches = []
+        for _ in range(num_batches):
+            embedded = [t.randn(batch_size, seq_len, embed_size, generator=generator) for _ in range(4)]
+            target = t.randint(vocab_size, (batch_size, seq_len), generator=generator)
+            batch = embedded + [target]
+            self.batches.append([var.cuda() for var in batch] if use_cuda else batch)
+        self.step = 0
+
+    def next_batch(self, batch_size, type):
+        batch = self.batches[self.step % len(self.batches)]
+        self.step += 1
+        return batch
+
+
+def benchmark(precision, args):
+    t.manual_seed(args.seed)
+    parameters = Parameters(args.seq_len, args.vocab_size, args.use_two_path_loss)
+    paraphraser = Paraphraser(parameters)
+    if args.use_cuda:
+        paraphraser = paraphraser.cuda()
+    optimizer = Adam(paraphraser.learnable_parameters(), args.learning_rate)
+    batches = FixedBatches(args.num_batches, args.batch_size, args.seq_len, args.vocab_size, args.use_cuda)
+    train_step = paraphraser.trainer(optimizer, batches, precision=PrecisionPolicy(precision, args.use_cuda))
+
+    losses, times = [], []
+    for i in range(args.warmup + args.steps):
+        t.manual_seed(args.seed + i)
+        start = time.perf_counter()
+        (ce, ce2), kld, _ = train_step(i, args.batch_size, args.use_cuda, 0.)
+        # reconstruction loss, the KLD term is barely weighted this early
+        loss = float(ce + ce2)
+        if args.use_cuda:
+            t.cuda.synchronize()
+        if i >= args.warmup:
+            times.append(time.perf_counter() - start)
+        losses.append(loss)
+    return np.array(losses), np.mean(times)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Precision benchmark')
+    parser.add_argument('--steps', type=int, default=50, help='timed steps (default: 50)')
+    parser.add_argument('--warmup', type=int, default=2, help='untimed first steps, part of the loss curve (default: 2)')
+    parser.add_argument('--batch-size', type=int, default=32, help='batch size (default: 32)')
+    parser.add_argument('--num-batches', type=int, default=4, help='fixed batches cycled through (default: 4)')
+    parser.add_argument('--seq-len', type=int, default=20, help='sentence length (default: 20)')
+    parser.add_argument('--vocab-size', type=int, default=20000, help='output vocabulary size (default: 20000)')
+    parser.add_argument('--learning-rate', type=float, default=0.0005, help='learning rate (default: 0.0005)')
+    parser.add_argument('-tpl', '--use-two-path-loss', action='store_true', help='train with the two path loss')
+    parser.add_argument('--seed', type=int, default=0, help='random seed (default: 0)')
+    parser.add_argument('--output', default='', help='optional path of a JSON report')
+    args = parser.parse_args()
+    args.use_cuda = t.cuda.is_available()
+
+    precisions = ['fp32', 'bf16'] + (['fp16'] if args.use_cuda else [])
+    curves, report = {}, []
+    for precision in precisions:
+        curves[precision], step_time = benchmark(precision, args)
+        deviation = np.abs(curves[precision] - curves['fp32'])
+        report.append({'precision': precision,
+                       'step_time': step_time,
+                       'speedup': report[0]['step_time'] / step_time if report else 1.0,
+                       'first_loss': curves[precision][0],
+                       'last_loss': curves[precision][-1],
+                       'max_abs_deviation': deviation.max(),
+                       'max_rel_deviation': (deviation / np.abs(curves['fp32'])).max()})
+        print(json.dumps(report[-1]))
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'report': report, 'curves': {k: v.tolist() for k, v in curves.items()}}, f, indent=2)
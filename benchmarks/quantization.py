@@ -0,0 +1,166 @@
+# -*- coding: utf-8 -*-
+"""
+    Accuracy, latency and memory of int8 dynamic quantization against fp32
+    for greedy decoding on the cpu.
+
+    Both modes decode the same test pairs with the same seed, each in a fresh
+    subprocess. Reported per mode are the BLEU of the decoded sentences
+    against the targets, the batch-1 latency percentiles, the throughput of
+    batched decoding, the size of the saved weights and the resident memory
+    of the process after decoding. The BLEU of the int8 sentences against
+    the fp32 ones measures how often quantization changes the output.
+
+    Trained weights are used with --model-name (vocabulary artifact or data
+    files as in sample.py), random weights over a synthetic corpus otherwise,
+    which only makes the latency, memory and agreement numbers meaningful.
+
+    Usage: python -m benchmarks.quantization --model-name NAME --model C-VAE*
+"""
+import argparse
+import io
+import json
+import os
+import subprocess
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+import torch as t
+
+from model.generator import Generator
+from model.parameters import Parameters
+from model.parametersGAN import Parameters as ParametersGAN
+from model.paraphraser import Paraphraser
+from utils.batch_loader import BatchLoader, clean_str, load_batch_loader
+from utils.bleu import compute_bleu
+from utils.decoding import decode_sentences, output_embedding
+from utils.quantization import quantize
+from utils.synthetic import SyntheticCorpus
+from utils.tensorfile import load_weights
+
+
+def build(args):
+    '''
+    :return: batch_loader, fp32 model in eval mode and the test pairs
+    '''
+    if args.model_name:
+        batch_loader = load_batch_loader(args.model_name)
+    else:
+        batch_loader = BatchLoader(args.vocab_size, synthetic=SyntheticCorpus(num_words=2 * args.vocab_size, seed=args.seed))
+
+    if args.model == 'GAN':
+        model = Generator(ParametersGAN(batch_loader.max_seq_len, batch_loader.vocab_size))
+        path = 'saved_models/trained_generator_' + args.model_name
+    else:
+        model = Paraphraser(Parameters(batch_loader.max_seq_len, batch_loader.vocab_size,
+                                       use_two_path_loss=(args.model == 'C-VAE*')))
+        path = 'saved_models/trained_paraphraser_' + args.model_name
+    if args.model_name:
+        load_weights(model, path, map_location='cpu')
+
+    if getattr(batch_loader, 'data', None) is not None:
+        question1, question2 = batch_loader.pairs(1)
+    else:
+        df = pd.read_csv(batch_loader.quora_data_files[1])
+        question1, question2 = df['question1'].values, df['question2'].values
+    source = [' '.join(clean_str(s).split()) for s in question1[:args.sentences]]
+    target = [' '.join(clean_str(s).split()) for s in question2[:args.sentences]]
+    return batch_loader, model.eval(), source, target
+
+
+def rss_mb():
+    with open('/proc/self/status') as f:
+        for line in f:
+            if line.startswith('VmRSS:'):
+                return int(line.split()[1]) / 1024.
+
+
+def run(mode, args):
+    '''
+        Decode the test pairs with the fp32 or the int8 model and print
+        timings, memory and the decoded sentences as json.
+    '''
+    t.manual_seed(args.seed)
+    t.set_num_threads(args.threads)
+    batch_loader, model, source, target = build(args)
+    from_normal = args.model == 'C-VAE'
+
+    start = time.perf_counter()
+    if mode == 'int8':
+        model = quantize(model)
+    prepare_seconds = time.perf_counter() - start
+
+    buffer = io.BytesIO()
+    t.save(model.state_dict(), buffer)
+
+    embedding = output_embedding(batch_loader)
+    with t.no_grad():
+        latency = []
+        for sentence in source[:args.latency_sentences]:
+            start = time.perf_counter()
+            decode_sentences(model, batch_loader, [sentence], args.seq_len, False, 1, from_normal, embedding=embedding)
+            latency.append(time.perf_counter() - start)
+
+        t.manual_seed(args.seed)
+        start = time.perf_counter()
+        sampled = decode_sentences(model, batch_loader, source, args.seq_len, False, args.batch_size, from_normal,
+                                   embedding=embedding)
+        elapsed = time.perf_counter() - start
+
+    print(json.dumps({'mode': mode,
+                      'prepare_seconds': prepare_seconds,
+                      'p50_ms': 1000 * float(np.percentile(latency, 50)),
+                      'p95_ms': 1000 * float(np.percentile(latency, 95)),
+                      'sentences_per_second': len(source) / elapsed,
+                      'weights_mb': len(buffer.getvalue()) / 2 ** 20,
+                      'rss_mb': rss_mb(),
+                      'bleu': compute_bleu([[s.split()] for s in target], [s.split() for s in sampled])[0],
+                      'sampled': sampled}))
+
+
+def measure(mode, args):
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join([root, os.environ.get('PYTHONPATH', '')]))
+    command = [sys.executable, '-m', 'benchmarks.quantization', '--run', mode] + sys.argv[1:]
+    output = subprocess.run(command, env=env, stdout=subprocess.PIPE, check=True).stdout
+    return json.loads(output.decode('utf-8').strip().splitlines()[-1])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Quantization benchmark')
+    parser.add_argument('--model-name', default='', help='trained model, random weights if empty (default: "")')
+    parser.add_argument('--model', default='C-VAE*', choices=['C-VAE', 'C-VAE*', 'GAN'], help='model to decode with (default: C-VAE*)')
+    parser.add_argument('--sentences', type=int, default=500, help='test pairs decoded (default: 500)')
+    parser.add_argument('--latency-sentences', type=int, default=100, help='test pairs decoded one at a time (default: 100)')
+    parser.add_argument('--batch-size', type=int, default=64, help='batch size of the throughput run (default: 64)')
+    parser.add_argument('--seq-len', type=int, default=30, help='max length of the decoded sentences (default: 30)')
+    parser.add_argument('--vocab-size', type=int, default=20000, help='output vocabulary of random weights (default: 20000)')
+    parser.add_argument('--threads', type=int, default=1, help='torch threads (default: 1)')
+    parser.add_argument('--seed', type=int, default=0, help='random seed (default: 0)')
+    parser.add_argument('--run', choices=['fp32', 'int8'], help=argparse.SUPPRESS)
+    parser.add_argument('--output', default='', help='optional path of a JSON report')
+    args = parser.parse_args()
+
+    if args.run:
+        run(args.run, args)
+        sys.exit(0)
+
+    report = {mode: measure(mode, args) for mode in ['fp32', 'int8']}
+    for mode in ['fp32', 'int8']:
+        print(json.dumps({k: v for k, v in report[mode].items() if k != 'sampled'}))
+
+    fp32, int8 = report['fp32'], report['int8']
+    agreement = compute_bleu([[s.split()] for s in fp32['sampled']], [s.split() for s in int8['sampled']])[0]
+    print('------------------------------')
+    print('BLEU delta:     {:+.4f} ({:.4f} -> {:.4f})'.format(int8['bleu'] - fp32['bleu'], fp32['bleu'], int8['bleu']))
+    print('BLEU vs fp32:   {:.4f}'.format(agreement))
+    print('p50 speedup:    {:.2f}x'.format(fp32['p50_ms'] / int8['p50_ms']))
+    print('throughput:     {:.2f}x'.format(int8['sentences_per_second'] / fp32['sentences_per_second']))
+    print('weights:        {:.0f} MB -> {:.0f} MB'.format(fp32['weights_mb'], int8['weights_mb']))
+    print('memory saved:   {:.0f} MB'.format(fp32['rss_mb'] - int8['rss_mb']))
+
+    if args.output:
+        report['bleu_vs_fp32'] = agreement
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+"""
+    Greedy decoding with the eager Paraphraser against the TorchScript
+    sampler of utils.scripting, on the cpu with random weights.
+
+    Reported per backend are the batch-1 latency per sentence and per decoded
+    token, and the throughput of --threads Python threads decoding single
+    sentences at the same time with one intra-op thread each, which only
+    scales where the decoding loop runs without the GIL. Both backends
+    decode every sentence for --seq-len steps, random weights rarely emit
+    the end label.
+
+    Usage: python -m benchmarks.scripting --threads 1 2 4
+"""
+import argparse
+import copy
+import json
+import os
+import tempfile
+import threading
+import time
+
+import numpy as np
+import torch as t
+
+from model.parameters import Parameters
+from model.paraphraser import Paraphraser
+from utils.batch_loader import BatchLoader, clean_str
+from utils.decoding import greedy_decode, output_embedding
+from utils.quantization import fuse_highway
+from utils.scripting import ScriptedSampler, export_sampler
+from utils.synthetic import SyntheticCorpus
+
+
+def eager_backend(model, batch_loader):
+    embedding = output_embedding(batch_loader)
+
+    @t.no_grad()
+    def sample(sentence, seq_len):
+        source = batch_loader.embed_batch([sentence.split() + [batch_loader.end_label]])
+        return greedy_decode(model, batch_loader, t.from_numpy(source).float(), seq_len, False, embedding)
+    return sample
+
+
+def scripted_backend(sampler):
+    def sample(sentence, seq_len):
+        return sampler.sample([sentence], seq_len)
+    return sample
+
+
+def latency(sample, sentences, seq_len):
+    times = []
+    for sentence in sentences:
+        start = time.perf_counter()
+        sample(sentence, seq_len)
+        times.append(time.perf_counter() - start)
+    return times
+
+
+def throughput(sample, sentences, seq_len, threads):
+    '''
+    :return: sentences per second of threads threads sharing sentences
+    '''
+    chunks = [sentences[i::threads] for i in range(threads)]
+    workers = [threading.Thread(target=latency, args=(sample, chunk, seq_len)) for chunk in chunks]
+    start = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    return len(sentences) / (time.perf_counter() - start)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='TorchScript benchmark')
+    parser.add_argument('--sentences', type=int, default=64, help='test sentences decoded per measurement (default: 64)')
+    parser.add_argument('--seq-len', type=int, default=20, help='decoded tokens per sentence (default: 20)')
+    parser.add_argument('--threads', type=int, nargs='+', default=[1, 2, 4], help='concurrent threads (default: 1 2 4)')
+    parser.add_argument('--vocab-size', type=int, default=20000, help='output vocabulary size (default: 20000)')
+    parser.add_argument('--seed', type=int, default=0, help='random seed (default: 0)')
+    parser.add_argument('--output', default='', help='optional path of a JSON report')
+    args = parser.parse_args()
+
+    t.manual_seed(args.seed)
+    t.set_num_threads(1)
+    batch_loader = BatchLoader(args.vocab_size, synthetic=SyntheticCorpus(num_words=2 * args.vocab_size, seed=args.seed))
+    model = Paraphraser(Parameters(batch_loader.max_seq_len, batch_loader.vocab_size, use_two_path_loss=True)).eval()
+    sentences = [' '.join(clean_str(s).split()) for s in batch_loader.pairs(1)[0][:args.sentences]]
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = export_sampler(model, batch_loader, os.path.join(directory, 'sampler.pt'))
+        sampler = ScriptedSampler(path)
+
+    # the same fused highway in both backends
+    backends = {'eager': eager_backend(fuse_highway(copy.deepcopy(model)), batch_loader),
+                'script': scripted_backend(sampler)}
+
+    report = {}
+    for name, sample in backends.items():
+        latency(sample, sentences[:4], args.seq_len)
+        times = latency(sample, sentences, args.seq_len)
+        report[name] = {'p50_ms': 1000 * float(np.percentile(times, 50)),
+                        'p95_ms': 1000 * float(np.percentile(times, 95)),
+                        'ms_per_token': 1000 * float(np.mean(times)) / args.seq_len,
+                        'sentences_per_second': {threads: throughput(sample, sentences, args.seq_len, threads)
+                                                 for threads in args.threads}}
+        print(json.dumps(dict(backend=name, **report[name])))
+
+    eager, script = report['eager'], report['script']
+    print('------------------------------')
+    print('p50 speedup:    {:.2f}x'.format(eager['p50_ms'] / script['p50_ms']))
+    for threads in args.threads:
+        print('{} threads:      {:.2f}x ({:.1f} -> {:.1f} sentences/s)'.format(
+            threads, script['sentences_per_second'][threads] / eager['sentences_per_second'][threads],
+            eager['sentences_per_second'][threads], script['sentences_per_second'][threads]))
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+"""
+    Throughput and latency of the paraphrase service of utils.serving with
+    and without micro-batching, on localhost with random weights.
+
+    A server is started in this process on a free port, or on a Unix socket
+    with --unix True, and --clients threads each send --requests requests of
+    one test sentence, waiting for every answer before the next. The same
+    load runs with --max-batch 1, every request decoded alone, and with each
+    of --max-batch. Reported are the requests per second, the client side
+    latency percentiles and, from /metrics, the mean sentences per batch
+    and the largest queue depth.
+
+    With --cache-size the batchers are put behind a utils.cache.ResultCache
+    and the clients draw their sentences from --distinct ones with Zipf
+    distributed frequencies, as repeated production questions, in the
+    deterministic mean mode. The cache hit rate is reported as well.
+
+    Usage: python -m benchmarks.serving --clients 16 --max-batch 8 32
+           python -m benchmarks.serving --cache-size 10000 --distinct 50
+"""
+import argparse
+import json
+import os
+import tempfile
+import threading
+import time
+
+import numpy as np
+import torch as t
+
+from model.parameters import Parameters
+from model.paraphraser import Paraphraser
+from utils.batch_loader import BatchLoader, clean_str
+from utils.cache import CachedBatcher, ResultCache
+from utils.scripting import TokenSampler
+from utils.serving import Client, MicroBatcher, make_server
+from utils.synthetic import SyntheticCorpus
+
+
+def client_load(address, sentences, requests, options, latency):
+    client = Client(*address)
+    for i in range(requests):
+        start = time.perf_counter()
+        client.paraphrase([sentences[i % len(sentences)]], **options)
+        latency.append(time.perf_counter() - start)
+    client.close()
+
+
+def measure(sampler, max_batch, sentences, args):
+    batcher = MicroBatcher(sampler, max_batch, args.max_wait_ms / 1000., bucket=args.bucket)
+    if args.cache_size:
+        batcher = CachedBatcher(batcher, ResultCache(args.cache_size), 'benchmark')
+    with tempfile.TemporaryDirectory() as directory:
+        socket_path = os.path.join(directory, 'serve.sock') if args.unix else None
+        server = make_server(batcher, port=0, socket_path=socket_path)
+        address = (None, None, socket_path) if args.unix else server.server_address[:2]
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+
+        options = {'mode': 'mean' if args.cache_size else 'posterior', 'max_len': args.seq_len}
+        latency = []
+        clients = [threading.Thread(target=client_load,
+                                    args=(address, sentences[i::args.clients], args.requests, options, latency))
+                   for i in range(args.clients)]
+        start = time.perf_counter()
+        for client in clients:
+            client.start()
+        for client in clients:
+            client.join()
+        elapsed = time.perf_counter() - start
+
+        metrics = Client(*address).metrics()
+        server.shutdown()
+        server.server_close()
+        batcher.close()
+
+    return {'requests_per_second': len(latency) / elapsed,
+            'p50_ms': 1000 * float(np.percentile(latency, 50)),
+            'p95_ms': 1000 * float(np.percentile(latency, 95)),
+            'mean_batch': metrics['batch_rows']['mean'] if 'batch_rows' in metrics else 0.,
+            'max_queue_depth': metrics['max_queue_depth'],
+            'hit_rate': metrics['cache']['hit_rate'] if 'cache' in metrics else 0.}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Serving benchmark')
+    parser.add_argument('--clients', type=int, default=16, help='concurrent clients (default: 16)')
+    parser.add_argument('--requests', type=int, default=8, help='requests per client (default: 8)')
+    parser.add_argument('--max-batch', type=int, nargs='+', default=[8, 32], help='micro-batch sizes compared to 1 (default: 8 32)')
+    parser.add_argument('--max-wait-ms', type=float, default=5., help='longest wait for a micro-batch to fill (default: 5.0)')
+    parser.add_argument('--bucket', type=int, default=32, help='padding multiple of the sources, see utils.serving (default: 32)')
+    parser.add_argument('--seq-len', type=int, default=20, help='max length of the decoded sentences (default: 20)')
+    parser.add_argument('--vocab-size', type=int, default=20000, help='output vocabulary size (default: 20000)')
+    parser.add_argument('--cache-size', type=int, default=0, help='results cached in memory, 0 disables the cache (default: 0)')
+    parser.add_argument('--distinct', type=int, default=50, help='distinct sentences of the cached runs (default: 50)')
+    parser.add_argument('--unix', default=False, type=bool, help='serve on a Unix socket instead of localhost (default: False)')
+    parser.add_argument('--seed', type=int, default=0, help='random seed (default: 0)')
+    parser.add_argument('--output', default='', help='optional path of a JSON report')
+    args = parser.parse_args()
+
+    t.manual_seed(args.seed)
+    batch_loader = BatchLoader(args.vocab_size, synthetic=SyntheticCorpus(num_words=2 * args.vocab_size, seed=args.seed))
+    model = Paraphraser(Parameters(batch_loader.max_seq_len, batch_loader.vocab_size, use_two_path_loss=True))
+    sampler = TokenSampler.from_model(model, batch_loader)
+    sentences = [' '.join(clean_str(s).split()) for s in batch_loader.pairs(1)[0][:args.clients * args.requests]]
+    if args.cache_size:
+        # the k-th most frequent sentence has probability proportional to 1 / k
+        frequencies = 1. / np.arange(1, args.distinct + 1)
+        draws = np.random.RandomState(args.seed).choice(args.distinct, len(sentences), p=frequencies / frequencies.sum())
+        sentences = [sentences[i] for i in draws]
+    sampler.sample(sentences[:2], 2)
+
+    report = {}
+    for max_batch in [1] + args.max_batch:
+        report[max_batch] = measure(sampler, max_batch, sentences, args)
+        print(json.dumps(dict(max_batch=max_batch, **report[max_batch])))
+
+    alone = report[1]
+    print('------------------------------')
+    print('{:<10} {:>10} {:>8} {:>8} {:>8} {:>11} {:>9} {:>9}'.format(
+        'max batch', 'requests/s', 'speedup', 'p50 ms', 'p95 ms', 'mean batch', 'max queue', 'hit rate'))
+    for max_batch, result in report.items():
+        print('{:<10} {:>10.1f} {:>7.2f}x {:>8.1f} {:>8.1f} {:>11.1f} {:>9} {:>8.1%}'.format(
+            max_batch, result['requests_per_second'], result['requests_per_second'] / alone['requests_per_second'],
+            result['p50_ms'], result['p95_ms'], result['mean_batch'], result['max_queue_depth'], result['hit_rate']))
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+"""
+    Memory and start time of worker processes receiving a BatchLoader as a
+    pickled copy or as a handle of its shared memory (BatchLoader.share).
+
+    A BatchLoader is built once over a synthetic corpus. Per mode, --processes
+    spawned processes receive it the way SamplingWorker and spawned
+    data-parallel ranks do, draw --batches train batches and wait. Reported
+    are the median time from process start until the first batch and the
+    summed proportional set size (Pss) of the processes, pages of the shared
+    file count once in total.
+
+    Usage: python -m benchmarks.shared_data --pairs 140000 --processes 4
+"""
+import argparse
+import json
+import multiprocessing as mp
+import time
+
+import numpy as np
+
+from benchmarks.weight_loading import memory
+from utils.batch_loader import BatchLoader
+from utils.synthetic import SyntheticCorpus
+
+
+def run(started, batch_loader, batches, results, done):
+    '''
+        Draw batches from the received loader, report and wait for the
+        parent to measure memory.
+    '''
+    np.random.seed(0)
+    batch_loader.next_batch(32, 'train')
+    elapsed = time.time() - started
+    for _ in range(batches - 1):
+        batch_loader.next_batch(32, 'train')
+    results.put({'seconds': elapsed})
+    done.wait()
+
+
+def measure(mode, batch_loader, args):
+    context = mp.get_context('spawn')
+    results, done = context.Queue(), context.Event()
+    processes = [context.Process(target=run, args=(time.time(), batch_loader, args.batches, results, done))
+                 for _ in range(args.processes)]
+    for process in processes:
+        process.start()
+    runs = [results.get() for _ in processes]
+    usage = [memory(process.pid) for process in processes]
+    done.set()
+    for process in processes:
+        process.join()
+    return {'mode': mode,
+            'seconds': float(np.median([r['seconds'] for r in runs])),
+            'rss_mb': sum(u['rss_mb'] for u in usage),
+            'pss_mb': sum(u['pss_mb'] for u in usage)}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Shared data benchmark')
+    parser.add_argument('--pairs', type=int, default=140000, help='train pairs of the corpus (default: 140000)')
+    parser.add_argument('--num-words', type=int, default=40000, help='distinct words of the corpus (default: 40000)')
+    parser.add_argument('--processes', type=int, default=4, help='worker processes (default: 4)')
+    parser.add_argument('--batches', type=int, default=20, help='batches drawn by every worker (default: 20)')
+    parser.add_argument('--output', default='', help='optional path of a JSON report')
+    args = parser.parse_args()
+
+    corpus = SyntheticCorpus(args.pairs, num_words=args.num_words)
+    batch_loader = BatchLoader(synthetic=corpus)
+    report = [measure('copy', batch_loader, args)]
+    print(json.dumps(report[-1]))
+    report.append(measure('shared', batch_loader.share(), args))
+    print(json.dumps(report[-1]))
+
+    copy, shared = report
+    print('------------------------------')
+    print('start speedup:  {:.1f}x'.format(copy['seconds'] / shared['seconds']))
+    print('memory saved:   {:.0f} MB Pss over {} processes'.format(copy['pss_mb'] - shared['pss_mb'], args.processes))
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+"""
+    Latency of greedy decoding with a vocabulary shortlist against the share
+    of sentences decoded exactly as with the full vocabulary, on the cpu.
+
+    Every configuration of --top-n and --fallback decodes the same test
+    sentences from the same z as the full projection. Reported per
+    configuration are the batch-1 latency percentiles, the sentences per
+    second with --batch-size, the mean number of candidates of a batch, the
+    share of decoder steps that fell back to the full vocabulary and the
+    share of sentences identical to full decoding.
+
+    Trained weights are used with --model-name (vocabulary artifact or data
+    files as in sample.py, alignments of python -m utils.shortlist if saved),
+    random weights over a synthetic corpus otherwise, which rarely pick
+    frequent or source words and so only make the latency numbers
+    meaningful.
+
+    Usage: python -m benchmarks.shortlist --model-name NAME --top-n 500 2000 --fallback 0 0.5
+"""
+import argparse
+import json
+import time
+
+import numpy as np
+import torch as t
+
+from model.parameters import Parameters
+from model.paraphraser import Paraphraser
+from utils.batch_loader import BatchLoader, clean_str, load_batch_loader
+from utils.decoding import greedy_decode, output_embedding
+from utils.distillation import load_sizes
+from utils.shortlist import Shortlist, load_alignments
+from utils.synthetic import SyntheticCorpus
+from utils.tensorfile import load_weights
+
+
+def build(args):
+    '''
+    :return: batch_loader, model in eval mode and the test sources
+    '''
+    if args.model_name:
+        batch_loader = load_batch_loader(args.model_name)
+        path = 'saved_models/trained_paraphraser_' + args.model_name
+        model = Paraphraser(Parameters(batch_loader.max_seq_len, batch_loader.vocab_size, True, **load_sizes(path)))
+        load_weights(model, path, map_location='cpu')
+    else:
+        batch_loader = BatchLoader(args.vocab_size, synthetic=SyntheticCorpus(num_words=2 * args.vocab_size, seed=args.seed))
+        model = Paraphraser(Parameters(batch_loader.max_seq_len, batch_loader.vocab_size, True))
+
+    if getattr(batch_loader, 'data', None) is not None:
+        sources = batch_loader.pairs(1)[0]
+    else:
+        import pandas as pd
+        sources = pd.read_csv(batch_loader.quora_data_files[1])['question1'].values
+    return batch_loader, model.eval(), [clean_str(s).split() for s in sources[:args.sentences]]
+
+
+def decode(model, batch_loader, embedding, tokens, noise, args, shortlist, batch_size):
+    '''
+    :return: decoded sentences, seconds of every batch and candidates of every batch
+    '''
+    result, times, candidates = [], [], []
+    with t.no_grad():
+        for i in range(0, len(tokens), batch_size):
+            batch = tokens[i:i + batch_size]
+            start = time.perf_counter()
+            source = t.from_numpy(batch_loader.embed_batch([s + [batch_loader.end_label] for s in batch])).float()
+            projection = None if shortlist is None else shortlist.projection(model.decoder.fc, batch)
+            result += greedy_decode(model, batch_loader, source, args.seq_len, False, embedding,
+                                    noise=noise[i:i + batch_size], shortlist=projection)
+            times.append(time.perf_counter() - start)
+            if projection is not None:
+                candidates.append(len(projection.candidates))
+    return result, times, candidates
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Vocabulary shortlist benchmark')
+    parser.add_argument('--model-name', default='', help='trained model, random weights if empty (default: "")')
+    parser.add_argument('--top-n', type=int, nargs='+', default=[500, 2000], help='frequent words of the shortlist (default: 500 2000)')
+    parser.add_argument('--fallback', type=float, nargs='+', default=[0., 0.5], help='fallback probabilities (default: 0 0.5)')
+    parser.add_argument('--sentences', type=int, default=200, help='test sentences decoded (default: 200)')
+    parser.add_argument('--batch-size', type=int, default=32, help='batch size of the throughput run (default: 32)')
+    parser.add_argument('--seq-len', type=int, default=20, help='max length of the decoded sentences (default: 20)')
+    parser.add_argument('--vocab-size', type=int, default=20000, help='output vocabulary of random weights (default: 20000)')
+    parser.add_argument('--threads', type=int, default=1, help='torch threads (default: 1)')
+    parser.add_argument('--seed', type=int, default=0, help='random seed (default: 0)')
+    parser.add_argument('--output', default='', help='optional path of a JSON report')
+    args = parser.parse_args()
+
+    t.manual_seed(args.seed)
+    t.set_num_threads(args.threads)
+    batch_loader, model, tokens = build(args)
+    embedding = output_embedding(batch_loader)
+    alignments = load_alignments(args.model_name) if args.model_name else None
+    noise = np.random.RandomState(args.seed).randn(len(tokens), model.params.latent_variable_size).astype(np.float32)
+
+    configurations = [('full', None)] + [('top{}_fallback{:g}'.format(n, f), (n, f))
+                                         for n in args.top_n for f in args.fallback]
+    report = {}
+    for name, configuration in configurations:
+        shortlist = None if configuration is None else Shortlist(batch_loader, configuration[0], alignments, configuration[1])
+        sampled, latency, _ = decode(model, batch_loader, embedding, tokens, noise, args, shortlist, 1)
+        steps, fallbacks = (shortlist.steps, shortlist.fallbacks) if shortlist is not None else (0, 0)
+        _, times, candidates = decode(model, batch_loader, embedding, tokens, noise, args, shortlist, args.batch_size)
+
+        report[name] = {'p50_ms': 1000 * float(np.percentile(latency, 50)),
+                        'p95_ms': 1000 * float(np.percentile(latency, 95)),
+                        'sentences_per_second': len(tokens) / sum(times),
+                        'candidates': float(np.mean(candidates)) if candidates else batch_loader.vocab_size,
+                        'fallback_rate': fallbacks / steps if steps else 0.,
+                        'exact_match': float(np.mean([s == f for s, f in zip(sampled, report['full']['sampled'])]))
+                                       if 'full' in report else 1.,
+                        'sampled': sampled}
+        print(json.dumps(dict(configuration=name, **{k: v for k, v in report[name].items() if k != 'sampled'})))
+
+    full = report['full']
+    print('------------------------------')
+    print('{:<24} {:>10} {:>8} {:>9} {:>10} {:>9} {:>11}'.format(
+        'configuration', 'candidates', 'p50 ms', 'speedup', 'sent/s', 'fallback', 'exact match'))
+    for name, result in report.items():
+        print('{:<24} {:>10.0f} {:>8.2f} {:>8.2f}x {:>10.1f} {:>8.1%} {:>10.1%}'.format(
+            name, result['candidates'], result['p50_ms'], full['p50_ms'] / result['p50_ms'],
+            result['sentences_per_second'], result['fallback_rate'], result['exact_match']))
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
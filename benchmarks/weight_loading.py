@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+"""
+    Load time and memory of Paraphraser weights, torch.load'ed or mapped
+    from a tensor file.
+
+    Random weights are saved as a state_dict and converted to a tensor file.
+    Per mode, --processes processes load them at the same time and run one
+    forward pass, which touches every weight. Reported are the median load
+    time and the summed proportional set size (Pss) of the processes, pages
+    of the mapped file shared through the page cache count once in total.
+
+    Usage: python -m benchmarks.weight_loading --processes 4
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+import torch as t
+
+from model.parameters import Parameters
+from model.paraphraser import Paraphraser
+from utils.tensorfile import SUFFIX, convert, load_weights
+
+
+def build(args):
+    return Paraphraser(Parameters(args.seq_len, args.vocab_size, use_two_path_loss=True))
+
+
+def run(mode, path, args):
+    '''
+        Load the weights, touch them, report and wait for the parent to
+        measure memory.
+    '''
+    t.set_num_threads(1)
+    paraphraser = build(args)
+    if mode == 'torch':
+        start = time.perf_counter()
+        paraphraser.load_state_dict(t.load(path, map_location='cpu'))
+    else:
+        start = time.perf_counter()
+        load_weights(paraphraser, path)
+    elapsed = time.perf_counter() - start
+
+    x = t.randn(1, args.seq_len, 300)
+    with t.no_grad():
+        paraphraser(0., [x, x], [x, x], None, None, False)
+    print(json.dumps({'load_seconds': elapsed}), flush=True)
+    sys.stdin.readline()
+
+
+def memory(pid):
+    values = {}
+    with open('/proc/{}/smaps_rollup'.format(pid)) as f:
+        for line in f:
+            parts = line.split()
+            if parts[0] in ('Rss:', 'Pss:'):
+                values[parts[0][:-1].lower() + '_mb'] = int(parts[1]) / 1024.
+    return values
+
+
+def measure(mode, path, args):
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join([root, os.environ.get('PYTHONPATH', '')]))
+    command = [sys.executable, '-m', 'benchmarks.weight_loading', '--run', mode, path,
+               '--seq-len', str(args.seq_len), '--vocab-size', str(args.vocab_size)]
+    processes = [subprocess.Popen(command, env=env, stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+                 for _ in range(args.processes)]
+    results = []
+    for process in processes:
+        result = json.loads(process.stdout.readline().decode('utf-8'))
+        result.update(memory(process.pid))
+        results.append(result)
+    for process in processes:
+        process.communicate(b'\n')
+    return {'mode': mode,
+            'load_seconds': float(np.median([r['load_seconds'] for r in results])),
+            'rss_mb': sum(r['rss_mb'] for r in results),
+            'pss_mb': sum(r['pss_mb'] for r in results)}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Weight loading benchmark')
+    parser.add_argument('--processes', type=int, default=4, help='processes loading at the same time (default: 4)')
+    parser.add_argument('--seq-len', type=int, default=20, help='sentence length (default: 20)')
+    parser.add_argument('--vocab-size', type=int, default=20000, help='output vocabulary size (default: 20000)')
+    parser.add_argument('--run', nargs=2, metavar=('MODE', 'PATH'), help=argparse.SUPPRESS)
+    parser.add_argument('--output', default='', help='optional path of a JSON report')
+    args = parser.parse_args()
+
+    if args.run:
+        run(args.run[0], args.run[1], args)
+        sys.exit(0)
+
+    report = []
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'trained_paraphraser_benchmark')
+        t.save(build(args).state_dict(), path)
+        convert(path)
+        print('state_dict: {:.0f} MB, tensor file: {:.0f} MB'.format(
+            os.path.getsize(path) / 2 ** 20, os.path.getsize(path + SUFFIX) / 2 ** 20))
+        for mode in ['torch', 'mapped']:
+            report.append(measure(mode, path, args))
+            print(json.dumps(report[-1]))
+
+    torch_load, mapped = report
+    print('------------------------------')
+    print('load speedup:   {:.1f}x'.format(torch_load['load_seconds'] / mapped['load_seconds']))
+    print('memory saved:   {:.0f} MB Pss over {} processes'.format(torch_load['pss_mb'] - mapped['pss_mb'], args.processes))
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
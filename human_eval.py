@@ -10,7 +10,8 @@ import json
 import random
 
 from sample import sample_with_input, sample_with_beam
-from utils.batch_loader import BatchLoader, clean_str
+from utils.batch_loader import clean_str, load_batch_loader
+from utils.tensorfile import load_weights
 from model.paraphraser import Paraphraser
 from model.generator import Generator
 from synonym_paraphraser import SynonymParaphraser
@@ -54,11 +55,11 @@ def main():
 
 
     # Sample from Guptas original model
-    batch_loader = BatchLoader()
+    batch_loader = load_batch_loader('ori_32')
     from model.parameters import Parameters
     parameters = Parameters(batch_loader.max_seq_len, batch_loader.vocab_size)
     paraphraser = Paraphraser(parameters)
-    paraphraser.load_state_dict(t.load('saved_models/trained_paraphraser_ori_32', map_location=t.device('cpu')))
+    load_weights(paraphraser, 'saved_models/trained_paraphraser_ori_32', map_location=t.device('cpu'))
 
     samples_ori, target, source_ori = sample_with_input(batch_loader, paraphraser, args,
                                 decoder_only=True,
@@ -68,10 +69,10 @@ def main():
     ori_items = generate_items(source_ori, samples_ori[0], 'ori')
 
     # Sample from Guptas model with two-path-loss
-    batch_loader = BatchLoader()
+    batch_loader = load_batch_loader('tpl_16_32')
     parameters = Parameters(batch_loader.max_seq_len, batch_loader.vocab_size, use_two_path_loss=True)
     paraphraser = Paraphraser(parameters)
-    paraphraser.load_state_dict(t.load('saved_models/trained_paraphraser_tpl_16_32', map_location=t.device('cpu')))
+    load_weights(paraphraser, 'saved_models/trained_paraphraser_tpl_16_32', map_location=t.device('cpu'))
 
     samples_tpl, target, source_tpl = sample_with_input(batch_loader, paraphraser, args,
                                 decoder_only=False,
@@ -79,11 +80,11 @@ def main():
     tpl_items = generate_items(source_tpl, samples_tpl[0], 'tpl')
 
     # Sample from GAN model
-    batch_loader = BatchLoader()
+    batch_loader = load_batch_loader('gan_140k')
     from model.parametersGAN import Parameters
     parameters = Parameters(batch_loader.max_seq_len, batch_loader.vocab_size)
     paraphraser = Generator(parameters)
-    paraphraser.load_state_dict(t.load('saved_models/trained_generator_gan_140k', map_location=t.device('cpu')))
+    load_weights(paraphraser, 'saved_models/trained_generator_gan_140k', map_location=t.device('cpu'))
     samples_gan, target, source_gan = sample_with_input(batch_loader, paraphraser, args,
                                 decoder_only=False,
                                 file_name='datasets/human_test.csv')
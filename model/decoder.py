@@ -3,6 +3,9 @@ import torch.nn as nn
 import torch.nn.functional as F
 from torch.cuda import amp
 
+from utils.recompute import recompute
+from utils.telemetry import telemetry
+
 class Decoder(nn.Module):
     def __init__(self, params, highway):
         super(Decoder, self).__init__()
@@ -28,6 +31,11 @@ class Decoder(nn.Module):
         self.fc = nn.Linear(self.params.decoder_rnn_size, self.params.vocab_size)
 
     def build_initial_state(self, input):
+        if self.params.checkpoint_encoder and self.training and t.is_grad_enabled():
+            return recompute(self.initial_state, input)
+        return self.initial_state(input)
+
+    def initial_state(self, input):
         [batch_size, seq_len, embed_size] = input.size()
         input = input.view(-1, embed_size)
         input = self.hw1(input)
@@ -81,11 +89,39 @@ class Decoder(nn.Module):
         z = t.cat([z] * seq_len, 1).view(batch_size, seq_len, self.params.latent_variable_size)
         decoder_input = t.cat([decoder_input, z], 2)
 
+        if self.params.checkpoint_decoder and self.training and t.is_grad_enabled():
+            # only the logits are kept, rnn activations are recomputed in backward
+            result, h_state, c_state = recompute(self.decode, decoder_input, *initial_state)
+        else:
+            result, h_state, c_state = self.decode(decoder_input, *initial_state)
+
+        return result, (h_state, c_state)
+
+    def rnn_output(self, decoder_input, z, initial_state):
+        """
+            Decoder rnn without dropout and projection, e.g. to project onto
+            a shortlist of the vocabulary, see utils.shortlist.
+
+        :return: rnn output with shape of [batch_size, seq_len, decoder_rnn_size]
+                 final rnn state with shape of [num_layers, batch_size, decoder_rnn_size]
+        """
+        [batch_size, seq_len, _] = decoder_input.size()
+        z = z.unsqueeze(1).expand(batch_size, seq_len, self.params.latent_variable_size)
+
+        with telemetry.timer('lstm'):
+            rnn_out, final_state = self.decoding_rnn(t.cat([decoder_input, z], 2), initial_state)
+        return rnn_out, final_state
+
+    def decode(self, decoder_input, h_state, c_state):
+        [batch_size, seq_len, _] = decoder_input.size()
+
         # with amp.autocast():
-        rnn_out, final_state = self.decoding_rnn(decoder_input, initial_state)
+        with telemetry.timer('lstm'):
+            rnn_out, (h_state, c_state) = self.decoding_rnn(decoder_input, (h_state, c_state))
 
-        rnn_out = rnn_out.contiguous().view(-1, self.params.decoder_rnn_size)
-        result = self.fc(rnn_out)
-        result = result.view(batch_size, seq_len, self.params.vocab_size)
+        with telemetry.timer('projection'):
+            rnn_out = rnn_out.contiguous().view(-1, self.params.decoder_rnn_size)
+            result = self.fc(rnn_out)
+            result = result.view(batch_size, seq_len, self.params.vocab_size)
 
-        return result, final_state
+        return result, h_state, c_state
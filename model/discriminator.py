@@ -1,5 +1,6 @@
 import torch as t
 import torch.nn as nn
+import torch.nn.functional as F
 from torch.cuda import amp
 
 class Discriminator(nn.Module):
@@ -44,3 +45,57 @@ class Discriminator(nn.Module):
 
     def learnable_parameters(self):
         return [p for p in self.parameters() if p.requires_grad]
+
+
+class CNNDiscriminator(nn.Module):
+    """
+        Convolutional text classifier with max-over-time pooling (Kim, 2014).
+        Much cheaper than the bidirectional LSTM when scoring rollouts.
+    """
+
+    def __init__(self, params):
+        super(CNNDiscriminator, self).__init__()
+        self.params = params
+        self.convs = nn.ModuleList([nn.Conv1d(self.params.word_embed_size,
+                                              self.params.discriminator_num_filters,
+                                              kernel_size)
+                                    for kernel_size in self.params.discriminator_kernel_sizes])
+        num_features = self.params.discriminator_num_filters * len(self.params.discriminator_kernel_sizes)
+        self.dropout = nn.Dropout(0.3)
+        self.fc = nn.Linear(num_features, num_features)
+        self.relu = nn.ReLU()
+        self.out = nn.Linear(num_features, 1)
+
+    def forward(self, sentences):
+        """
+        :param sentences: [batch_size, seq_len, embed_size] tensor
+        :return: unnormalized logits with shape of [batch_size]
+        """
+        # (batch, embed_size, seq_len)
+        input = sentences.transpose(1, 2)
+
+        # sequences shorter than the widest filter are zero padded
+        min_len = max(self.params.discriminator_kernel_sizes)
+        if input.size(2) < min_len:
+            input = F.pad(input, (0, min_len - input.size(2)))
+
+        features = [t.max(F.relu(conv(input)), dim=2)[0] for conv in self.convs]
+        features = self.dropout(t.cat(features, 1))
+
+        output = self.fc(features)
+        output = self.relu(output)
+        output = self.out(output)
+        output = t.squeeze(output, 1)
+
+        return output
+
+    def learnable_parameters(self):
+        return [p for p in self.parameters() if p.requires_grad]
+
+
+def build_discriminator(params):
+    if params.discriminator_type == 'lstm':
+        return Discriminator(params)
+    if params.discriminator_type == 'cnn':
+        return CNNDiscriminator(params)
+    raise ValueError('Unknown discriminator type: {}'.format(params.discriminator_type))
@@ -1,8 +1,12 @@
+import functools
+
 import torch as t
 import torch.nn as nn
 import torch.nn.functional as F
 from torch.cuda import amp
 
+from utils.recompute import recompute
+
 class Encoder(nn.Module):
     def __init__(self, params, highway):
         super(Encoder, self).__init__()
@@ -20,6 +24,24 @@ class Encoder(nn.Module):
         self.context_to_mu = nn.Linear(self.params.encoder_rnn_size * 4, self.params.latent_variable_size)
         self.context_to_logvar = nn.Linear(self.params.encoder_rnn_size * 4, self.params.latent_variable_size)
 
+    def encode(self, rnn, input, *state):
+        '''
+            highway and rnn over one embedded sentence, state is the
+            optional (h, c) initial state and the final one is returned
+        '''
+        [batch_size, seq_len, embed_size] = input.size()
+        input = input.view(-1, embed_size)
+        input = self.hw1(input)
+        input = input.view(batch_size, seq_len, embed_size)
+        # with amp.autocast():
+        _, state = rnn(input, state if state else None)
+        return state
+
+    def encode_branch(self, i, input, state):
+        if self.params.checkpoint_encoder and self.training and t.is_grad_enabled():
+            return recompute(functools.partial(self.encode, self.rnns[i]), input, *state)
+        return self.encode(self.rnns[i], input, *state)
+
     def forward(self, input_source, input_target):
         """
         :param input_source: [batch_size, seq_len, embed_size] tensor
@@ -29,26 +51,16 @@ class Encoder(nn.Module):
         """
 
 
-        state = None
+        state = ()
+        batch_size = input_source.size(0)
         if input_target==None:
             # Second path through the network
-            [batch_size, seq_len, embed_size] = input_source.size()
-
-            input_source = input_source.view(-1, embed_size)
-            input_source = self.hw1(input_source)
-            input_source = input_source.view(batch_size, seq_len, embed_size)
-
-            _, state = self.rnns[0](input_source, state)
+            state = self.encode_branch(0, input_source, state)
 
         else:
             # (num_layers * num_directions, batch, hidden_size)
             for i, input in enumerate([input_source , input_target]):
-                [batch_size, seq_len, embed_size] = input.size()
-                input = input.view(-1, embed_size)
-                input = self.hw1(input)
-                input = input.view(batch_size, seq_len, embed_size)
-                # with amp.autocast():
-                _, state = self.rnns[i](input, state)
+                state = self.encode_branch(i, input, state)
 
         [h_state, c_state] = state
         h_state = h_state.view(self.params.encoder_num_layers, 2, batch_size, self.params.encoder_rnn_size)[-1]
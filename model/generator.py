@@ -9,6 +9,8 @@ from torch.cuda import amp
 from .decoder import Decoder
 from .encoder import Encoder
 from .highway import Highway
+from utils.profiler import profiler
+from utils.telemetry import telemetry
 
 class Generator(nn.Module):
     def __init__(self, params):
@@ -40,7 +42,8 @@ class Generator(nn.Module):
             '''
             [batch_size, _, _] = encoder_input[0].size()
 
-            mu, logvar = self.encoder(encoder_input[0], encoder_input[1])
+            with profiler.timer('encoder'):
+                mu, logvar = self.encoder(encoder_input[0], encoder_input[1])
             std = t.exp(0.5 * logvar)
 
             z1 = Variable(t.randn([batch_size, self.params.latent_variable_size]))
@@ -48,9 +51,12 @@ class Generator(nn.Module):
                 z1 = z1.cuda()
             z1 = z1 * std + mu
 
-            kld = (-0.5 * t.sum(logvar - t.pow(mu, 2) - t.exp(logvar) + 1, 1)).mean().squeeze()
+            # in fp32 under autocast as well
+            mu32, logvar32 = mu.float(), logvar.float()
+            kld = (-0.5 * t.sum(logvar32 - t.pow(mu32, 2) - t.exp(logvar32) + 1, 1)).mean().squeeze()
 
-            mu, logvar = self.encoder(encoder_input[0], None)
+            with profiler.timer('encoder'):
+                mu, logvar = self.encoder(encoder_input[0], None)
             std = t.exp(0.5 * logvar)
 
             z2 = Variable(t.randn([batch_size, self.params.latent_variable_size]))
@@ -60,17 +66,19 @@ class Generator(nn.Module):
         else:
             kld = None
 
-        out1, final_state = self.decoder(decoder_input[0], decoder_input[1],
-                                        z1, drop_prob, initial_state)
+        with profiler.timer('decoder'):
+            out1, final_state = self.decoder(decoder_input[0], decoder_input[1],
+                                            z1, drop_prob, initial_state)
 
-        out2, _ = self.decoder(decoder_input[0], decoder_input[1],
-                                        z2, drop_prob, initial_state)
+            out2, _ = self.decoder(decoder_input[0], decoder_input[1],
+                                            z2, drop_prob, initial_state)
 
         return (out1, out2), final_state, kld
 
     def learnable_parameters(self):
         return [p for p in self.parameters() if p.requires_grad]
 
+    @telemetry.instrument
     def sample_with_input(self, batch_loader, seq_len, use_cuda, input, ml=True):
         [encoder_input_source, encoder_input_target, decoder_input_source, _, _] = input
 
@@ -79,7 +87,8 @@ class Generator(nn.Module):
         # encode
         [batch_size, _, _] = encoder_input[0].size()
 
-        mu, logvar = self.encoder(encoder_input[0], None)
+        with telemetry.timer('encode'):
+            mu, logvar = self.encoder(encoder_input[0], None)
         std = t.exp(0.5 * logvar)
 
 
@@ -88,29 +97,39 @@ class Generator(nn.Module):
             z = z.cuda()
         z = z * std + mu
 
-        initial_state = self.decoder.build_initial_state(decoder_input_source)
+        with telemetry.timer('encode'):
+            initial_state = self.decoder.build_initial_state(decoder_input_source)
         decoder_input = batch_loader.get_raw_input_from_sentences([batch_loader.go_label])
 
         result = ''
+        stop = seq_len
         for i in range(seq_len):
             if use_cuda:
-                decoder_input = decoder_input.cuda()
+                with telemetry.timer('transfer'):
+                    decoder_input = decoder_input.cuda()
 
             logits, initial_state = self.decoder(None, decoder_input, z, 0.0, initial_state)
-            logits = logits.view(-1, self.params.vocab_size)
-            prediction = F.softmax(logits, dim=-1)
+            telemetry.step()
+            with telemetry.timer('projection'):
+                logits = logits.view(-1, self.params.vocab_size)
+                prediction = F.softmax(logits, dim=-1)
+            with telemetry.timer('transfer'):
+                prediction = prediction.data.cpu().numpy()[-1]
             if ml:
-                word = batch_loader.likely_word_from_distribution(prediction.data.cpu().numpy()[-1])
+                word = batch_loader.likely_word_from_distribution(prediction)
             else:
-                word = batch_loader.sample_word_from_distribution(prediction.data.cpu().numpy()[-1])
+                word = batch_loader.sample_word_from_distribution(prediction)
             if word == batch_loader.end_label:
+                stop = i
                 break
             result += ' ' + word
 
             decoder_input = batch_loader.get_raw_input_from_sentences([word])
 
+        telemetry.finish(len(result.split()), stop)
         return result
 
+    @telemetry.instrument
     def sample(self, given_seq, seq_len, z, initial_state, use_cuda, batch_loader, encoder_input_source=None):
 
         if initial_state is None:
@@ -131,19 +150,25 @@ class Generator(nn.Module):
         result = list(given_seq[:, :-1, :].chunk(given_len, 1))
         decoder_input = given_seq[:, -1, :].unsqueeze(1)
 
+        tokens, stop = 0, seq_len
         for i in range(given_len, seq_len):
             if use_cuda:
-                decoder_input = decoder_input.cuda()
+                with telemetry.timer('transfer'):
+                    decoder_input = decoder_input.cuda()
 
             logits, initial_state = self.decoder(None, decoder_input, z, 0.0, initial_state)
-            logits = logits.view(-1, self.params.vocab_size)
+            telemetry.step()
 
             # Save next inital state for next part of rollout...
             if i == given_len:
                 next_initial_state = initial_state
 
-            prediction = F.softmax(logits, dim=-1)
-            words = [batch_loader.likely_word_from_distribution(p) for p in prediction.data.cpu().numpy()]
+            with telemetry.timer('projection'):
+                logits = logits.float().view(-1, self.params.vocab_size)
+                prediction = F.softmax(logits, dim=-1)
+            with telemetry.timer('transfer'):
+                prediction = prediction.data.cpu().numpy()
+            words = [batch_loader.likely_word_from_distribution(p) for p in prediction]
 
             all_end_labels = True
             for word in words:
@@ -152,16 +177,20 @@ class Generator(nn.Module):
                     break
             if all_end_labels:
                 # print(f'Words last generated: {words}')
+                stop = i
                 break
+            tokens += sum(word != batch_loader.end_label for word in words)
 
             decoder_input = batch_loader.get_raw_input_from_sentences(words)
 
             if use_cuda:
-                decoder_input = decoder_input.cuda()
+                with telemetry.timer('transfer'):
+                    decoder_input = decoder_input.cuda()
             result.append(decoder_input)
 
         result = t.cat(result, dim=1)
 
+        telemetry.finish(tokens, stop)
         return result, next_initial_state
 
 
@@ -206,6 +235,7 @@ class Generator(nn.Module):
 
         return result, logits
 
+    @telemetry.instrument
     def beam_search(self, batch_loader, seq_len, use_cuda, input, k, sample_from_normal):
         [encoder_input_source, _, decoder_input_source, _, _] = input
 
@@ -217,24 +247,30 @@ class Generator(nn.Module):
             z = z.cuda()
 
         if not sample_from_normal:
-            mu, logvar = self.encoder(encoder_input_source, None)
+            with telemetry.timer('encode'):
+                mu, logvar = self.encoder(encoder_input_source, None)
             std = t.exp(0.5 * logvar)
             z = z * std + mu
 
-        initial_state = self.decoder.build_initial_state(decoder_input_source)
+        with telemetry.timer('encode'):
+            initial_state = self.decoder.build_initial_state(decoder_input_source)
         decoder_input = batch_loader.get_raw_input_from_sentences([batch_loader.go_label])
         if use_cuda:
-            decoder_input = decoder_input.cuda()
+            with telemetry.timer('transfer'):
+                decoder_input = decoder_input.cuda()
 
         logits, initial_state = self.decoder(None, decoder_input, z, 0.0, initial_state)
-        logits = logits.view(-1, self.params.vocab_size)
-        predictions = F.softmax(logits, dim=-1)
+        telemetry.step()
+        with telemetry.timer('projection'):
+            logits = logits.view(-1, self.params.vocab_size)
+            predictions = F.softmax(logits, dim=-1)
 
         # sequences = [[list(), 0.0]]
         sequences = [[list(), 0.0, initial_state, decoder_input, False]]
 
         # walk over each step in sequence
-        for seq in range(seq_len):
+        stop = seq_len
+        for position in range(seq_len):
             all_candidates = list()
             # expand each current candidate
             for i in range(len(sequences)):
@@ -243,11 +279,16 @@ class Generator(nn.Module):
                     all_candidates.append(sequences[i])
                     continue
                 if use_cuda:
-                    decoder_input = decoder_input.cuda()
+                    with telemetry.timer('transfer'):
+                        decoder_input = decoder_input.cuda()
 
                 logits, initial_state = self.decoder(None, decoder_input, z, 0.0, initial_state)
-                logits = logits.view(-1, self.params.vocab_size)
-                prediction = F.softmax(logits, dim=-1).data.cpu().numpy()[-1]
+                telemetry.step()
+                with telemetry.timer('projection'):
+                    logits = logits.view(-1, self.params.vocab_size)
+                    prediction = F.softmax(logits, dim=-1)
+                with telemetry.timer('transfer'):
+                    prediction = prediction.data.cpu().numpy()[-1]
                 for j in range(prediction.shape[0]):
                     word = batch_loader.get_word_by_idx(j)
                     if word == batch_loader.unk_label:
@@ -262,9 +303,12 @@ class Generator(nn.Module):
             ordered = sorted(all_candidates, key=lambda tup:tup[1])
             # select k best
             sequences = ordered[:k]
+            if stop == seq_len and all(sequence[4] for sequence in sequences):
+                stop = position
         results = []
         for sequence in sequences:
             results.append(' '.join(sequence[0]))
+        telemetry.finish(len(sequences[0][0]), stop)
         return results
 
 
@@ -34,3 +34,41 @@ class Highway(nn.Module):
             x = gate * nonlinear + (1 - gate) * linear
 
         return x
+
+
+class FusedHighway(nn.Module):
+    def __init__(self, highway):
+        '''
+            Highway with the gate, nonlinear and linear transformations of a
+            layer in one [3 * size, size] Linear, one matrix multiplication
+            per layer instead of three. Computes the same function as
+            highway, e.g. for inference after quantization, and can be
+            compiled with torch.jit.script.
+        '''
+        super(FusedHighway, self).__init__()
+
+        size = highway.gate[0].in_features
+        self.num_layers = highway.num_layers
+        self.layers = nn.ModuleList([nn.Linear(size, 3 * size) for _ in range(self.num_layers)])
+        self.f = highway.f
+
+        with t.no_grad():
+            for layer in range(self.num_layers):
+                parts = [highway.gate[layer], highway.nonlinear[layer], highway.linear[layer]]
+                self.layers[layer].weight.copy_(t.cat([p.weight for p in parts], 0))
+                self.layers[layer].bias.copy_(t.cat([p.bias for p in parts], 0))
+
+    def forward(self, x):
+        """
+        :param x: tensor with shape of [batch_size, size]
+
+        :return: tensor with shape of [batch_size, size]
+        """
+
+        for layer in self.layers:
+            gate, nonlinear, linear = layer(x).chunk(3, dim=-1)
+            gate = t.sigmoid(gate)
+
+            x = gate * self.f(nonlinear) + (1 - gate) * linear
+
+        return x
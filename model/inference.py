@@ -0,0 +1,246 @@
+from typing import List, Tuple
+
+import torch as t
+import torch.nn as nn
+import torch.nn.functional as F
+
+from .highway import FusedHighway
+
+
+def fused_highway(model):
+    '''
+        FusedHighway of model, the one of a quantized model is reused.
+    '''
+    if isinstance(model.highway, FusedHighway):
+        return model.highway
+    return FusedHighway(model.highway)
+
+
+class SourceEncoder(nn.Module):
+    def __init__(self, encoder, highway):
+        '''
+            Second path of Encoder, the source sentence alone to the
+            parameters of z, for inference and torch.jit.script.
+        '''
+        super(SourceEncoder, self).__init__()
+
+        self.hw1 = highway
+        self.rnn = encoder.rnns[0]
+        self.context_to_mu = encoder.context_to_mu
+        self.context_to_logvar = encoder.context_to_logvar
+        self.num_layers = encoder.params.encoder_num_layers
+        self.rnn_size = encoder.params.encoder_rnn_size
+
+    def forward(self, input):
+        """
+        :param input: embedded source with shape of [batch_size, seq_len, embed_size]
+
+        :return: mu and logvar with shape of [batch_size, latent_variable_size]
+        """
+        batch_size, seq_len, embed_size = input.size()
+        input = self.hw1(input.view(-1, embed_size)).view(batch_size, seq_len, embed_size)
+
+        _, (h_state, c_state) = self.rnn(input)
+        h_state = h_state.view(self.num_layers, 2, batch_size, self.rnn_size)[-1]
+        c_state = c_state.view(self.num_layers, 2, batch_size, self.rnn_size)[-1]
+        h_state = h_state.permute(1, 0, 2).contiguous().view(batch_size, -1)
+        c_state = c_state.permute(1, 0, 2).contiguous().view(batch_size, -1)
+        final_state = t.cat([h_state, c_state], 1)
+
+        return self.context_to_mu(final_state), self.context_to_logvar(final_state)
+
+
+class InitialState(nn.Module):
+    def __init__(self, decoder, highway):
+        '''
+            Decoder.initial_state for inference and torch.jit.script.
+        '''
+        super(InitialState, self).__init__()
+
+        self.hw1 = highway
+        self.encoding_rnn = decoder.encoding_rnn
+        self.h_to_initial_state = decoder.h_to_initial_state
+        self.c_to_initial_state = decoder.c_to_initial_state
+        self.encoder_num_layers = decoder.params.encoder_num_layers
+        self.encoder_rnn_size = decoder.params.encoder_rnn_size
+        self.decoder_num_layers = decoder.params.decoder_num_layers
+        self.decoder_rnn_size = decoder.params.decoder_rnn_size
+
+    def forward(self, input):
+        """
+        :param input: embedded source with shape of [batch_size, seq_len, embed_size]
+
+        :return: initial h and c of the decoder rnn with shape of
+                 [decoder_num_layers, batch_size, decoder_rnn_size]
+        """
+        batch_size, seq_len, embed_size = input.size()
+        input = self.hw1(input.view(-1, embed_size)).view(batch_size, seq_len, embed_size)
+
+        _, (h_state, c_state) = self.encoding_rnn(input)
+        h_state = h_state.view(self.encoder_num_layers, 2, batch_size, self.encoder_rnn_size)[-1]
+        c_state = c_state.view(self.encoder_num_layers, 2, batch_size, self.encoder_rnn_size)[-1]
+        h_state = h_state.permute(1, 0, 2).contiguous().view(batch_size, -1)
+        c_state = c_state.permute(1, 0, 2).contiguous().view(batch_size, -1)
+
+        h_initial = self.h_to_initial_state(h_state).view(batch_size,
+            self.decoder_num_layers, self.decoder_rnn_size).permute(1, 0, 2).contiguous()
+        c_initial = self.c_to_initial_state(c_state).view(batch_size,
+            self.decoder_num_layers, self.decoder_rnn_size).permute(1, 0, 2).contiguous()
+
+        return h_initial, c_initial
+
+
+class DecoderStep(nn.Module):
+    def __init__(self, decoder):
+        '''
+            Decoder rnn and projection without dropout, the state is passed
+            in and returned explicitly.
+        '''
+        super(DecoderStep, self).__init__()
+
+        self.decoding_rnn = decoder.decoding_rnn
+        self.fc = decoder.fc
+
+    def forward(self, input, z, h_state, c_state):
+        """
+        :param input: embedded previous words with shape of [batch_size, seq_len, embed_size]
+        :param z: context with shape of [batch_size, latent_variable_size]
+        :param h_state, c_state: rnn state with shape of [num_layers, batch_size, decoder_rnn_size]
+
+        :return: logits with shape of [batch_size, seq_len, vocab_size] and the new rnn state
+        """
+        batch_size, seq_len, _ = input.size()
+        input = t.cat([input, z.unsqueeze(1).expand(batch_size, seq_len, z.size(1))], 2)
+
+        rnn_out, (h_state, c_state) = self.decoding_rnn(input, (h_state, c_state))
+        return self.fc(rnn_out), h_state, c_state
+
+
+class Sampler(nn.Module):
+    def __init__(self, model, input_embedding, output_embedding, go_embedding, unk_idx, end_idx):
+        '''
+            Greedy and beam decoding of a Paraphraser or Generator over token
+            ids, compilable with torch.jit.script.
+
+        :param input_embedding: [num_input_words, embed_size] vectors of the
+            source token ids, zero for the labels and the padding
+        :param output_embedding: [vocab_size, embed_size] decoder input of
+            every output word, see utils.decoding.output_embedding
+        :param go_embedding: [embed_size] decoder input of the first step
+        '''
+        super(Sampler, self).__init__()
+
+        highway = fused_highway(model)
+        self.encoder = SourceEncoder(model.encoder, highway)
+        self.initial_state = InitialState(model.decoder, highway)
+        self.step = DecoderStep(model.decoder)
+
+        self.register_buffer('input_embedding', input_embedding)
+        self.register_buffer('output_embedding', output_embedding)
+        self.register_buffer('go_embedding', go_embedding.view(1, 1, -1))
+        self.latent_variable_size = model.params.latent_variable_size
+        self.unk_idx = unk_idx
+        self.end_idx = end_idx
+
+    def context(self, source, from_normal: bool, from_mean: bool):
+        z = t.randn([source.size(0), self.latent_variable_size], device=source.device)
+        if not from_normal:
+            mu, logvar = self.encoder(source)
+            z = mu if from_mean else z * t.exp(0.5 * logvar) + mu
+        return z
+
+    def forward(self, source_ids, seq_len: int, from_normal: bool = False, from_mean: bool = False):
+        """
+        :param source_ids: [batch_size, seq_len] input word ids of the sources,
+            each followed by the end label and padding
+        :param from_normal: draw z from the prior instead of the source posterior
+        :param from_mean: take the mean of the source posterior as z, which
+            makes decoding deterministic
+
+        :return: [batch_size, steps] ids of the most likely output words, a
+                 sentence ends at its first end label. Matches
+                 utils.decoding.greedy_decode.
+        """
+        source = self.input_embedding[source_ids]
+        batch_size = source.size(0)
+
+        z = self.context(source, from_normal, from_mean)
+        h_state, c_state = self.initial_state(source)
+        input = self.go_embedding.expand(batch_size, 1, self.go_embedding.size(2))
+
+        finished = t.zeros([batch_size], dtype=t.bool, device=source.device)
+        words: List[t.Tensor] = []
+        for i in range(seq_len):
+            logits, h_state, c_state = self.step(input, z, h_state, c_state)
+            logits = logits[:, -1]
+            # never emit <unk>
+            logits[:, self.unk_idx] = -float('inf')
+            idx = logits.argmax(dim=-1)
+
+            words.append(idx)
+            finished = finished | (idx == self.end_idx)
+            if bool(finished.all()):
+                break
+            input = self.output_embedding[idx].unsqueeze(1)
+
+        return t.stack(words, dim=1)
+
+    @t.jit.export
+    def beam_search(self, source_ids, seq_len: int, beam_size: int, from_normal: bool = False,
+                    from_mean: bool = False) -> Tuple[t.Tensor, t.Tensor]:
+        """
+        :param source_ids: as for forward
+        :param beam_size: sentences kept per source
+
+        :return: [batch_size, beam_size, steps] output word ids and
+                 [batch_size, beam_size] summed log-probabilities, best first.
+                 As Paraphraser.beam_search a sentence keeps its score once
+                 it ended, but the go label is fed once and all sources are
+                 decoded at the same time.
+        """
+        source = self.input_embedding[source_ids]
+        batch_size = source.size(0)
+
+        z = self.context(source, from_normal, from_mean)
+        h_state, c_state = self.initial_state(source)
+
+        # the beams of a source are consecutive rows
+        z = z.repeat_interleave(beam_size, 0)
+        h_state = h_state.repeat_interleave(beam_size, 1)
+        c_state = c_state.repeat_interleave(beam_size, 1)
+        input = self.go_embedding.expand(batch_size * beam_size, 1, self.go_embedding.size(2))
+
+        # only the first beam of a source is alive before the first step
+        scores = t.full([batch_size, beam_size], -float('inf'), device=source.device)
+        scores[:, 0] = 0.
+        finished = t.zeros([batch_size, beam_size], dtype=t.bool, device=source.device)
+        tokens = t.zeros([batch_size, beam_size, 0], dtype=t.long, device=source.device)
+        offsets = t.arange(batch_size, device=source.device).unsqueeze(1) * beam_size
+
+        for i in range(seq_len):
+            logits, h_state, c_state = self.step(input, z, h_state, c_state)
+            log_probs = F.log_softmax(logits[:, -1], dim=-1)
+            log_probs[:, self.unk_idx] = -float('inf')
+            vocab_size = log_probs.size(1)
+            log_probs = log_probs.view(batch_size, beam_size, vocab_size)
+
+            # an ended sentence is one candidate with an unchanged score
+            ended = t.full([vocab_size], -float('inf'), device=source.device)
+            ended[self.end_idx] = 0.
+            log_probs = t.where(finished.unsqueeze(2), ended, log_probs)
+
+            candidates = (scores.unsqueeze(2) + log_probs).view(batch_size, beam_size * vocab_size)
+            scores, best = candidates.topk(beam_size, dim=1)
+            beam = t.div(best, vocab_size, rounding_mode='floor')
+            idx = best % vocab_size
+
+            finished = finished.gather(1, beam) | (idx == self.end_idx)
+            tokens = t.cat([tokens.gather(1, beam.unsqueeze(2).expand(batch_size, beam_size, tokens.size(2))),
+                            idx.unsqueeze(2)], 2)
+            rows = (beam + offsets).view(-1)
+            h_state, c_state = h_state[:, rows], c_state[:, rows]
+            if bool(finished.all()):
+                break
+            input = self.output_embedding[idx.view(-1)].unsqueeze(1)
+
+        return tokens, scores
@@ -1,19 +1,28 @@
 import math
 
+
+# architecture sizes, saved next to the weights of a model trained with other ones
+SIZES = ['encoder_rnn_size', 'encoder_num_layers', 'latent_variable_size', 'decoder_rnn_size', 'decoder_num_layers']
+
+
 class Parameters:
-    def __init__(self, max_seq_len, vocab_size, use_two_path_loss=False):
+    def __init__(self, max_seq_len, vocab_size, use_two_path_loss=False,
+                 checkpoint_encoder=False, checkpoint_decoder=False,
+                 encoder_rnn_size=600, encoder_num_layers=1, latent_variable_size=1100,
+                 decoder_rnn_size=600, decoder_num_layers=2):
         self.max_seq_len = int(max_seq_len) + 1  # go or eos token
 
         self.vocab_size = int(vocab_size)
         self.word_embed_size = 300 # must be 300 for fastText embedding
 
-        self.encoder_rnn_size = 600
-        self.encoder_num_layers = 1
+        # smaller sizes for a distilled student, see utils.distillation
+        self.encoder_rnn_size = int(encoder_rnn_size)
+        self.encoder_num_layers = int(encoder_num_layers)
 
-        self.latent_variable_size = 1100
+        self.latent_variable_size = int(latent_variable_size)
 
-        self.decoder_rnn_size = 600
-        self.decoder_num_layers = 2
+        self.decoder_rnn_size = int(decoder_rnn_size)
+        self.decoder_num_layers = int(decoder_num_layers)
 
         self.kld_penalty_weight = 1.0
         self.ce_weight = 16.0
@@ -21,5 +30,12 @@ class Parameters:
 
         self.use_two_path_loss = use_two_path_loss
 
+        # recompute activations in backward instead of keeping them, see utils.recompute
+        self.checkpoint_encoder = checkpoint_encoder
+        self.checkpoint_decoder = checkpoint_decoder
+
+    def sizes(self):
+        return {name: getattr(self, name) for name in SIZES}
+
     def get_kld_coef(self, i):
         return self.kld_penalty_weight * (math.tanh((i - 3500)/1000) + 1)/2.0
@@ -1,7 +1,8 @@
 import math
 
 class Parameters:
-    def __init__(self, max_seq_len, vocab_size):
+    def __init__(self, max_seq_len, vocab_size, discriminator_type='lstm',
+                 checkpoint_encoder=False, checkpoint_decoder=False):
         self.max_seq_len = int(max_seq_len) + 1  # go or eos token
 
         self.vocab_size = int(vocab_size)
@@ -18,8 +19,17 @@ class Parameters:
         self.discriminator_rnn_size = 600
         self.discriminator_num_layers = 2
 
+        # 'lstm' or 'cnn', see model.discriminator.build_discriminator
+        self.discriminator_type = discriminator_type
+        self.discriminator_kernel_sizes = [2, 3, 4, 5]
+        self.discriminator_num_filters = 100
+
         self.use_two_path_loss = True
 
+        # recompute activations in backward instead of keeping them, see utils.recompute
+        self.checkpoint_encoder = checkpoint_encoder
+        self.checkpoint_decoder = checkpoint_decoder
+
         self.kld_penalty_weight = 1.0
         self.cross_entropy_penalty_weight = 79.0
 
@@ -9,6 +9,11 @@ from torch.autograd import Variable
 from .decoder import Decoder
 from .encoder import Encoder
 from .highway import Highway
+from utils.accumulation import AccumulationBudget, no_sync, scale_gradients
+from utils.metrics import MetricsAccumulator
+from utils.precision import PrecisionPolicy
+from utils.profiler import profiler
+from utils.telemetry import telemetry
 
 class Paraphraser(nn.Module):
     def __init__(self, params):
@@ -39,7 +44,8 @@ class Paraphraser(nn.Module):
             '''
             [batch_size, _, _] = encoder_input[0].size()
 
-            mu, logvar = self.encoder(encoder_input[0], encoder_input[1])
+            with profiler.timer('encoder'):
+                mu, logvar = self.encoder(encoder_input[0], encoder_input[1])
             std = t.exp(0.5 * logvar)
 
             z1 = Variable(t.randn([batch_size, self.params.latent_variable_size]))
@@ -47,10 +53,13 @@ class Paraphraser(nn.Module):
                 z1 = z1.cuda()
             z1 = z1 * std + mu
 
-            kld = (-0.5 * t.sum(logvar - t.pow(mu, 2) - t.exp(logvar) + 1, 1)).mean().squeeze()
+            # in fp32 under autocast as well
+            mu32, logvar32 = mu.float(), logvar.float()
+            kld = (-0.5 * t.sum(logvar32 - t.pow(mu32, 2) - t.exp(logvar32) + 1, 1)).mean().squeeze()
 
             if self.params.use_two_path_loss:
-                mu2, logvar2 = self.encoder(encoder_input[0], input_target=None)
+                with profiler.timer('encoder'):
+                    mu2, logvar2 = self.encoder(encoder_input[0], input_target=None)
                 std2 = t.exp(0.5 * logvar2)
 
                 z2 = Variable(t.randn([batch_size, self.params.latent_variable_size]))
@@ -61,56 +70,114 @@ class Paraphraser(nn.Module):
         else:
             kld = None
 
-        out1, final_state = self.decoder(decoder_input[0], decoder_input[1],
-                                        z1, drop_prob, initial_state)
-        if self.params.use_two_path_loss:
-            out2, final_state2 = self.decoder(decoder_input[0], decoder_input[1],
-                                            z2, drop_prob, initial_state)
-        else:
-            out2 = None
+        with profiler.timer('decoder'):
+            out1, final_state = self.decoder(decoder_input[0], decoder_input[1],
+                                            z1, drop_prob, initial_state)
+            if self.params.use_two_path_loss:
+                out2, final_state2 = self.decoder(decoder_input[0], decoder_input[1],
+                                                z2, drop_prob, initial_state)
+            else:
+                out2 = None
 
         return (out1, out2), final_state, kld
 
     def learnable_parameters(self):
         return [p for p in self.parameters() if p.requires_grad]
 
-    def trainer(self, optimizer, batch_loader):
-        def train(i, batch_size, use_cuda, dropout):
-            input = batch_loader.next_batch(batch_size, 'train')
-            input = [var.cuda() if use_cuda else var for var in input]
-
-            [encoder_input_source,
-             encoder_input_target,
-             decoder_input_source,
-             decoder_input_target, target] = input
-
-            (logits, logits2), _, kld = self(dropout,
-                    (encoder_input_source, encoder_input_target),
-                    (decoder_input_source, decoder_input_target),
-                    z=None, use_cuda=use_cuda)
-
-            target = target.view(-1)
-            cross_entropy, cross_entropy2 = [], []
-
-
-            logits = logits.view(-1, self.params.vocab_size)
-            cross_entropy = F.cross_entropy(logits, target)
-
-            if self.params.use_two_path_loss:
-                logits2 = logits2.view(-1, self.params.vocab_size)
-                cross_entropy2 = F.cross_entropy(logits2, target)
-            else:
-                cross_entropy2 = 0
-
-            loss = self.params.ce_weight * cross_entropy \
-                 + self.params.ce2_weight * cross_entropy2 \
-                 + self.params.get_kld_coef(i) * kld
+    def trainer(self, optimizer, batch_loader, model=None, budget=None, precision=None, distillation=None):
+        '''
+        model: optional wrapper of self used for the forward pass,
+            e.g. DistributedDataParallel
+        budget: optional AccumulationBudget, micro-batches are accumulated until
+            it is reached so that i counts optimizer steps rather than batches
+        precision: optional PrecisionPolicy of the forward pass, fp32 by default
+        distillation: optional utils.distillation.Distillation, the decoder
+            paths also fit the soft targets of its teacher. The returned
+            cross entropies are the ones to the target words either way.
+        '''
+        model = self if model is None else model
+        budget = AccumulationBudget() if budget is None else budget
+        precision = PrecisionPolicy() if precision is None else precision
+        scaler = precision.scaler
 
+        def train(i, batch_size, use_cuda, dropout):
             optimizer.zero_grad()
-            loss.backward()
-            optimizer.step()
-
-            return (cross_entropy, cross_entropy2), kld, self.params.get_kld_coef(i)
+            accumulated, total = 0, 0
+            ce_sum, ce2_sum, kld_sum = 0, 0, 0
+
+            while True:
+                with profiler.timer('next_batch'):
+                    input = batch_loader.next_batch(batch_size, 'train')
+                    input = [var.cuda() if use_cuda else var for var in input]
+
+                [encoder_input_source,
+                 encoder_input_target,
+                 decoder_input_source,
+                 decoder_input_target, target] = input
+
+                size = budget.size(target)
+                # summed over the ranks, so that all of them sync at the same micro-batch
+                reduced = budget.reduce(size)
+                profiler.count('sentences', target.size(0))
+                profiler.count('tokens', target.numel())
+                with no_sync(model, budget.is_full(total + reduced)):
+                    with profiler.timer('forward'), precision.autocast():
+                        (logits, logits2), _, kld = model(dropout,
+                                (encoder_input_source, encoder_input_target),
+                                (decoder_input_source, decoder_input_target),
+                                z=None, use_cuda=use_cuda)
+
+                    if distillation is not None:
+                        with profiler.timer('teacher'), precision.autocast():
+                            teacher_logits, teacher_logits2 = distillation.targets(
+                                (encoder_input_source, encoder_input_target),
+                                (decoder_input_source, decoder_input_target), use_cuda)
+
+                    with profiler.timer('loss'):
+                        target = target.view(-1)
+                        cross_entropy, cross_entropy2 = [], []
+
+
+                        logits = logits.float().view(-1, self.params.vocab_size)
+                        cross_entropy = F.cross_entropy(logits, target)
+
+                        if self.params.use_two_path_loss:
+                            logits2 = logits2.float().view(-1, self.params.vocab_size)
+                            cross_entropy2 = F.cross_entropy(logits2, target)
+                        else:
+                            cross_entropy2 = 0
+
+                        fit, fit2 = cross_entropy, cross_entropy2
+                        if distillation is not None:
+                            fit = distillation.loss(cross_entropy, logits, teacher_logits)
+                            if self.params.use_two_path_loss:
+                                fit2 = distillation.loss(cross_entropy2, logits2, teacher_logits2)
+
+                        loss = self.params.ce_weight * fit \
+                             + self.params.ce2_weight * fit2 \
+                             + self.params.get_kld_coef(i) * kld
+
+                    with profiler.timer('backward'):
+                        scaler.scale(loss * size).backward()
+
+                accumulated += size
+                total += reduced
+                ce_sum = ce_sum + size * cross_entropy.detach()
+                kld_sum = kld_sum + size * kld.detach()
+                if self.params.use_two_path_loss:
+                    ce2_sum = ce2_sum + size * cross_entropy2.detach()
+
+                if budget.is_full(total):
+                    break
+
+            with profiler.timer('optimizer'):
+                scaler.unscale_(optimizer)
+                # mean over the effective batch
+                scale_gradients(self.learnable_parameters(), budget.gradient_scale(total))
+                scaler.step(optimizer)
+                scaler.update()
+
+            return (ce_sum / accumulated, ce2_sum / accumulated), kld_sum / accumulated, self.params.get_kld_coef(i)
 
         return train
 
@@ -143,11 +210,16 @@ class Paraphraser(nn.Module):
             return sampled, expected
 
 
-        def validate(batch_size, use_cuda, need_samples=False):
+        @t.no_grad()
+        def validate(batch_size, use_cuda, need_samples=False, input=None):
+            '''
+            input: optional ready batch, e.g. of a ValidationSet, instead of
+                a random test batch
+            '''
             if need_samples:
                 input, sentences = batch_loader.next_batch(batch_size, 'test', return_sentences=True)
                 sentences = [[' '.join(s) for s in q] for q in sentences]
-            else:
+            elif input is None:
                 input = batch_loader.next_batch(batch_size, 'test')
 
             input = [var.cuda() if use_cuda else var for var in input]
@@ -189,6 +261,21 @@ class Paraphraser(nn.Module):
 
         return validate
 
+    def evaluate(self, validation_set, use_cuda):
+        '''
+        :return: dictionary of the mean losses over a ValidationSet
+        '''
+        validate = self.validater(None)
+        names = ['ce', 'ce2', 'kld'] if self.params.use_two_path_loss else ['ce', 'kld']
+        metrics = MetricsAccumulator(names, 'cuda' if use_cuda else 'cpu')
+
+        for input in validation_set:
+            (cross_entropy, cross_entropy2), kld, _ = validate(input[0].size(0), use_cuda, input=input)
+            metrics.update(input[0].size(0), ce=cross_entropy, ce2=cross_entropy2, kld=kld)
+
+        return metrics.means()
+
+    @telemetry.instrument
     def sample_with_input(self, batch_loader, seq_len, use_cuda, input, ml=True):
         [encoder_input_source, encoder_input_target, decoder_input_source, _, _] = input
 
@@ -197,7 +284,8 @@ class Paraphraser(nn.Module):
         # encode
         [batch_size, _, _] = encoder_input[0].size()
 
-        mu, logvar = self.encoder(encoder_input[0], None)
+        with telemetry.timer('encode'):
+            mu, logvar = self.encoder(encoder_input[0], None)
 
         std = t.exp(0.5 * logvar)
 
@@ -207,27 +295,36 @@ class Paraphraser(nn.Module):
             z = z.cuda()
         z = z * std + mu
 
-        initial_state = self.decoder.build_initial_state(decoder_input_source)
+        with telemetry.timer('encode'):
+            initial_state = self.decoder.build_initial_state(decoder_input_source)
         decoder_input = batch_loader.get_raw_input_from_sentences([batch_loader.go_label])
 
         result = ''
+        stop = seq_len
         for i in range(seq_len):
             if use_cuda:
-                decoder_input = decoder_input.cuda()
+                with telemetry.timer('transfer'):
+                    decoder_input = decoder_input.cuda()
 
             logits, initial_state = self.decoder(None, decoder_input, z, 0.0, initial_state)
-            logits = logits.view(-1, self.params.vocab_size)
-            prediction = F.softmax(logits, dim=-1)
+            telemetry.step()
+            with telemetry.timer('projection'):
+                logits = logits.view(-1, self.params.vocab_size)
+                prediction = F.softmax(logits, dim=-1)
+            with telemetry.timer('transfer'):
+                prediction = prediction.data.cpu().numpy()[-1]
             if ml:
-                word = batch_loader.likely_word_from_distribution(prediction.data.cpu().numpy()[-1])
+                word = batch_loader.likely_word_from_distribution(prediction)
             else:
-                word = batch_loader.sample_word_from_distribution(prediction.data.cpu().numpy()[-1])
+                word = batch_loader.sample_word_from_distribution(prediction)
             if word == batch_loader.end_label:
+                stop = i
                 break
             result += ' ' + word
 
             decoder_input = batch_loader.get_raw_input_from_sentences([word])
 
+        telemetry.finish(len(result.split()), stop)
         return result
 
     def sample_with_pair(self, batch_loader, seq_len, use_cuda, source_sent, target_sent):
@@ -236,6 +333,7 @@ class Paraphraser(nn.Module):
         return self.sample_with_input(batch_loader, seq_len, use_cuda, input)
 
     """ Should only be used with a batch size of 1 """
+    @telemetry.instrument
     def sample_from_normal(self, batch_loader, seq_len, use_cuda, input, ml=True):
         [_, _, decoder_input_source, _, _] = input
         [batch_size, _, _] = decoder_input_source.size()
@@ -244,29 +342,39 @@ class Paraphraser(nn.Module):
         if use_cuda:
             z = z.cuda()
 
-        initial_state = self.decoder.build_initial_state(decoder_input_source)
+        with telemetry.timer('encode'):
+            initial_state = self.decoder.build_initial_state(decoder_input_source)
         decoder_input = batch_loader.get_raw_input_from_sentences([batch_loader.go_label])
 
         result = ''
+        stop = seq_len
         for i in range(seq_len):
             if use_cuda:
-                decoder_input = decoder_input.cuda()
+                with telemetry.timer('transfer'):
+                    decoder_input = decoder_input.cuda()
 
             logits, initial_state = self.decoder(None, decoder_input, z, 0.0, initial_state)
-            logits = logits.view(-1, self.params.vocab_size)
-            prediction = F.softmax(logits, dim=-1)
+            telemetry.step()
+            with telemetry.timer('projection'):
+                logits = logits.view(-1, self.params.vocab_size)
+                prediction = F.softmax(logits, dim=-1)
+            with telemetry.timer('transfer'):
+                prediction = prediction.data.cpu().numpy()[-1]
             if ml:
-                word = batch_loader.likely_word_from_distribution(prediction.data.cpu().numpy()[-1])
+                word = batch_loader.likely_word_from_distribution(prediction)
             else:
-                word = batch_loader.sample_word_from_distribution(prediction.data.cpu().numpy()[-1])
+                word = batch_loader.sample_word_from_distribution(prediction)
             if word == batch_loader.end_label:
+                stop = i
                 break
             result += ' ' + word
 
             decoder_input = batch_loader.get_raw_input_from_sentences([word])
 
+        telemetry.finish(len(result.split()), stop)
         return result
 
+    @telemetry.instrument
     def beam_search(self, batch_loader, seq_len, use_cuda, input, k, sample_from_normal):
         [encoder_input_source, _, decoder_input_source, _, _] = input
 
@@ -278,24 +386,30 @@ class Paraphraser(nn.Module):
             z = z.cuda()
 
         if not sample_from_normal:
-            mu, logvar = self.encoder(encoder_input_source, None)
+            with telemetry.timer('encode'):
+                mu, logvar = self.encoder(encoder_input_source, None)
             std = t.exp(0.5 * logvar)
             z = z * std + mu
 
-        initial_state = self.decoder.build_initial_state(decoder_input_source)
+        with telemetry.timer('encode'):
+            initial_state = self.decoder.build_initial_state(decoder_input_source)
         decoder_input = batch_loader.get_raw_input_from_sentences([batch_loader.go_label])
         if use_cuda:
-            decoder_input = decoder_input.cuda()
+            with telemetry.timer('transfer'):
+                decoder_input = decoder_input.cuda()
 
         logits, initial_state = self.decoder(None, decoder_input, z, 0.0, initial_state)
-        logits = logits.view(-1, self.params.vocab_size)
-        predictions = F.softmax(logits, dim=-1)
+        telemetry.step()
+        with telemetry.timer('projection'):
+            logits = logits.view(-1, self.params.vocab_size)
+            predictions = F.softmax(logits, dim=-1)
 
         # sequences = [[list(), 0.0]]
         sequences = [[list(), 0.0, initial_state, decoder_input, False]]
 
         # walk over each step in sequence
-        for seq in range(seq_len):
+        stop = seq_len
+        for position in range(seq_len):
             all_candidates = list()
             # expand each current candidate
             for i in range(len(sequences)):
@@ -304,11 +418,16 @@ class Paraphraser(nn.Module):
                     all_candidates.append(sequences[i])
                     continue
                 if use_cuda:
-                    decoder_input = decoder_input.cuda()
+                    with telemetry.timer('transfer'):
+                        decoder_input = decoder_input.cuda()
 
                 logits, initial_state = self.decoder(None, decoder_input, z, 0.0, initial_state)
-                logits = logits.view(-1, self.params.vocab_size)
-                prediction = F.softmax(logits, dim=-1).data.cpu().numpy()[-1]
+                telemetry.step()
+                with telemetry.timer('projection'):
+                    logits = logits.view(-1, self.params.vocab_size)
+                    prediction = F.softmax(logits, dim=-1)
+                with telemetry.timer('transfer'):
+                    prediction = prediction.data.cpu().numpy()[-1]
                 for j in range(prediction.shape[0]):
                     word = batch_loader.get_word_by_idx(j)
                     if word == batch_loader.unk_label:
@@ -323,9 +442,12 @@ class Paraphraser(nn.Module):
             ordered = sorted(all_candidates, key=lambda tup:tup[1])
             # select k best
             sequences = ordered[:k]
+            if stop == seq_len and all(sequence[4] for sequence in sequences):
+                stop = position
         results = []
         for sequence in sequences:
             results.append(' '.join(sequence[0]))
+        telemetry.finish(len(sequences[0][0]), stop)
         return results
 
     def sample_with_phrase(self, batch_loader, seq_len, use_cuda, source_sent):
@@ -5,12 +5,20 @@ import numpy as np
 import torch as t
 from torch.optim import Adam
 
-from utils.batch_loader import BatchLoader
+from utils.batch_loader import load_batch_loader
+from utils.decoding import EagerSampler
+from utils.distillation import load_sizes
+from utils.onnx_export import OnnxSampler, export_onnx
+from utils.quantization import SUFFIX as INT8_SUFFIX, load_quantized, quantize
+from utils.scripting import ScriptedSampler, export_sampler, exported_weights, weights_fingerprint
+from utils.shortlist import Shortlist, load_alignments
+from utils.tensorfile import load_weights
 from model.parameters import Parameters
 from model.parametersGAN import Parameters as ParametersGAN
 
 from model.paraphraser import Paraphraser
 from model.generator import Generator
+from utils.telemetry import print_summary, telemetry
 
 def sample_with_input_file(batch_loader, paraphraser, args):
     result, target, source, i = [], [] , [],  0
@@ -114,33 +122,119 @@ def sample_with_input(batch_loader, paraphraser, args, decoder_only, num_samples
         i += 1
     return result, target, source
 
+def sample_with_backend(batch_loader, sampler, args, decoder_only):
+    '''
+        sample_with_input through a ScriptedSampler, an OnnxSampler or an
+        EagerSampler.
+    '''
+    result, target, source, i = [], [], [], 0
+    while True:
+        next_batch = batch_loader.next_batch_from_file(batch_size=1,
+         file_name='quora_test', return_sentences=True)
+
+        if next_batch is None:
+            break
+
+        _, sentences = next_batch
+        result += sampler.sample([' '.join(sentences[0][0])], args.seq_len, from_normal=decoder_only)
+
+        target += [' '.join(sentences[1][0])]
+        source += [' '.join(sentences[0][0])]
+        if i % 1000 == 0:
+            print(i)
+            print('source : ', source[-1])
+            print('target : ', target[-1])
+            print('sampled : ', result[-1])
+        i += 1
+    return [result], target, source
+
 if __name__ == "__main__":
 
     parser = argparse.ArgumentParser(description='Paraphraser')
     parser.add_argument('--use-cuda', type=bool, default=False, metavar='CUDA', help='use cuda (default: False)')
     parser.add_argument('--model-name', default='', metavar='MN', help='name of model to save (default: "")')
-    parser.add_argument('--seq-len', default=30, metavar='SL', help='max length of sequence (default: 30)')
+    parser.add_argument('--seq-len', default=30, type=int, metavar='SL', help='max length of sequence (default: 30)')
     parser.add_argument('--model', default='C-VAE', metavar='M', help='Model to use (default: C-VAE)')
+    parser.add_argument('--telemetry', default='', metavar='TM',
+                        help='record per-call decoding latency and save its percentiles to this json file (default: "")')
+    parser.add_argument('--int8', default=False, type=bool, metavar='Q',
+                        help='sample on the cpu with dynamically int8 quantized LSTM and Linear layers (default: False)')
+    parser.add_argument('--backend', default='torch', choices=['torch', 'script', 'onnx'], metavar='B',
+                        help='run the model eagerly, as TorchScript or on onnxruntime, the last two on the cpu (default: torch)')
+    parser.add_argument('--shortlist', default=0, type=int, metavar='SN',
+                        help='project onto the source words, the N most frequent words and the aligned words only, 0 projects onto all (default: 0)')
+    parser.add_argument('--shortlist-fallback', default=0., type=float, metavar='SF',
+                        help='use all words where the best shortlisted one has less probability among the shortlist (default: 0.)')
     args = parser.parse_args()
 
-    batch_loader = BatchLoader()
+    if args.shortlist and args.backend != 'torch':
+        parser.error('--shortlist is only supported by the torch backend')
+    if args.backend == 'onnx' and args.int8:
+        parser.error('--int8 is not supported by the onnx backend')
+    if args.backend != 'torch' and args.use_cuda:
+        print('{} backend runs on the cpu, args.use_cuda = False '.format(args.backend))
+        args.use_cuda = False
+
+    if args.int8 and args.use_cuda:
+        print('int8 inference runs on the cpu, args.use_cuda = False ')
+        args.use_cuda = False
+
+    if args.telemetry:
+        telemetry.enable()
+
+    batch_loader = load_batch_loader(args.model_name)
     if args.model == 'C-VAE':
-        parameters = Parameters(batch_loader.max_seq_len, batch_loader.vocab_size)
+        path = 'saved_models/trained_paraphraser_' + args.model_name
+        parameters = Parameters(batch_loader.max_seq_len, batch_loader.vocab_size, **load_sizes(path))
         paraphraser = Paraphraser(parameters)
-        paraphraser.load_state_dict(t.load('saved_models/trained_paraphraser_' + args.model_name, map_location=t.device('cpu')))
+        load_weights(paraphraser, path, map_location=t.device('cpu'))
     elif args.model == 'C-VAE*':
-        parameters = Parameters(batch_loader.max_seq_len, batch_loader.vocab_size, use_two_path_loss=True)
+        path = 'saved_models/trained_paraphraser_' + args.model_name
+        parameters = Parameters(batch_loader.max_seq_len, batch_loader.vocab_size, use_two_path_loss=True, **load_sizes(path))
         paraphraser = Paraphraser(parameters)
-        paraphraser.load_state_dict(t.load('saved_models/trained_paraphraser_' + args.model_name, map_location=t.device('cpu')))
+        load_weights(paraphraser, path, map_location=t.device('cpu'))
     elif args.model == 'GAN':
+        path = 'saved_models/trained_generator_' + args.model_name
         parameters = ParametersGAN(batch_loader.max_seq_len, batch_loader.vocab_size)
         paraphraser = Generator(parameters)
-        paraphraser.load_state_dict(t.load('saved_models/trained_generator_' + args.model_name, map_location=t.device('cpu')))
+        load_weights(paraphraser, path, map_location=t.device('cpu'))
+    weights = [path]
+
+    kind = 'generator' if args.model == 'GAN' else 'paraphraser'
+    if args.int8:
+        # weights exported with python -m utils.quantization, else quantized here
+        if os.path.exists(path + INT8_SUFFIX):
+            paraphraser = load_quantized(paraphraser, path + INT8_SUFFIX)
+            weights.append(path + INT8_SUFFIX)
+        else:
+            paraphraser = quantize(paraphraser)
 
     if args.use_cuda:
         paraphraser = paraphraser.cuda()
 
-    result, target, source = sample_with_input(batch_loader, paraphraser, args, decoder_only=(args.model == 'C-VAE'))
+    # exports of python -m utils.scripting and python -m utils.onnx_export,
+    # else or if made from other weights exported here
+    if args.backend == 'script':
+        path = 'saved_models/scripted_{}_{}{}.pt'.format(kind, args.model_name, INT8_SUFFIX if args.int8 else '')
+        weights = weights_fingerprint(*weights)
+        if exported_weights(path) != weights:
+            export_sampler(paraphraser, batch_loader, path, weights)
+        sampler = ScriptedSampler(path)
+    elif args.backend == 'onnx':
+        path = 'saved_models/onnx_{}_{}'.format(kind, args.model_name)
+        weights = weights_fingerprint(*weights)
+        if exported_weights(path) != weights:
+            export_onnx(paraphraser, batch_loader, path, weights=weights)
+        sampler = OnnxSampler(path)
+    elif args.shortlist:
+        # alignments written by python -m utils.shortlist, else source and frequent words only
+        shortlist = Shortlist(batch_loader, args.shortlist, load_alignments(args.model_name), args.shortlist_fallback)
+        sampler = EagerSampler(paraphraser, batch_loader, args.use_cuda, shortlist)
+
+    if args.backend == 'torch' and not args.shortlist:
+        result, target, source = sample_with_input(batch_loader, paraphraser, args, decoder_only=(args.model == 'C-VAE'))
+    else:
+        result, target, source = sample_with_backend(batch_loader, sampler, args, decoder_only=(args.model == 'C-VAE'))
 
 
     sampled_file_dst = 'logs/sampled_out_{}.txt'.format(args.model_name)
@@ -156,4 +250,10 @@ if __name__ == "__main__":
     print(sampled_file_dst)
     print(target_file_dst)
     print(source_file_dst)
+    if args.shortlist:
+        print('full vocabulary fallbacks: {} of {} steps'.format(shortlist.fallbacks, shortlist.steps))
+    if args.telemetry:
+        print_summary(telemetry.dump(args.telemetry))
+        print('decoding telemetry saved to: ')
+        print(args.telemetry)
     print('END')
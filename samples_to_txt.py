@@ -6,7 +6,8 @@ import torch as t
 from torch.optim import Adam
 
 from sample import sample_with_input, sample_with_beam
-from utils.batch_loader import BatchLoader
+from utils.batch_loader import load_batch_loader
+from utils.tensorfile import load_weights
 from model.paraphraser import Paraphraser
 from model.generator import Generator
 
@@ -37,24 +38,24 @@ def sample(args):
     if not os.path.isdir('logs/'+ args.model_name + '/samples'):
         os.mkdir('logs/'+ args.model_name + '/samples')
 
-    batch_loader = BatchLoader()
+    batch_loader = load_batch_loader(args.model_name)
     # Load model...
     if 'ori' in args.model_name.lower() and not 'gan' in args.model_name.lower() or 'tpl' in args.model_name.lower():
         from model.parameters import Parameters
         parameters = Parameters(batch_loader.max_seq_len, batch_loader.vocab_size, use_two_path_loss=('tpl' in args.model_name.lower()))
         paraphraser = Paraphraser(parameters)
         if args.use_cuda:
-            paraphraser.load_state_dict(t.load('saved_models/trained_paraphraser_' + args.model_name, map_location=t.device('cuda:0')))
+            load_weights(paraphraser, 'saved_models/trained_paraphraser_' + args.model_name, map_location=t.device('cuda:0'))
         else:
-            paraphraser.load_state_dict(t.load('saved_models/trained_paraphraser_' + args.model_name, map_location=t.device('cpu')))
+            load_weights(paraphraser, 'saved_models/trained_paraphraser_' + args.model_name, map_location=t.device('cpu'))
     elif 'gan' in args.model_name.lower():
         from model.parametersGAN import Parameters
         parameters = Parameters(batch_loader.max_seq_len, batch_loader.vocab_size)
         paraphraser = Generator(parameters)
         if args.use_cuda:
-            paraphraser.load_state_dict(t.load('saved_models/trained_generator_' + args.model_name, map_location=t.device('cuda:0')))
+            load_weights(paraphraser, 'saved_models/trained_generator_' + args.model_name, map_location=t.device('cuda:0'))
         else:
-            paraphraser.load_state_dict(t.load('saved_models/trained_generator_' + args.model_name, map_location=t.device('cpu')))
+            load_weights(paraphraser, 'saved_models/trained_generator_' + args.model_name, map_location=t.device('cpu'))
     if args.beam:
         samples, target, source = sample_with_beam(batch_loader, paraphraser, args,
                                     decoder_only=('ori' in args.model_name.lower() and not 'gan' in args.model_name.lower()),
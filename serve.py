@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+"""
+    Paraphrase service: loads a trained Paraphraser or Generator once and
+    answers JSON requests over local HTTP or a Unix socket, coalescing
+    concurrent requests into micro-batches, see utils.serving. Repeated
+    sentences are answered from a result cache, see utils.cache.
+
+    Usage: python serve.py --model C-VAE* --model-name NAME --port 8000
+           curl -s localhost:8000/paraphrase -d '{"sentences": ["how do i learn python"], "num_samples": 2}'
+           curl -s localhost:8000/metrics
+"""
+import argparse
+import os
+import signal
+
+import torch as t
+
+from model.generator import Generator
+from model.parameters import Parameters
+from model.parametersGAN import Parameters as ParametersGAN
+from model.paraphraser import Paraphraser
+from utils.batch_loader import load_batch_loader
+from utils.cache import CachedBatcher, ResultCache
+from utils.distillation import load_sizes
+from utils.onnx_export import OnnxSampler, export_onnx
+from utils.quantization import SUFFIX as INT8_SUFFIX, load_quantized, quantize
+from utils.scripting import ScriptedSampler, TokenSampler, export_sampler, exported_weights, weights_fingerprint
+from utils.serving import MicroBatcher, make_server
+from utils.tensorfile import load_weights
+
+
+def load_sampler(args):
+    '''
+    :return: sampler of the trained model for the backend of args and the
+             fingerprint of what it decodes with, for the result cache
+    '''
+    batch_loader = load_batch_loader(args.model_name)
+    kind = 'generator' if args.model == 'GAN' else 'paraphraser'
+    path = 'saved_models/trained_{}_{}'.format(kind, args.model_name)
+    if args.model == 'GAN':
+        model = Generator(ParametersGAN(batch_loader.max_seq_len, batch_loader.vocab_size))
+    else:
+        model = Paraphraser(Parameters(batch_loader.max_seq_len, batch_loader.vocab_size,
+                                       use_two_path_loss=(args.model == 'C-VAE*'), **load_sizes(path)))
+    load_weights(model, path, map_location='cpu')
+    weights = [path]
+
+    if args.int8:
+        # weights exported with python -m utils.quantization, else quantized here
+        if os.path.exists(path + INT8_SUFFIX):
+            model = load_quantized(model, path + INT8_SUFFIX)
+            weights.append(path + INT8_SUFFIX)
+        else:
+            model = quantize(model)
+    weights = weights_fingerprint(*weights)
+    fingerprint = '{}:{}:{}:{}'.format(weights, getattr(batch_loader, 'fingerprint', ''),
+                                       args.backend, 'int8' if args.int8 else 'fp32')
+
+    # exports of python -m utils.scripting and python -m utils.onnx_export,
+    # else or if made from other weights exported here
+    if args.backend == 'script':
+        path = 'saved_models/scripted_{}_{}{}.pt'.format(kind, args.model_name, INT8_SUFFIX if args.int8 else '')
+        if exported_weights(path) != weights:
+            export_sampler(model, batch_loader, path, weights)
+        return ScriptedSampler(path), fingerprint
+    if args.backend == 'onnx':
+        path = 'saved_models/onnx_{}_{}'.format(kind, args.model_name)
+        if exported_weights(path) != weights:
+            export_onnx(model, batch_loader, path, weights=weights)
+        return OnnxSampler(path), fingerprint
+    return TokenSampler.from_model(model, batch_loader), fingerprint
+
+
+def stop(signum, frame):
+    raise KeyboardInterrupt
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Paraphrase service')
+    parser.add_argument('--model-name', default='', help='name of the trained model (default: "")')
+    parser.add_argument('--model', default='C-VAE', choices=['C-VAE', 'C-VAE*', 'GAN'], help='model to serve (default: C-VAE)')
+    parser.add_argument('--backend', default='torch', choices=['torch', 'script', 'onnx'],
+                        help='run the model eagerly, as TorchScript or on onnxruntime, onnx without beam search (default: torch)')
+    parser.add_argument('--int8', default=False, type=bool, help='serve the dynamically int8 quantized model (default: False)')
+    parser.add_argument('--host', default='127.0.0.1', help='address to listen on (default: 127.0.0.1)')
+    parser.add_argument('--port', default=8000, type=int, help='port to listen on, 0 picks a free one (default: 8000)')
+    parser.add_argument('--socket', default='', help='listen on this Unix socket instead of host:port (default: "")')
+    parser.add_argument('--max-batch', default=32, type=int, help='sentences decoded per micro-batch (default: 32)')
+    parser.add_argument('--max-wait-ms', default=5., type=float, help='longest wait of a request for its micro-batch to fill (default: 5.0)')
+    parser.add_argument('--max-queue', default=1024, type=int, help='queued requests before new ones are rejected (default: 1024)')
+    parser.add_argument('--bucket', default=32, type=int, help='sources are padded to a multiple of this many words and batched by it, 1 decodes them unpadded (default: 32)')
+    parser.add_argument('--max-len', default=100, type=int, help='largest max_len a request may ask for (default: 100)')
+    parser.add_argument('--timeout', default=60., type=float, help='seconds a request may take (default: 60.0)')
+    parser.add_argument('--threads', default=0, type=int, help='torch threads, 0 keeps the default (default: 0)')
+    parser.add_argument('--cache-size', default=10000, type=int, help='paraphrased sentences kept in memory, 0 disables the cache (default: 10000)')
+    parser.add_argument('--cache-mb', default=64., type=float, help='memory of the cached paraphrases in MB (default: 64.0)')
+    parser.add_argument('--cache-ttl', default=3600., type=float, help='seconds a cached paraphrase is served (default: 3600.0)')
+    parser.add_argument('--cache-dir', default='', help='also keep the cache in a sqlite file in this directory, "" keeps it in memory only (default: "")')
+    parser.add_argument('--cache-stochastic', default='bypass', choices=['bypass', 'shard'],
+                        help='posterior and prior mode requests bypass the cache or are cached in --cache-shards variants (default: bypass)')
+    parser.add_argument('--cache-shards', default=8, type=int, help='cached variants of a stochastic paraphrase (default: 8)')
+    parser.add_argument('--verbose', default=False, type=bool, help='log every request (default: False)')
+    args = parser.parse_args()
+
+    if args.backend == 'onnx' and args.int8:
+        parser.error('--int8 is not supported by the onnx backend')
+    if args.threads:
+        t.set_num_threads(args.threads)
+
+    sampler, fingerprint = load_sampler(args)
+    # first call outside of the measured latencies
+    sampler.sample(['warm up'], 2)
+
+    batcher = MicroBatcher(sampler, args.max_batch, args.max_wait_ms / 1000., args.max_queue, bucket=args.bucket)
+    if args.cache_size:
+        cache = ResultCache(args.cache_size, int(args.cache_mb * 2 ** 20), args.cache_ttl, args.cache_dir or None)
+        batcher = CachedBatcher(batcher, cache, fingerprint, args.cache_stochastic, args.cache_shards)
+    server = make_server(batcher, args.host, args.port, args.socket,
+                         default_mode='prior' if args.model == 'C-VAE' else 'posterior',
+                         max_len=args.max_len, timeout=args.timeout, verbose=args.verbose)
+
+    # stop on SIGTERM as on Ctrl-C
+    signal.signal(signal.SIGTERM, stop)
+
+    print('------------------------------')
+    print('serving {} {} ({} backend) on {}'.format(
+        args.model, args.model_name, args.backend,
+        args.socket or 'http://{}:{}'.format(*server.server_address[:2])))
+    print('------------------------------', flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        batcher.close()
+        if args.socket and os.path.exists(args.socket):
+            os.remove(args.socket)
+    print('END')
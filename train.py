@@ -1,143 +1,208 @@
 # -*- coding: utf-8 -*-
 import argparse
+import functools
 import os
 import sys
 import time
 
-import numpy as np
 import torch as t
 from torch.optim import Adam
 
-import sample
-from utils.batch_loader import BatchLoader
+from utils import distributed
+from utils.accumulation import AccumulationBudget
+from utils.batch_loader import VOCAB_SIZE, BatchLoader
+from utils.checkpoint import CheckpointManager, get_rng_states, set_rng_state
+from utils.distillation import Distillation, load_teacher, save_sizes
+from utils.metrics import MetricsAccumulator, MetricsLog
+from utils.precision import PrecisionPolicy
+from utils.profiler import print_report, profiler
+from utils.sampling import SamplingWorker
+from utils.synthetic import SyntheticCorpus, min_train_size
+from utils.validation import BackgroundValidator, ValidationSet
+from utils.vocab import artifact_path, describe, fingerprint, save_vocab
 from model.parameters import Parameters
 from model.paraphraser import Paraphraser
 
-if __name__ == "__main__":
-    print(sys.getdefaultencoding())
-    print(sys.getfilesystemencoding())
-    parser = argparse.ArgumentParser(description='Paraphraser')
-    parser.add_argument('--num-iterations', type=int, default=300000, help='num iterations (default: 300000)')
-    parser.add_argument('--batch-size', type=int, default=32, help='batch size (default: 32)')
-    parser.add_argument('--use-cuda', type=bool, default=True, help='use cuda (default: True)')
-    parser.add_argument('--learning-rate', type=float, default=0.00005, help='learning rate (default: 0.00005)')
-    parser.add_argument('--dropout', type=float, default=0.3, help='dropout (default: 0.3)')
-    parser.add_argument('--use-trained', type=bool, default=False, help='load pretrained model (default: False)')
-    parser.add_argument('--model-name', default='', help='name of model to save (default: "")')
-    parser.add_argument('--weight-decay', default=0.0, type=float, help='L2 regularization penalty (default: 0.0)')
-    parser.add_argument('--interm-sampling', default=True, type=bool, help='if sample while training (default: False)')
-    parser.add_argument('-tpl', '--use_two_path_loss', default=False, type=bool, help='use two path loss while training (default: False)')
-    args = parser.parse_args()
 
-    if args.use_cuda and not t.cuda.is_available():
-        print('Found no GPU, args.use_cuda = False ')
-        args.use_cuda = False
-
-    batch_loader = BatchLoader()
+def build_batch_loader(args):
+    synthetic = None
+    if args.synthetic:
+        synthetic = SyntheticCorpus(args.synthetic_pairs, num_words=args.synthetic_words, seed=args.synthetic_seed)
+    batch_loader = BatchLoader(synthetic=synthetic)
+    # word vectors and pairs in shared memory, child processes attach to them
+    return batch_loader.share() if args.share_data else batch_loader
+
+
+def main(args, batch_loader=None):
+    '''
+    batch_loader: optional loader shared by the launching process
+    '''
+    if batch_loader is None:
+        batch_loader = build_batch_loader(args)
+    vocab_fingerprint = fingerprint(describe(batch_loader))
+    if distributed.is_distributed():
+        batch_loader.shard(distributed.get_rank(), distributed.get_world_size())
     parameters = Parameters(batch_loader.max_seq_len,
                             batch_loader.vocab_size,
-                            args.use_two_path_loss)
+                            args.use_two_path_loss,
+                            checkpoint_encoder=args.checkpoint_encoder,
+                            checkpoint_decoder=args.checkpoint_decoder,
+                            encoder_rnn_size=args.encoder_rnn_size,
+                            encoder_num_layers=args.encoder_num_layers,
+                            latent_variable_size=args.latent_variable_size,
+                            decoder_rnn_size=args.decoder_rnn_size,
+                            decoder_num_layers=args.decoder_num_layers)
 
     paraphraser = Paraphraser(parameters)
-    ce_result_valid = []
-    kld_result_valid = []
-    ce_result_train = []
-    kld_result_train = []
-    ce_cur_train = []
-    kld_cur_train = []
-    if args.use_two_path_loss:
-        ce2_cur_train = []
-        ce2_result_train = []
-        ce2_result_valid = []
+
+    # windowed loss sums stay on the device until a logging interval
+    metric_names = ['ce', 'ce2', 'kld'] if args.use_two_path_loss else ['ce', 'kld']
+    device = 'cuda' if args.use_cuda else 'cpu'
+    train_metrics = MetricsAccumulator(metric_names, device)
+    valid_metrics = MetricsAccumulator(metric_names, device)
 
     # Create locations to store logs
-    if not os.path.isdir('logs/'+ args.model_name):
+    if distributed.is_master() and not os.path.isdir('logs/'+ args.model_name):
         os.mkdir('logs/'+ args.model_name)
-    if args.interm_sampling and not os.path.isdir('logs/'+ args.model_name + '/intermediate'):
+    if distributed.is_master() and args.interm_sampling and not os.path.isdir('logs/'+ args.model_name + '/intermediate'):
         os.mkdir('logs/'+ args.model_name + '/intermediate')
 
 
-    if args.use_trained:
+    checkpoints = CheckpointManager('saved_models/checkpoints_' + args.model_name, 'paraphraser', args.keep_checkpoints)
+    checkpoint = checkpoints.load(map_location='cpu') if args.use_trained else None
+    start_iteration = 0
+
+    if checkpoint is not None:
+        if checkpoint.get('vocab', vocab_fingerprint) != vocab_fingerprint:
+            raise ValueError('checkpoint was trained with a different vocabulary')
+        paraphraser.load_state_dict(checkpoint['model'])
+    elif args.use_trained:
+        # weights only, optimizer state and iteration start over
         paraphraser.load_state_dict(t.load('saved_models/trained_paraphraser_' + args.model_name))
-        ce_result_valid = list(np.load('logs/{}/ce_result_valid.npy'.format(args.model_name)))
-        kld_result_valid = list(np.load('logs/{}/kld_result_valid.npy'.format(args.model_name)))
-        ce_result_train = list(np.load('logs/{}/ce_result_train.npy'.format(args.model_name)))
-        kld_result_train = list(np.load('logs/{}/kld_result_train.npy'.format(args.model_name)))
-        if args.use_two_path_loss:
-            ce2_result_valid = list(np.load('logs/{}/ce2_result_valid.npy'.format(args.model_name)))
-            ce2_result_train = list(np.load('logs/{}/ce2_result_train.npy'.format(args.model_name)))
+
+    # vocabularies and word vectors for the sampling scripts, see BatchLoader.from_artifact
+    if distributed.is_master():
+        save_vocab(batch_loader, artifact_path(args.model_name))
+        # the sampling scripts build the same architecture, see utils.distillation.load_sizes
+        save_sizes(parameters, 'saved_models/trained_paraphraser_' + args.model_name)
+
+    # one record of train and validation losses per logging interval
+    metrics_log = None
+    if distributed.is_master():
+        log_columns = ['{}_result_{}'.format(name, split) for split in ['train', 'valid'] for name in metric_names]
+        metrics_log = MetricsLog('logs/{}/metrics.log'.format(args.model_name), log_columns, append=args.use_trained)
+        if checkpoint is not None:
+            # records past the checkpoint are logged again after resuming
+            metrics_log.truncate(checkpoint['iteration'])
 
     if args.use_cuda:
         paraphraser = paraphraser.cuda()
 
     optimizer = Adam(paraphraser.learnable_parameters(), args.learning_rate, weight_decay=args.weight_decay)
-
-    train_step = paraphraser.trainer(optimizer, batch_loader)
+    precision = PrecisionPolicy(args.precision, args.use_cuda)
+
+    if checkpoint is not None:
+        optimizer.load_state_dict(checkpoint['optimizer'])
+        if 'scaler' in checkpoint:
+            precision.scaler.load_state_dict(checkpoint['scaler'])
+        set_rng_state(checkpoint['rng'])
+        start_iteration = checkpoint['iteration'] + 1
+        del checkpoint
+
+    # one iteration is one optimizer step over an effective batch of the budget size
+    # rank 0 owns logging, validation, checkpoints and sampling
+    budget = AccumulationBudget(args.accumulate_tokens, args.accumulate_sentences)
+    # a smaller student learns from the soft decoder distributions of a trained teacher
+    distillation = None
+    if args.teacher_name:
+        teacher = load_teacher(args.teacher_name, batch_loader, args.use_two_path_loss, args.use_cuda)
+        distillation = Distillation(teacher, args.distill_temperature, args.distill_weight)
+    train_step = paraphraser.trainer(optimizer, batch_loader, distributed.wrap(paraphraser, args.use_cuda), budget, precision,
+                                     distillation)
     validate = paraphraser.validater(batch_loader)
 
-    for iteration in range(args.num_iterations):
+    validation_set, background_validator = None, None
+    if args.valid_size > 0 and distributed.is_master():
+        validation_set = ValidationSet(batch_loader, args.valid_size, args.valid_batch_size)
+        if args.background_validation:
+            background_validator = BackgroundValidator(functools.partial(Paraphraser, parameters),
+                                                       validation_set, args.use_cuda)
+        elif args.use_cuda:
+            validation_set.to('cuda')
+
+    # train losses of the logging intervals whose validation is not finished
+    pending_train_means = {}
+
+    def report_validation(iteration, valid_means):
+        train_means = pending_train_means.pop(iteration)
+        values = [train_means[name] for name in metric_names] + [valid_means[name] for name in metric_names]
+        metrics_log.append(iteration, **dict(zip(log_columns, values)))
+
+        print('\n')
+        print('------------VALID-------------')
+        if background_validator is not None:
+            print('----------ITERATION-----------')
+            print(iteration)
+        print('--------CROSS-ENTROPY---------')
+        print(valid_means['ce'])
+        if args.use_two_path_loss:
+            print('----CROSS-ENTROPY-2ND-PATH----')
+            print(valid_means['ce2'])
+        print('-------------KLD--------------')
+        print(valid_means['kld'])
+        print('------------------------------')
+
+    # intermediate samples are decoded by a separate process
+    sampling_worker = None
+    if args.interm_sampling and distributed.is_master():
+        sampling_worker = SamplingWorker(functools.partial(Paraphraser, parameters), batch_loader, args.model_name, args.use_cuda,
+                                         batch_size=args.sampling_batch_size,
+                                         from_normal=not parameters.use_two_path_loss,
+                                         bleu=args.sampling_bleu)
+
+    # per-stage timings of the training steps, reported at every logging interval
+    if args.profile and distributed.is_master():
+        profiler.enable(synchronize=args.use_cuda, trace_window=args.profile_trace,
+                        trace_path='logs/{}/trace.json'.format(args.model_name))
+
+    for iteration in range(start_iteration, args.num_iterations):
+        profiler.step(iteration)
         (cross_entropy, cross_entropy2), kld, coef = train_step(iteration, args.batch_size, args.use_cuda, args.dropout)
 
-        ce_cur_train += [cross_entropy.data.cpu().numpy()]
-        kld_cur_train += [kld.data.cpu().numpy()]
-        if args.use_two_path_loss:
-            ce2_cur_train += [cross_entropy2.data.cpu().numpy()]
+        train_metrics.update(ce=cross_entropy, ce2=cross_entropy2, kld=kld)
 
         # validation
-        if iteration % 500 == 0:
-            ce_result_train += [np.mean(ce_cur_train)]
-            kld_result_train += [np.mean(kld_cur_train)]
-            ce_cur_train, kld_cur_train = [], []
-
-            if args.use_two_path_loss:
-                ce2_result_train += [np.mean(ce2_cur_train)]
-                ce2_cur_train = []
+        if iteration % 500 == 0 and distributed.is_master():
+            train_means = pending_train_means[iteration] = train_metrics.means()
 
             print('\n')
             print('------------TRAIN-------------')
             print('----------ITERATION-----------')
             print(iteration)
             print('--------CROSS-ENTROPY---------')
-            print(ce_result_train[-1])
+            print(train_means['ce'])
             if args.use_two_path_loss:
                 print('----CROSS-ENTROPY-2ND PATH----')
-                print(ce2_result_train[-1])
+                print(train_means['ce2'])
             print('-------------KLD--------------')
-            print(kld_result_train[-1])
+            print(train_means['kld'])
             print('-----------KLD-coef-----------')
             print(coef)
             print('------------------------------')
 
+            if args.profile:
+                print_report(profiler.dump('logs/{}/profile.{}'.format(args.model_name, args.profile_format), iteration))
 
-            # averaging across several batches
-            cross_entropy, cross_entropy2, kld = [], [], []
-            for i in range(20):
-                (ce, ce2), kl, _ = validate(args.batch_size, args.use_cuda)
-                cross_entropy += [ce.data.cpu().numpy()]
-                kld += [kl.data.cpu().numpy()]
-
-                if args.use_two_path_loss:
-                    cross_entropy2 += [ce2.data.cpu().numpy()]
-
-
-            kld = np.mean(kld)
-            cross_entropy = np.mean(cross_entropy)
-            ce_result_valid += [cross_entropy]
-            kld_result_valid += [kld]
-            if args.use_two_path_loss:
-                cross_entropy2 = np.mean(cross_entropy2)
-                ce2_result_valid += [cross_entropy2]
-
-            print('\n')
-            print('------------VALID-------------')
-            print('--------CROSS-ENTROPY---------')
-            print(cross_entropy)
-            if args.use_two_path_loss:
-                print('----CROSS-ENTROPY-2ND-PATH----')
-                print(cross_entropy2)
-            print('-------------KLD--------------')
-            print(kld)
-            print('------------------------------')
+            if background_validator is not None:
+                background_validator.submit(iteration, paraphraser.state_dict())
+            elif validation_set is not None:
+                report_validation(iteration, paraphraser.evaluate(validation_set, args.use_cuda))
+            else:
+                # averaging across several random batches
+                for i in range(20):
+                    (ce, ce2), kl, _ = validate(args.batch_size, args.use_cuda)
+                    valid_metrics.update(ce=ce, ce2=ce2, kld=kl)
+                report_validation(iteration, valid_metrics.means())
 
             _, _, (sampled, s1, s2) = validate(2, args.use_cuda, need_samples=True)
 
@@ -149,45 +214,112 @@ if __name__ == "__main__":
                 print('sampled: ' + result)
                 print('...........................')
 
+            profiler.exclude()
+
+        if background_validator is not None:
+            for i, valid_means in background_validator.poll():
+                report_validation(i, valid_means)
+
         # save model
+        rng = None
         if (iteration % 10000 == 0 and iteration != 0) or iteration == (args.num_iterations - 1):
-            t.save(paraphraser.state_dict(), 'saved_models/trained_paraphraser_' + args.model_name)
-            np.save('logs/{}/ce_result_valid.npy'.format(args.model_name), np.array(ce_result_valid))
-            np.save('logs/{}/kld_result_valid.npy'.format(args.model_name), np.array(kld_result_valid))
-            np.save('logs/{}/ce_result_train.npy'.format(args.model_name), np.array(ce_result_train))
-            np.save('logs/{}/kld_result_train.npy'.format(args.model_name), np.array(kld_result_train))
-            if args.use_two_path_loss:
-                np.save('logs/{}/ce2_result_valid.npy'.format(args.model_name), np.array(ce2_result_valid))
-                np.save('logs/{}/ce2_result_train.npy'.format(args.model_name), np.array(ce2_result_train))
+            # random states of every rank, each restores its own
+            rng = get_rng_states()
+        if rng is not None and distributed.is_master():
+            if background_validator is not None:
+                # the log covers every interval up to the checkpoint
+                for i, valid_means in background_validator.poll(wait=True):
+                    report_validation(i, valid_means)
+
+            # plain weights for the sampling scripts
+            state_dict = paraphraser.state_dict()
+            files = {'saved_models/trained_paraphraser_' + args.model_name: state_dict,
+                     # memory-mappable copy, see utils.tensorfile.load_weights
+                     'saved_models/trained_paraphraser_' + args.model_name + '.tensors': state_dict}
+            if iteration % 250000 == 0:
+                files['saved_models/trained_paraphraser_250k_' + args.model_name] = state_dict
+
+            checkpoints.save({'iteration': iteration,
+                              'vocab': vocab_fingerprint,
+                              'model': state_dict,
+                              'optimizer': optimizer.state_dict(),
+                              'scaler': precision.scaler.state_dict(),
+                              'rng': rng}, iteration, files)
 
 
         #interm sampling
         if (iteration % 20000 == 0 and iteration != 0) or iteration == (args.num_iterations - 1):
-            if args.interm_sampling:
-                args.seq_len = 30
-
-                result, target, source = sample.sample_with_input_file(batch_loader, paraphraser, args)
-
-                sampled_file_dst = 'logs/{}/intermediate/sampled_{}k.txt'.format(args.model_name, iteration//1000)
-                target_file_dst = 'logs/{}/intermediate/target_{}k.txt'.format(args.model_name, iteration//1000)
-                source_file_dst = 'logs/{}/intermediate/source_{}k.txt'.format(args.model_name, iteration//1000)
-
-                np.savetxt(sampled_file_dst, np.array(result), delimiter='\n', fmt='%s')
-                np.savetxt(target_file_dst, np.array(target), delimiter='\n', fmt='%s')
-                np.savetxt(source_file_dst, np.array(source), delimiter='\n', fmt='%s')
-
-                print('------------------------------')
-                print('results saved to: ')
-                print(sampled_file_dst)
-                print(target_file_dst)
-                print(source_file_dst)
-
-        if (iteration % 250000 == 0 and iteration != 0):
-            t.save(paraphraser.state_dict(), 'saved_models/trained_paraphraser_250k_' + args.model_name)
-            np.save('logs/{}/ce_result_valid.npy'.format(args.model_name), np.array(ce_result_valid))
-            np.save('logs/{}/kld_result_valid.npy'.format(args.model_name), np.array(kld_result_valid))
-            np.save('logs/{}/ce_result_train.npy'.format(args.model_name), np.array(ce_result_train))
-            np.save('logs/{}/kld_result_train.npy'.format(args.model_name), np.array(kld_result_train))
-            if args.use_two_path_loss:
-                np.save('logs/{}/ce2_result_valid.npy'.format(args.model_name), np.array(ce2_result_valid))
-                np.save('logs/{}/ce2_result_train.npy'.format(args.model_name), np.array(ce2_result_train))
+            if sampling_worker is not None:
+                sampling_worker.submit(iteration, paraphraser.state_dict())
+
+    if background_validator is not None:
+        for i, valid_means in background_validator.close():
+            report_validation(i, valid_means)
+    if sampling_worker is not None:
+        sampling_worker.close()
+    checkpoints.wait()
+    if metrics_log is not None:
+        metrics_log.close()
+
+if __name__ == "__main__":
+    print(sys.getdefaultencoding())
+    print(sys.getfilesystemencoding())
+    parser = argparse.ArgumentParser(description='Paraphraser')
+    parser.add_argument('--num-iterations', type=int, default=300000, help='num iterations (default: 300000)')
+    parser.add_argument('--batch-size', type=int, default=32, help='batch size (default: 32)')
+    parser.add_argument('--use-cuda', type=bool, default=True, help='use cuda (default: True)')
+    parser.add_argument('--learning-rate', type=float, default=0.00005, help='learning rate (default: 0.00005)')
+    parser.add_argument('--dropout', type=float, default=0.3, help='dropout (default: 0.3)')
+    parser.add_argument('--use-trained', type=bool, default=False, help='load pretrained model (default: False)')
+    parser.add_argument('--model-name', default='', help='name of model to save (default: "")')
+    parser.add_argument('--weight-decay', default=0.0, type=float, help='L2 regularization penalty (default: 0.0)')
+    parser.add_argument('--interm-sampling', default=True, type=bool, help='if sample while training (default: False)')
+    parser.add_argument('--sampling-batch-size', default=64, type=int, help='batch size of the intermediate sampling (default: 64)')
+    parser.add_argument('--sampling-bleu', default=False, type=bool, help='score the intermediate samples with BLEU (default: False)')
+    parser.add_argument('-tpl', '--use_two_path_loss', default=False, type=bool, help='use two path loss while training (default: False)')
+    parser.add_argument('--accumulate-tokens', default=0, type=int, help='target tokens per optimizer step, 0 disables (default: 0)')
+    parser.add_argument('--accumulate-sentences', default=0, type=int, help='sentence pairs per optimizer step, 0 disables (default: 0)')
+    parser.add_argument('--checkpoint-encoder', default=False, type=bool, help='recompute encoder activations in backward to save memory (default: False)')
+    parser.add_argument('--checkpoint-decoder', default=False, type=bool, help='recompute decoder rnn and projection activations in backward to save memory (default: False)')
+    parser.add_argument('--precision', default='fp32', choices=['fp32', 'bf16', 'fp16'], help='precision of the forward pass, fp16 needs a GPU (default: fp32)')
+    parser.add_argument('--profile', default=False, type=bool, help='time the training stages and report them every 500 iterations (default: False)')
+    parser.add_argument('--profile-format', default='json', choices=['json', 'csv'], help='format of logs/<model>/profile.* (default: json)')
+    parser.add_argument('--profile-trace', default=None, type=int, nargs=2, metavar=('START', 'STOP'), help='iterations of a torch profiler trace, needs --profile (default: None)')
+    parser.add_argument('--valid-size', default=640, type=int, help='pairs of the fixed validation set, 0 validates on 20 random batches (default: 640)')
+    parser.add_argument('--valid-batch-size', default=128, type=int, help='batch size of the fixed validation set (default: 128)')
+    parser.add_argument('--background-validation', default=False, type=bool, help='validate weight snapshots in a separate process (default: False)')
+    parser.add_argument('--keep-checkpoints', default=3, type=int, help='number of full checkpoints kept, at least 1 (default: 3)')
+    parser.add_argument('--world-size', default=1, type=int, help='number of data-parallel processes (default: 1)')
+    parser.add_argument('--synthetic', default=False, type=bool, help='train on a generated Zipf corpus with random word vectors instead of the data files (default: False)')
+    parser.add_argument('--synthetic-pairs', default=20000, type=int, help='train pairs of the synthetic corpus, at least a quarter of --synthetic-words (default: 20000)')
+    parser.add_argument('--synthetic-words', default=30000, type=int, help='distinct words of the synthetic corpus, more than the vocabulary size (default: 30000)')
+    parser.add_argument('--synthetic-seed', default=0, type=int, help='seed of the synthetic corpus (default: 0)')
+    parser.add_argument('--share-data', default=False, type=bool, help='keep word vectors and pairs in shared memory for the worker and data-parallel processes (default: False)')
+    parser.add_argument('--encoder-rnn-size', default=600, type=int, help='hidden size of the encoder rnns (default: 600)')
+    parser.add_argument('--encoder-num-layers', default=1, type=int, help='layers of the encoder rnns (default: 1)')
+    parser.add_argument('--latent-variable-size', default=1100, type=int, help='size of z (default: 1100)')
+    parser.add_argument('--decoder-rnn-size', default=600, type=int, help='hidden size of the decoder rnn (default: 600)')
+    parser.add_argument('--decoder-num-layers', default=2, type=int, help='layers of the decoder rnn (default: 2)')
+    parser.add_argument('--teacher-name', default='', help='trained paraphraser to distill into this model, "" trains without a teacher (default: "")')
+    parser.add_argument('--distill-temperature', default=2.0, type=float, help='softmax temperature of the teacher and student distributions (default: 2.0)')
+    parser.add_argument('--distill-weight', default=0.5, type=float, help='share of the teacher distributions in the decoder loss (default: 0.5)')
+    args = parser.parse_args()
+
+    if args.keep_checkpoints < 1:
+        parser.error('--keep-checkpoints must be at least 1')
+    # the corpus has to fill the output vocabulary and leave words for <unk>
+    if args.synthetic and args.synthetic_words <= VOCAB_SIZE:
+        parser.error('--synthetic-words must exceed the vocabulary size {}'.format(VOCAB_SIZE))
+    if args.synthetic and args.synthetic_pairs < min_train_size(args.synthetic_words):
+        parser.error('--synthetic-pairs must be at least {} to cover {} words'.format(
+            min_train_size(args.synthetic_words), args.synthetic_words))
+
+    if args.use_cuda and not t.cuda.is_available():
+        print('Found no GPU, args.use_cuda = False ')
+        args.use_cuda = False
+
+    if args.share_data and args.world_size > 1 and 'RANK' not in os.environ:
+        # spawned ranks attach to the loader of this process instead of building their own
+        distributed.launch(functools.partial(main, batch_loader=build_batch_loader(args)), args, args.world_size)
+    else:
+        distributed.launch(main, args, args.world_size)
@@ -1,5 +1,7 @@
 # -*- coding: utf-8 -*-
 import argparse
+import functools
+import glob
 import os
 import sys
 import time
@@ -10,69 +12,61 @@ from torch.optim import Adam
 import torch.nn as nn
 import torch.nn.functional as F
 from torch.autograd import Variable
-from torch.cuda import amp
 
-import sample
-from utils.batch_loader import BatchLoader
+from utils import distributed
+from utils.accumulation import AccumulationBudget, no_sync, scale_gradients
+from utils.batch_loader import VOCAB_SIZE, BatchLoader
+from utils.checkpoint import CheckpointManager, get_rng_states, set_rng_state
+from utils.metrics import MetricsAccumulator, MetricsLog
+from utils.precision import PrecisionPolicy
+from utils.profiler import print_report, profiler
+from utils.sampling import SamplingWorker
+from utils.synthetic import SyntheticCorpus, min_train_size
+from utils.validation import ValidationSet
+from utils.vocab import artifact_path, describe, fingerprint, save_vocab
 from utils.rollout import Rollout
+from utils.replay_buffer import ReplayBuffer
 from model.parametersGAN import Parameters
 from model.generator import Generator
-from model.discriminator import Discriminator
+from model.discriminator import build_discriminator
 import gc
 
 lambdas = [0.5, 0.5, 0.01]
 rollout_num = 8
 
-def trainer(generator, g_optim, discriminator, d_optim, rollout, batch_loader, scaler):
-    def train(i, batch_size, use_cuda, dropout):
-        input = batch_loader.next_batch(batch_size, 'train')
-        input = [var.cuda() if use_cuda else var for var in input]
-
-        [encoder_input_source,
-         encoder_input_target,
-         decoder_input_source,
-         decoder_input_target, target] = input
-
-        target = target.view(-1)
-
-        g_optim.zero_grad()
-
-        with amp.autocast():
-            (logits, logits2), _, kld = generator(dropout,
-                    (encoder_input_source, encoder_input_target),
-                    (decoder_input_source, decoder_input_target),
-                    z=None, use_cuda=use_cuda)
-
-            logits = logits.view(-1, generator.params.vocab_size)
-            logits2 = logits2.view(-1, generator.params.vocab_size)
-            ce_1 = F.cross_entropy(logits, target)
-            ce_2 = F.cross_entropy(logits2, target)
-
-            # Generate fake data
-            prediction = F.softmax(logits2, dim=-1)
-            samples = prediction.multinomial(1).view(batch_size, -1)
-            gen_samples = batch_loader.embed_batch_from_index(samples)
+def trainer(generator, g_optim, discriminator, d_optim, rollout, batch_loader, precision,
+            replay_buffer=None, d_g_ratio=1.0, g_model=None, d_model=None, budget=None):
+    '''
+    precision: PrecisionPolicy of the forward passes, its scaler scales the
+        losses of both optimizers
+    replay_buffer: optional ReplayBuffer of generated token ids, the discriminator
+        then trains on sequences drawn from it instead of only the latest samples
+    d_g_ratio: discriminator updates per generator update, fractions spread
+        updates over several generator steps (e.g. 0.5 updates every other step)
+    g_model, d_model: optional wrappers of generator and discriminator used for
+        the forward pass, e.g. DistributedDataParallel
+    budget: optional AccumulationBudget, generator micro-batches are accumulated
+        until it is reached so that i counts optimizer steps rather than batches
+    '''
+    g_model = generator if g_model is None else g_model
+    d_model = discriminator if d_model is None else d_model
+    budget = AccumulationBudget() if budget is None else budget
+    scaler = precision.scaler
+
+    # start with enough credit for a discriminator update on the first step
+    state = {'d_credit': max(0., 1. - d_g_ratio), 'd_loss': None}
+
+    def train_discriminator(batch_size, use_cuda, encoder_input_target, gen_samples):
+        if replay_buffer is not None:
+            gen_samples = batch_loader.embed_batch_from_index(replay_buffer.sample(batch_size))
             if use_cuda:
                 gen_samples = gen_samples.cuda()
 
-            rewards = rollout.reward(gen_samples, [encoder_input_source, encoder_input_target], decoder_input_source, use_cuda, batch_loader)
-            rewards = Variable(t.tensor(rewards))
-            if use_cuda:
-                rewards = rewards.cuda()
-            neg_lik = F.cross_entropy(logits2, target, reduction='none')
-
-            dg_loss = t.mean(neg_lik * rewards.flatten())
-            g_loss = lambda1 * ce_1 + lambda1 * kld + lambda2 * ce_2 + lambda3 * dg_loss
-
-
-        scaler.scale(g_loss).backward()
-        scaler.unscale_(g_optim)
-        t.nn.utils.clip_grad_norm_(generator.learnable_parameters(), 10)
-        scaler.step(g_optim)
-        scaler.update()
-
-        # Train discriminator with real and fake data
-        data = t.cat([encoder_input_target, gen_samples], dim=0)
+        # real and fake sentences may differ in length, pad with zeros (end label)
+        seq_len = max(encoder_input_target.size(1), gen_samples.size(1))
+        real = F.pad(encoder_input_target, (0, 0, 0, seq_len - encoder_input_target.size(1)))
+        fake = F.pad(gen_samples, (0, 0, 0, seq_len - gen_samples.size(1)))
+        data = t.cat([real, fake], dim=0)
 
         labels = t.zeros(2*batch_size)
         labels[:batch_size] = 1
@@ -83,9 +77,9 @@ def trainer(generator, g_optim, discriminator, d_optim, rollout, batch_loader, s
 
 
         d_optim.zero_grad()
-        with amp.autocast():
-            d_logits = discriminator(data)
-            d_loss = F.binary_cross_entropy_with_logits(d_logits, labels)
+        with precision.autocast():
+            d_logits = d_model(data)
+        d_loss = F.binary_cross_entropy_with_logits(d_logits.float(), labels)
 
         scaler.scale(d_loss).backward()
         scaler.unscale_(d_optim)
@@ -93,10 +87,110 @@ def trainer(generator, g_optim, discriminator, d_optim, rollout, batch_loader, s
         scaler.step(d_optim)
         scaler.update()
 
-        return (ce_1, ce_2, dg_loss, d_loss), kld
+        return d_loss
+
+    def train(i, batch_size, use_cuda, dropout, lambdas):
+        lambda1, lambda2, lambda3 = lambdas
+
+        g_optim.zero_grad()
+        accumulated, total = 0, 0
+        ce1_sum, ce2_sum, dg_sum, kld_sum = 0, 0, 0, 0
+
+        while True:
+            with profiler.timer('next_batch'):
+                input = batch_loader.next_batch(batch_size, 'train')
+                input = [var.cuda() if use_cuda else var for var in input]
+
+            [encoder_input_source,
+             encoder_input_target,
+             decoder_input_source,
+             decoder_input_target, target] = input
+
+            size = budget.size(target)
+            # summed over the ranks, so that all of them sync at the same micro-batch
+            reduced = budget.reduce(size)
+            profiler.count('sentences', target.size(0))
+            profiler.count('tokens', target.numel())
+            target = target.view(-1)
+
+            with no_sync(g_model, budget.is_full(total + reduced)):
+                with profiler.timer('forward'), precision.autocast():
+                    (logits, logits2), _, kld = g_model(dropout,
+                            (encoder_input_source, encoder_input_target),
+                            (decoder_input_source, decoder_input_target),
+                            z=None, use_cuda=use_cuda)
+
+                # losses and sampling from fp32 logits
+                with profiler.timer('loss'):
+                    logits = logits.float().view(-1, generator.params.vocab_size)
+                    logits2 = logits2.float().view(-1, generator.params.vocab_size)
+                    ce_1 = F.cross_entropy(logits, target)
+                    ce_2 = F.cross_entropy(logits2, target)
+
+                # Generate fake data
+                with profiler.timer('sample'):
+                    prediction = F.softmax(logits2, dim=-1)
+                    samples = prediction.multinomial(1).view(batch_size, -1)
+                    gen_samples = batch_loader.embed_batch_from_index(samples)
+                    if use_cuda:
+                        gen_samples = gen_samples.cuda()
+
+                with profiler.timer('rollout'), precision.autocast():
+                    rewards = rollout.reward(gen_samples, [encoder_input_source, encoder_input_target], decoder_input_source, use_cuda, batch_loader)
+
+                with profiler.timer('loss'):
+                    rewards = Variable(t.tensor(rewards))
+                    if use_cuda:
+                        rewards = rewards.cuda()
+                    neg_lik = F.cross_entropy(logits2, target, reduction='none')
+
+                    dg_loss = t.mean(neg_lik * rewards.flatten())
+                    g_loss = lambda1 * ce_1 + lambda1 * kld + lambda2 * ce_2 + lambda3 * dg_loss
+
+                with profiler.timer('backward'):
+                    scaler.scale(g_loss * size).backward()
+
+            if replay_buffer is not None:
+                replay_buffer.add(samples)
+
+            accumulated += size
+            total += reduced
+            ce1_sum = ce1_sum + size * ce_1.detach()
+            ce2_sum = ce2_sum + size * ce_2.detach()
+            dg_sum = dg_sum + size * dg_loss.detach()
+            kld_sum = kld_sum + size * kld.detach()
+
+            if budget.is_full(total):
+                break
+
+        with profiler.timer('optimizer'):
+            scaler.unscale_(g_optim)
+            # mean over the effective batch
+            scale_gradients(generator.learnable_parameters(), budget.gradient_scale(total))
+            t.nn.utils.clip_grad_norm_(generator.learnable_parameters(), 10)
+            scaler.step(g_optim)
+            scaler.update()
+
+        # Train discriminator with real and fake data of the last micro-batch
+        state['d_credit'] += d_g_ratio
+        d_steps = int(state['d_credit'])
+        state['d_credit'] -= d_steps
+        for _ in range(d_steps):
+            with profiler.timer('discriminator'):
+                state['d_loss'] = train_discriminator(batch_size, use_cuda, encoder_input_target, gen_samples)
+
+        return (ce1_sum / accumulated, ce2_sum / accumulated, dg_sum / accumulated, state['d_loss']), kld_sum / accumulated
 
     return train
 
+def latest_weights(prefix):
+    '''
+    :return: path of the last weights saved as prefix_<thousand iterations>,
+             prefix itself if there are none
+    '''
+    saved = [path for path in glob.glob(prefix + '_*') if path[len(prefix) + 1:].isdigit()]
+    return max(saved, key=lambda path: int(path[len(prefix) + 1:])) if saved else prefix
+
 @t.no_grad()
 def validater(generator, discriminator, rollout, batch_loader):
     def get_samples(logits, target):
@@ -117,14 +211,18 @@ def validater(generator, discriminator, rollout, batch_loader):
         return sampled, expected
 
     @t.no_grad()
-    def validate(batch_size, use_cuda, need_samples=False):
+    def validate(batch_size, use_cuda, need_samples=False, input=None):
+        '''
+        input: optional ready batch, e.g. of a ValidationSet, instead of
+            a random test batch
+        '''
         generator.eval()
         discriminator.eval()
 
         if need_samples:
             input, sentences = batch_loader.next_batch(batch_size, 'test', return_sentences=True)
             sentences = [[' '.join(s) for s in q] for q in sentences]
-        else:
+        elif input is None:
             input = batch_loader.next_batch(batch_size, 'test')
 
         input = [var.cuda() if use_cuda else var for var in input]
@@ -193,67 +291,81 @@ def validater(generator, discriminator, rollout, batch_loader):
 
     return validate
 
-if __name__ == "__main__":
-    parser = argparse.ArgumentParser(description='Paraphraser')
-    parser.add_argument('--num-iterations', type=int, default=250000, help='num iterations (default: 60000)')
-    parser.add_argument('--batch-size', type=int, default=32, help='batch size (default: 32)')
-    parser.add_argument('--use-cuda', type=bool, default=True, help='use cuda (default: True)')
-    parser.add_argument('--learning-rate', type=float, default=0.0001, help='learning rate (default: 0.0001)')
-    parser.add_argument('--dropout', type=float, default=0.3, help='dropout (default: 0.3)')
-    parser.add_argument('--use-trained', type=bool, default=False, help='load pretrained model (default: False)')
-    parser.add_argument('--model-name', default='', help='name of model to save (default: "")')
-    parser.add_argument('--warmup-step', default=10000, type=float, help='L2 regularization penalty (default: 0.0)')
-    parser.add_argument('--interm-sampling', default=True, type=bool, help='if sample while training (default: False)')
-    args = parser.parse_args()
-
-    if args.use_cuda and not t.cuda.is_available():
-        print('Found no GPU, args.use_cuda = False ')
-        args.use_cuda = False
 
-    batch_loader = BatchLoader()
+def build_batch_loader(args):
+    synthetic = None
+    if args.synthetic:
+        synthetic = SyntheticCorpus(args.synthetic_pairs, num_words=args.synthetic_words, seed=args.synthetic_seed)
+    batch_loader = BatchLoader(synthetic=synthetic)
+    # word vectors and pairs in shared memory, child processes attach to them
+    return batch_loader.share() if args.share_data else batch_loader
+
+
+def main(args, batch_loader=None):
+    '''
+    batch_loader: optional loader shared by the launching process
+    '''
+    if batch_loader is None:
+        batch_loader = build_batch_loader(args)
+    vocab_fingerprint = fingerprint(describe(batch_loader))
+    if distributed.is_distributed():
+        batch_loader.shard(distributed.get_rank(), distributed.get_world_size())
     parameters = Parameters(batch_loader.max_seq_len,
-                            batch_loader.vocab_size)
+                            batch_loader.vocab_size,
+                            discriminator_type=args.discriminator,
+                            checkpoint_encoder=args.checkpoint_encoder,
+                            checkpoint_decoder=args.checkpoint_decoder)
 
     generator = Generator(parameters)
-    discriminator = Discriminator(parameters)
-
-    # Loss main path
-    ce_result_valid, ce_result_train, ce_cur_train = [], [], []
-    # Loss second path
-    ce2_result_valid, ce2_result_train, ce2_cur_train = [], [], []
-    # KLD loss
-    kld_result_valid, kld_result_train, kld_cur_train = [], [], []
-    # Generator-discriminator loss
-    dg_result_valid, dg_result_train, dg_cur_train = [], [], []
-    # Discriminator loss
-    d_result_valid, d_result_train, d_cur_train = [], [], []
+    discriminator = build_discriminator(parameters)
+
+    # main path, second path, KLD, generator-discriminator and discriminator losses
+    metric_names = ['ce', 'ce2', 'kld', 'dg', 'd']
+
+    # windowed loss sums stay on the device until a logging interval
+    device = 'cuda' if args.use_cuda else 'cpu'
+    train_metrics = MetricsAccumulator(metric_names, device)
+    valid_metrics = MetricsAccumulator(metric_names, device)
 
     generator = Generator(parameters)
-    discriminator = Discriminator(parameters)
+    discriminator = build_discriminator(parameters)
 
     print(f'Number of parameters in generator: {sum(p.numel() for p in generator.learnable_parameters())}')
     print(f'Number of parameters in discriminator: {sum(p.numel() for p in discriminator.learnable_parameters())}')
 
     # Create locations to store logs
-    if not os.path.isdir('logs/'+ args.model_name):
+    if distributed.is_master() and not os.path.isdir('logs/'+ args.model_name):
         os.mkdir('logs/'+ args.model_name)
-    if args.interm_sampling and not os.path.isdir('logs/'+ args.model_name + '/intermediate'):
+    if distributed.is_master() and args.interm_sampling and not os.path.isdir('logs/'+ args.model_name + '/intermediate'):
         os.mkdir('logs/'+ args.model_name + '/intermediate')
 
 
-    if args.use_trained:
-        generator.load_state_dict(t.load('saved_models/trained_generator_' + args.model_name))
-        discriminator.load_state_dict(t.load('saved_models/trained_discriminator_' + args.model_name))
-        ce_result_valid = list(np.load('logs/{}/ce_result_valid.npy'.format(args.model_name)))
-        ce_result_train = list(np.load('logs/{}/ce_result_train.npy'.format(args.model_name)))
-        ce2_result_train = list(np.load('logs/{}/ce2_result_train.npy'.format(args.model_name)))
-        ce2_result_valid = list(np.load('logs/{}/ce2_result_valid.npy'.format(args.model_name)))
-        kld_result_valid = list(np.load('logs/{}/kld_result_valid.npy'.format(args.model_name)))
-        kld_result_train = list(np.load('logs/{}/kld_result_train.npy'.format(args.model_name)))
-        dg_result_train = list(np.load('logs/{}/dg_result_train.npy'.format(args.model_name)))
-        dg_result_valid = list(np.load('logs/{}/dg_result_valid.npy'.format(args.model_name)))
-        d_result_train = list(np.load('logs/{}/d_result_train.npy'.format(args.model_name)))
-        d_result_valid = list(np.load('logs/{}/d_result_valid.npy'.format(args.model_name)))
+    checkpoints = CheckpointManager('saved_models/checkpoints_' + args.model_name, 'gan', args.keep_checkpoints)
+    checkpoint = checkpoints.load(map_location='cpu') if args.use_trained else None
+    start_iteration = 0
+
+    if checkpoint is not None:
+        if checkpoint.get('vocab', vocab_fingerprint) != vocab_fingerprint:
+            raise ValueError('checkpoint was trained with a different vocabulary')
+        generator.load_state_dict(checkpoint['generator'])
+        discriminator.load_state_dict(checkpoint['discriminator'])
+    elif args.use_trained:
+        # weights only, optimizer state and iteration start over
+        generator.load_state_dict(t.load(latest_weights('saved_models/trained_generator_' + args.model_name)))
+        discriminator.load_state_dict(t.load(latest_weights('saved_models/trained_discriminator_' + args.model_name)))
+
+    # vocabularies and word vectors for the sampling scripts, see BatchLoader.from_artifact
+    if distributed.is_master():
+        save_vocab(batch_loader, artifact_path(args.model_name))
+
+    # one record of train and validation losses per logging interval
+    metrics_log = None
+    if distributed.is_master():
+        log_columns = ['{}_result_{}'.format(name, split) for split in ['train', 'valid'] for name in metric_names]
+        metrics_log = MetricsLog('logs/{}/metrics.log'.format(args.model_name), log_columns, append=args.use_trained)
+        if checkpoint is not None:
+            # records past the checkpoint are logged again after resuming
+            metrics_log.truncate(checkpoint['iteration'])
 
     if args.use_cuda:
         generator = generator.cuda()
@@ -266,84 +378,112 @@ if __name__ == "__main__":
     rollout = Rollout(generator, discriminator, 0.8, rollout_num)
 
     # discriminator, d_optim = amp.initialize(discriminator, d_optim, opt_level="O1")
-    scaler = amp.GradScaler()
-
-    train_step = trainer(generator, g_optim, discriminator, d_optim, rollout, batch_loader, scaler)
+    precision = PrecisionPolicy(args.precision, args.use_cuda)
+    scaler = precision.scaler
+
+    replay_buffer = None
+    if args.replay_buffer_size > 0:
+        replay_buffer = ReplayBuffer(args.replay_buffer_size, parameters.max_seq_len,
+                                     batch_loader.get_idx_by_word(batch_loader.end_label),
+                                     eviction=args.replay_eviction)
+
+    if checkpoint is not None:
+        g_optim.load_state_dict(checkpoint['g_optim'])
+        d_optim.load_state_dict(checkpoint['d_optim'])
+        scaler.load_state_dict(checkpoint['scaler'])
+        if replay_buffer is not None and checkpoint['replay_buffer'] is not None:
+            replay_buffer.load_state_dict(checkpoint['replay_buffer'])
+        set_rng_state(checkpoint['rng'])
+        start_iteration = checkpoint['iteration'] + 1
+        del checkpoint
+
+    train_step = trainer(generator, g_optim, discriminator, d_optim, rollout, batch_loader, precision,
+                         replay_buffer=replay_buffer, d_g_ratio=args.d_g_ratio,
+                         g_model=distributed.wrap(generator, args.use_cuda),
+                         d_model=distributed.wrap(discriminator, args.use_cuda),
+                         budget=AccumulationBudget(args.accumulate_tokens, args.accumulate_sentences))
     validate = validater(generator, discriminator, rollout, batch_loader)
 
+    validation_set = None
+    if args.valid_size > 0 and distributed.is_master():
+        validation_set = ValidationSet(batch_loader, args.valid_size, args.valid_batch_size)
+        if args.use_cuda:
+            validation_set.to('cuda')
+
 
 #    converge_criterion, converge_count = 1000, 0
 #    best_total_loss = np.inf
 
     start = time.time_ns()
 
-    for iteration in range(args.num_iterations):
-        if iteration <= args.warmup_step:
-            lambda3 = iteration / (1. * args.warmup_step) * lambdas[2]
-            lambda2 = iteration / (1. * args.warmup_step) * lambdas[1]
-            lambda1 = 1 - lambda2
-
-
-        (ce_1, ce_2, dg_loss, d_loss), kld = train_step(iteration, args.batch_size, args.use_cuda, args.dropout)
+    # intermediate samples are decoded by a separate process
+    sampling_worker = None
+    if args.interm_sampling and distributed.is_master():
+        sampling_worker = SamplingWorker(functools.partial(Generator, parameters), batch_loader, args.model_name, args.use_cuda,
+                                         batch_size=args.sampling_batch_size,
+                                         from_normal=not parameters.use_two_path_loss,
+                                         bleu=args.sampling_bleu)
+
+    # per-stage timings of the training steps, reported at every logging interval
+    if args.profile and distributed.is_master():
+        profiler.enable(synchronize=args.use_cuda, trace_window=args.profile_trace,
+                        trace_path='logs/{}/trace.json'.format(args.model_name))
+
+    for iteration in range(start_iteration, args.num_iterations):
+        profiler.step(iteration)
+        warmup = min(iteration, args.warmup_step) / (1. * args.warmup_step)
+        lambda3 = warmup * lambdas[2]
+        lambda2 = warmup * lambdas[1]
+        lambda1 = 1 - lambda2
+
+
+        (ce_1, ce_2, dg_loss, d_loss), kld = train_step(iteration, args.batch_size, args.use_cuda, args.dropout,
+                                                      (lambda1, lambda2, lambda3))
         # t.cuda.empty_cache()
 
         # Store losses
-        ce_cur_train += [ce_1.data.cpu().numpy()]
-        ce2_cur_train += [ce_2.data.cpu().numpy()]
-        kld_cur_train += [kld.data.cpu().numpy()]
-        dg_cur_train += [dg_loss.data.cpu().numpy()]
-        d_cur_train += [d_loss.data.cpu().numpy()]
+        train_metrics.update(ce=ce_1, ce2=ce_2, kld=kld, dg=dg_loss, d=d_loss)
 
         # validation
-        if iteration % 500 == 0     :
-            ce_result_train += [np.mean(ce_cur_train)]
-            ce2_result_train += [np.mean(ce2_cur_train)]
-            kld_result_train += [np.mean(kld_cur_train)]
-            dg_result_train += [np.mean(dg_cur_train)]
-            d_result_train += [np.mean(d_cur_train)]
-
-
-            ce_cur_train, ce2_cur_train, kld_cur_train, dg_cur_train, d_cur_train = [], [], [], [], []
+        if iteration % 500 == 0 and distributed.is_master():
+            train_means = train_metrics.means()
 
             print('\n')
             print('------------TRAIN-------------')
             print('----------ITERATION-----------')
             print(iteration)
             print('--------CROSS-ENTROPY---------')
-            print(f'{ce_result_train[-1]}\t (lambda1: {lambda1})')
+            print(f'{train_means["ce"]}\t (lambda1: {lambda1})')
             print('----CROSS-ENTROPY-2ND PATH----')
-            print(f'{ce2_result_train[-1]}\t (lambda2: {lambda2})')
+            print(f'{train_means["ce2"]}\t (lambda2: {lambda2})')
             print('--------------DG--------------')
-            print(f'{dg_result_train[-1]}\t (lambda3: {lambda3})')
+            print(f'{train_means["dg"]}\t (lambda3: {lambda3})')
             print('-------------KLD--------------')
-            print(f'{kld_result_train[-1]}\t (lambda1: {lambda1})')
+            print(f'{train_means["kld"]}\t (lambda1: {lambda1})')
             print('-------Discriminator----------')
-            print(f'{d_result_train[-1]}')
+            print(f'{train_means["d"]}')
             print('------------------------------')
 
+            if args.profile:
+                print_report(profiler.dump('logs/{}/profile.{}'.format(args.model_name, args.profile_format), iteration))
+
 
             # averaging across several batches
-            ce_1, ce_2, kld, dg_loss, d_loss = [], [], [], [], []
-            for i in range(20):
-                (c1, c2, kl, dg, d), _ = validate(args.batch_size, args.use_cuda)
-                ce_1 += [c1.data.cpu().numpy()]
-                ce_2 += [c2.data.cpu().numpy()]
-                kld += [kl.data.cpu().numpy()]
-                dg_loss += [dg.data.cpu().numpy()]
-                d_loss += [d.data.cpu().numpy()]
-
-
-            ce_1 = np.mean(ce_1)
-            ce_2 = np.mean(ce_2)
-            kld = np.mean(kld)
-            dg_loss = np.mean(dg_loss)
-            d_loss = np.mean(d_loss)
-
-            ce_result_valid += [ce_1]
-            ce2_result_valid += [ce_2]
-            kld_result_valid += [kld]
-            dg_result_valid += [dg_loss]
-            d_result_valid += [d_loss]
+            if validation_set is not None:
+                for input in validation_set:
+                    (c1, c2, kl, dg, d), _ = validate(input[0].size(0), args.use_cuda, input=input)
+                    valid_metrics.update(input[0].size(0), ce=c1, ce2=c2, kld=kl, dg=dg, d=d)
+            else:
+                for i in range(20):
+                    (c1, c2, kl, dg, d), _ = validate(args.batch_size, args.use_cuda)
+                    valid_metrics.update(ce=c1, ce2=c2, kld=kl, dg=dg, d=d)
+
+            valid_means = valid_metrics.means()
+            ce_1, ce_2, kld = valid_means['ce'], valid_means['ce2'], valid_means['kld']
+            dg_loss, d_loss = valid_means['dg'], valid_means['d']
+
+            values = [train_means[name] for name in metric_names] + [valid_means[name] for name in metric_names]
+            metrics_log.append(iteration, **dict(zip(log_columns, values)))
 
             total_loss = ce_1 * lambda1 + ce_2 *lambda2 + kld * lambda1 + dg_loss * lambda3
  #           if iteration > 10000:
@@ -380,40 +520,100 @@ if __name__ == "__main__":
                 print('sampled: ' + result)
                 print('...........................')
 
+            profiler.exclude()
+
         # save model
+        rng = None
         if (iteration % 10000 == 0 and iteration != 0) or iteration == (args.num_iterations - 1):
-            t.save(generator.state_dict(), 'saved_models/trained_generator_' + args.model_name + '_' + iteration//1000)
-            t.save(discriminator.state_dict(), 'saved_models/trained_discrminator_' + args.model_name + '_' +  iteration//1000)
-            np.save('logs/{}/ce_result_valid.npy'.format(args.model_name), np.array(ce_result_valid))
-            np.save('logs/{}/ce_result_train.npy'.format(args.model_name), np.array(ce_result_train))
-            np.save('logs/{}/kld_result_valid'.format(args.model_name), np.array(kld_result_valid))
-            np.save('logs/{}/kld_result_train'.format(args.model_name), np.array(kld_result_train))
-            np.save('logs/{}/ce2_result_valid.npy'.format(args.model_name), np.array(ce2_result_valid))
-            np.save('logs/{}/ce2_result_train.npy'.format(args.model_name), np.array(ce2_result_train))
-            np.save('logs/{}/dg_result_valid.npy'.format(args.model_name), np.array(dg_result_valid))
-            np.save('logs/{}/dg_result_train.npy'.format(args.model_name), np.array(dg_result_train))
-            np.save('logs/{}/d_result_valid.npy'.format(args.model_name), np.array(d_result_valid))
-            np.save('logs/{}/d_result_train.npy'.format(args.model_name), np.array(d_result_train))
+            # random states of every rank, each restores its own
+            rng = get_rng_states()
+        if rng is not None and distributed.is_master():
+            # plain weights for the sampling scripts
+            g_state_dict, d_state_dict = generator.state_dict(), discriminator.state_dict()
+            files = {'saved_models/trained_generator_{}_{}'.format(args.model_name, iteration//1000): g_state_dict,
+                     # memory-mappable copy, see utils.tensorfile.load_weights
+                     'saved_models/trained_generator_{}_{}.tensors'.format(args.model_name, iteration//1000): g_state_dict,
+                     'saved_models/trained_discriminator_{}_{}'.format(args.model_name, iteration//1000): d_state_dict}
+
+            checkpoints.save({'iteration': iteration,
+                              'vocab': vocab_fingerprint,
+                              'generator': g_state_dict,
+                              'discriminator': d_state_dict,
+                              'g_optim': g_optim.state_dict(),
+                              'd_optim': d_optim.state_dict(),
+                              'scaler': scaler.state_dict(),
+                              'replay_buffer': replay_buffer.state_dict() if replay_buffer is not None else None,
+                              'rng': rng}, iteration, files)
 
         #interm sampling
         if (iteration % 10000 == 0 and iteration != 0) or iteration == (args.num_iterations - 1):
-            if args.interm_sampling:
-                args.seq_len = 30
+            if sampling_worker is not None:
+                sampling_worker.submit(iteration, generator.state_dict())
 
-                result, target, source = sample.sample_with_input_file(batch_loader, generator, args)
+    if sampling_worker is not None:
+        sampling_worker.close()
+    checkpoints.wait()
+    if metrics_log is not None:
+        metrics_log.close()
 
-                sampled_file_dst = 'logs/{}/intermediate/sampled_{}k.txt'.format(args.model_name, iteration//1000)
-                target_file_dst = 'logs/{}/intermediate/target_{}k.txt'.format(args.model_name, iteration//1000)
-                source_file_dst = 'logs/{}/intermediate/source_{}k.txt'.format(args.model_name, iteration//1000)
 
-                np.savetxt(sampled_file_dst, np.array(result), delimiter='\n', fmt='%s')
-                np.savetxt(target_file_dst, np.array(target), delimiter='\n', fmt='%s')
-                np.savetxt(source_file_dst, np.array(source), delimiter='\n', fmt='%s')
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Paraphraser')
+    parser.add_argument('--num-iterations', type=int, default=250000, help='num iterations (default: 60000)')
+    parser.add_argument('--batch-size', type=int, default=32, help='batch size (default: 32)')
+    parser.add_argument('--use-cuda', type=bool, default=True, help='use cuda (default: True)')
+    parser.add_argument('--learning-rate', type=float, default=0.0001, help='learning rate (default: 0.0001)')
+    parser.add_argument('--dropout', type=float, default=0.3, help='dropout (default: 0.3)')
+    parser.add_argument('--use-trained', type=bool, default=False, help='load pretrained model (default: False)')
+    parser.add_argument('--model-name', default='', help='name of model to save (default: "")')
+    parser.add_argument('--warmup-step', default=10000, type=float, help='optimizer steps of the lambda warmup (default: 10000)')
+    parser.add_argument('--interm-sampling', default=True, type=bool, help='if sample while training (default: False)')
+    parser.add_argument('--sampling-batch-size', default=64, type=int, help='batch size of the intermediate sampling (default: 64)')
+    parser.add_argument('--sampling-bleu', default=False, type=bool, help='score the intermediate samples with BLEU (default: False)')
+    parser.add_argument('--discriminator', default='lstm', choices=['lstm', 'cnn'], help='discriminator architecture (default: lstm)')
+    parser.add_argument('--d-g-ratio', default=1.0, type=float, help='discriminator updates per generator update (default: 1.0)')
+    parser.add_argument('--replay-buffer-size', default=0, type=int, help='generated sentences kept for discriminator updates, 0 disables (default: 0)')
+    parser.add_argument('--replay-eviction', default='fifo', choices=['fifo', 'reservoir'], help='replay buffer eviction policy (default: fifo)')
+    parser.add_argument('--accumulate-tokens', default=0, type=int, help='target tokens per generator step, 0 disables (default: 0)')
+    parser.add_argument('--accumulate-sentences', default=0, type=int, help='sentence pairs per generator step, 0 disables (default: 0)')
+    parser.add_argument('--checkpoint-encoder', default=False, type=bool, help='recompute encoder activations in backward to save memory (default: False)')
+    parser.add_argument('--checkpoint-decoder', default=False, type=bool, help='recompute decoder rnn and projection activations in backward to save memory (default: False)')
+    parser.add_argument('--precision', default='auto', choices=['auto', 'fp32', 'bf16', 'fp16'], help='precision of the forward passes, auto is fp16 on GPU and fp32 otherwise (default: auto)')
+    parser.add_argument('--profile', default=False, type=bool, help='time the training stages and report them every 500 iterations (default: False)')
+    parser.add_argument('--profile-format', default='json', choices=['json', 'csv'], help='format of logs/<model>/profile.* (default: json)')
+    parser.add_argument('--profile-trace', default=None, type=int, nargs=2, metavar=('START', 'STOP'), help='iterations of a torch profiler trace, needs --profile (default: None)')
+    parser.add_argument('--valid-size', default=640, type=int, help='pairs of the fixed validation set, 0 validates on 20 random batches (default: 640)')
+    parser.add_argument('--valid-batch-size', default=128, type=int, help='batch size of the fixed validation set (default: 128)')
+    parser.add_argument('--keep-checkpoints', default=3, type=int, help='number of full checkpoints kept, at least 1 (default: 3)')
+    parser.add_argument('--world-size', default=1, type=int, help='number of data-parallel processes (default: 1)')
+    parser.add_argument('--synthetic', default=False, type=bool, help='train on a generated Zipf corpus with random word vectors instead of the data files (default: False)')
+    parser.add_argument('--synthetic-pairs', default=20000, type=int, help='train pairs of the synthetic corpus, at least a quarter of --synthetic-words (default: 20000)')
+    parser.add_argument('--synthetic-words', default=30000, type=int, help='distinct words of the synthetic corpus, more than the vocabulary size (default: 30000)')
+    parser.add_argument('--synthetic-seed', default=0, type=int, help='seed of the synthetic corpus (default: 0)')
+    parser.add_argument('--share-data', default=False, type=bool, help='keep word vectors and pairs in shared memory for the worker and data-parallel processes (default: False)')
+    args = parser.parse_args()
 
-                print('------------------------------')
-                print('results saved to: ')
-                print(sampled_file_dst)
-                print(target_file_dst)
-                print(source_file_dst)
+    # the discriminator has to step for its loss to be reported
+    if args.d_g_ratio <= 0:
+        parser.error('--d-g-ratio must be positive')
+    if args.keep_checkpoints < 1:
+        parser.error('--keep-checkpoints must be at least 1')
+    # the corpus has to fill the output vocabulary and leave words for <unk>
+    if args.synthetic and args.synthetic_words <= VOCAB_SIZE:
+        parser.error('--synthetic-words must exceed the vocabulary size {}'.format(VOCAB_SIZE))
+    if args.synthetic and args.synthetic_pairs < min_train_size(args.synthetic_words):
+        parser.error('--synthetic-pairs must be at least {} to cover {} words'.format(
+            min_train_size(args.synthetic_words), args.synthetic_words))
+    if args.use_cuda and not t.cuda.is_available():
+        print('Found no GPU, args.use_cuda = False ')
+        args.use_cuda = False
+    if args.precision == 'auto':
+        args.precision = 'fp16' if args.use_cuda else 'fp32'
+
+    if args.share_data and args.world_size > 1 and 'RANK' not in os.environ:
+        # spawned ranks attach to the loader of this process instead of building their own
+        distributed.launch(functools.partial(main, batch_loader=build_batch_loader(args)), args, args.world_size)
+    else:
+        distributed.launch(main, args, args.world_size)
 
 # End
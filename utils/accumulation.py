@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+import contextlib
+
+import torch as t
+import torch.distributed as dist
+
+from . import distributed
+
+
+class AccumulationBudget:
+    """
+        Effective batch size of one optimizer step, counted in target tokens
+        or in sentences.
+
+        Trainers keep drawing micro-batches until the budget is reached, back
+        propagate every micro-batch loss multiplied by its size and finally
+        divide the gradients by the accumulated size, which gives the exact
+        token (or sentence) weighted mean over the effective batch.
+    """
+    def __init__(self, max_tokens=0, max_sentences=0):
+        assert not (max_tokens and max_sentences), 'set either a token or a sentence budget'
+        self.max_tokens = max_tokens
+        self.max_sentences = max_sentences
+
+    @property
+    def enabled(self):
+        return bool(self.max_tokens or self.max_sentences)
+
+    def size(self, target):
+        '''
+        :param target: [batch_size, seq_len] tensor of target indexes
+        '''
+        if not self.enabled:
+            return 1
+        if self.max_tokens:
+            return target.numel()
+        return target.size(0)
+
+    def reduce(self, size):
+        '''
+        :return: size summed over the ranks of the process group
+        '''
+        if not self.enabled or not distributed.is_distributed():
+            return size
+        total = t.tensor([size], dtype=t.float64)
+        dist.all_reduce(total)
+        return int(total.item())
+
+    def is_full(self, accumulated):
+        '''
+        :param accumulated: total of the reduced sizes
+        '''
+        limit = (self.max_tokens or self.max_sentences) * distributed.get_world_size()
+        return not self.enabled or accumulated >= limit
+
+    def gradient_scale(self, accumulated):
+        '''
+        :param accumulated: total of the reduced sizes
+        :return: factor from the gradients, already averaged over the ranks by
+                 DistributedDataParallel, to the mean over the effective batch
+        '''
+        if not self.enabled:
+            return 1.
+        return distributed.get_world_size() / accumulated
+
+
+def no_sync(model, sync):
+    '''
+        Skip the gradient all-reduce of DistributedDataParallel for micro-batches
+        that do not complete an effective batch.
+    '''
+    if sync or not hasattr(model, 'no_sync'):
+        return contextlib.nullcontext()
+    return model.no_sync()
+
+
+def scale_gradients(parameters, scale):
+    if scale == 1:
+        return
+    for p in parameters:
+        if p.grad is not None:
+            p.grad.data.mul_(scale)
@@ -11,6 +11,12 @@ import fasttext.util
 from tqdm import tqdm
 import pickle5 as pickle
 
+from .shared import SharedArrays, SharedEmbeddingStore
+from .vocab import EmbeddingStore, artifact_path, load_vocab
+
+COLUMNS = ['question1', 'question2']
+VOCAB_SIZE = 20000
+
 def clean_str(string):
     '''
         Tokenization/string cleaning for all datasets except for SST.
@@ -38,9 +44,11 @@ def clean_str(string):
 
 
 class BatchLoader:
-    def __init__(self, vocab_size=20000, sentences=None, datasets={'quora'}, path=''):
+    def __init__(self, vocab_size=VOCAB_SIZE, sentences=None, datasets={'quora'}, path='', synthetic=None):
         '''
             Build vocab for sentences or for data files in path if None.
+            With a utils.synthetic.SyntheticCorpus as synthetic, its pairs and
+            word vectors stand in for the data files and fastText.
         '''
         self.vocab_size = vocab_size
         self.word_to_idx = {}
@@ -55,6 +63,8 @@ class BatchLoader:
         self.df_from_file = None
         self.sampling_file_name = None
         self.datasets = datasets
+        self.synthetic = synthetic
+        self.shared = None
         self.quora_data_files = [path + 'datasets/train140k.csv', path + 'datasets/test.csv']
 
         if sentences is None:
@@ -62,6 +72,90 @@ class BatchLoader:
 
         self.build_vocab(sentences)
 
+    @classmethod
+    def from_artifact(cls, path, fingerprint=None, path_prefix=''):
+        '''
+            Vocabularies and memory-mapped word vectors of an artifact saved
+            with utils.vocab.save_vocab, no corpus is read or rebuilt. Only
+            the sampling methods work, next_batch needs the training data.
+        '''
+        description, word_vec = load_vocab(path, fingerprint)
+
+        batch_loader = cls.__new__(cls)
+        batch_loader.vocab_size = description['vocab_size']
+        batch_loader.max_seq_len = description['max_seq_len']
+        batch_loader.idx_to_word = description['idx_to_word']
+        batch_loader.word_to_idx = {w: i for i, w in enumerate(batch_loader.idx_to_word)}
+        batch_loader.word_vec = word_vec
+        batch_loader.fingerprint = description['fingerprint']
+
+        batch_loader.unk_label = description['labels']['unk']
+        batch_loader.end_label = description['labels']['end']
+        batch_loader.go_label = description['labels']['go']
+
+        batch_loader.df_from_file = None
+        batch_loader.sampling_file_name = None
+        batch_loader.datasets = {'quora'}
+        batch_loader.synthetic = None
+        batch_loader.shared = None
+        batch_loader.quora_data_files = [path_prefix + 'datasets/train140k.csv', path_prefix + 'datasets/test.csv']
+        return batch_loader
+
+    def share(self):
+        '''
+            Move the word vectors and the pairs, as token ids into the rows of
+            the embedding matrix, to a utils.shared.SharedArrays file and drop
+            the dictionary and the data frames. Pickling the loader then only
+            passes the handle, workers, sampling processes and spawned ranks
+            map the same pages instead of receiving a copy. The file lives
+            until this loader is garbage collected or the process exits.
+        :return: self
+        '''
+        words = list(self.word_vec.keys())
+        index = {w: i for i, w in enumerate(words)}
+        arrays = {'embeddings': np.stack([np.asarray(self.word_vec[w]) for w in words])}
+        for file_id, split in enumerate(['train', 'test']):
+            for column in COLUMNS:
+                tokens = [clean_str(s).split() for s in self.data[file_id][column].values]
+                arrays['{}_{}_offsets'.format(split, column)] = np.cumsum([0] + [len(s) for s in tokens], dtype=np.int64)
+                arrays['{}_{}_ids'.format(split, column)] = np.array(
+                    [index.get(w, index['null']) for s in tokens for w in s], dtype=np.int32)
+
+        self.shared = SharedArrays(arrays)
+        self.word_vec = SharedEmbeddingStore(self.shared, words)
+        self.rows = [np.arange(len(self.data[0])), np.arange(len(self.data[1]))]
+        self.data, self.quora, self.synthetic = None, None, None
+        print('SHARED: {:.0f} MB in {}'.format(self.shared.nbytes / 2 ** 20, self.shared.path))
+        return self
+
+    def tokens(self, file_id, rows):
+        '''
+        :return: cleaned question1 and question2 of rows of the train (0) or
+                 test (1) pairs as lists of words
+        '''
+        if self.shared is None:
+            df = self.data[file_id].iloc[rows]
+            return [[clean_str(s).split() for s in df[column].values] for column in COLUMNS]
+
+        split = ['train', 'test'][file_id]
+        words = self.word_vec.words
+        sentences = []
+        for column in COLUMNS:
+            offsets = self.shared['{}_{}_offsets'.format(split, column)]
+            ids = self.shared['{}_{}_ids'.format(split, column)]
+            sentences += [[[words[i] for i in ids[offsets[r]:offsets[r + 1]]] for r in rows]]
+        return sentences
+
+    def pairs(self, file_id):
+        '''
+        :return: question1 and question2 arrays of all train (0) or test (1)
+                 pairs, cleaned strings for a shared loader
+        '''
+        if self.shared is None:
+            return [self.data[file_id][column].values for column in COLUMNS]
+        tokens = self.tokens(file_id, self.rows[file_id])
+        return [np.array([' '.join(s) for s in q], dtype=object) for q in tokens]
+
     def get_encoder_input(self, sentences):
         return [Variable(t.from_numpy(
             self.embed_batch([s + [self.end_label] for s in q]))).float() for q in sentences]
@@ -86,7 +180,9 @@ class BatchLoader:
 
     def input_from_sentences(self, sentences):
         sentences = [[clean_str(s).split() for s in q] for q in sentences]
+        return self.input_from_tokens(sentences)
 
+    def input_from_tokens(self, sentences):
         encoder_input_source, encoder_input_target = self.get_encoder_input(sentences)
         decoder_input_source, decoder_input_target = self.get_decoder_input(sentences)
         target = self.get_target(sentences)
@@ -101,6 +197,9 @@ class BatchLoader:
         if type == 'test':
             file_id = 1
 
+        if self.shared is not None:
+            return self.next_shared_batch(batch_size, file_id, return_sentences)
+
         if balanced:
             df = pd.DataFrame()
             length = batch_size//len(self.datasets)
@@ -123,6 +222,33 @@ class BatchLoader:
         else:
             return input
 
+    def next_shared_batch(self, batch_size, file_id, return_sentences=False):
+        rows = np.random.choice(self.rows[file_id], batch_size, replace=False)
+        sentences = self.tokens(file_id, rows)
+
+        # swap source and target
+        if np.random.rand() < 0.5:
+            sentences = [sentences[1], sentences[0]]
+
+        input = self.input_from_tokens(sentences)
+        if return_sentences:
+            return input, sentences
+        else:
+            return input
+
+    def shard(self, rank, world_size):
+        '''
+            Keep every world_size-th training pair starting at rank, so that
+            data-parallel processes draw batches from disjoint parts of the data.
+        '''
+        if self.shared is not None:
+            self.rows[0] = self.rows[0][rank::world_size]
+            print('SHARD {}/{}: train: {}'.format(rank, world_size, len(self.rows[0])))
+            return
+        self.quora[0] = self.quora[0].iloc[rank::world_size].reset_index(drop=True)
+        self.data[0] = self.data[0].iloc[rank::world_size].reset_index(drop=True)
+        print('SHARD {}/{}: train: {}'.format(rank, world_size, len(self.data[0])))
+
     def next_batch_from_file(self, batch_size, file_name='quora_test', return_sentences=False):
         if self.sampling_file_name is None \
             or self.sampling_file_name != file_name \
@@ -132,11 +258,15 @@ class BatchLoader:
             self.cur_file_point = 0
 
             predefined_datasets = {
-                'quora_test': [pd.read_csv(f)[['question1', 'question2']] for f in self.quora_data_files]
+                'quora_test': lambda: pd.read_csv(self.quora_data_files[1])[['question1', 'question2']]
             }
+            if self.synthetic is not None:
+                predefined_datasets['quora_test'] = lambda: self.synthetic.data[1]
+            if self.shared is not None:
+                predefined_datasets['quora_test'] = lambda: pd.DataFrame(dict(zip(COLUMNS, self.pairs(1))))
 
             if file_name in predefined_datasets.keys():
-                self.df_from_file = predefined_datasets[file_name][1]
+                self.df_from_file = predefined_datasets[file_name]()
             else:
                 self.df_from_file = pd.read_csv(file_name)
 
@@ -256,7 +386,15 @@ class BatchLoader:
 
     def build_fasttext(self, word_dict):
         # create word_vec with fastText vectors
-        if not os.path.exists('word_vec.pkl'):
+        if isinstance(self.word_vec, EmbeddingStore):
+            # vectors of an artifact, unknown words fall back to 'null' as
+            # with a cached word_vec.pkl
+            return
+        elif self.synthetic is not None:
+            for word in word_dict:
+                if word not in self.word_vec:
+                    self.word_vec[word] = self.synthetic.word_vector(word)
+        elif not os.path.exists('word_vec.pkl'):
             ft = fasttext.load_model('cc.sv.300.bin')
             for word in tqdm(word_dict):
                 vec = np.array(ft.get_word_vector(word))
@@ -298,9 +436,29 @@ class BatchLoader:
     def read_train_test_dataset(self):
         self.data = [pd.DataFrame(), pd.DataFrame()]
 
-        self.quora = [pd.read_csv(f)[['question1', 'question2']] for f in self.quora_data_files]
+        if self.synthetic is not None:
+            self.quora = [df.copy() for df in self.synthetic.data]
+        else:
+            self.quora = [pd.read_csv(f)[['question1', 'question2']] for f in self.quora_data_files]
         # self.quora[0] = self.quora[0]#[:1000]
         # self.quora[1] = self.quora[1]#[:100]
         print('QUORA: train: {}, test: {}'.format(len(self.quora[0]), len(self.quora[1])))
         self.data = [d.append(q, ignore_index=True) for d,q in zip(self.data, self.quora)]
         print('ALL: train: {}, test: {}'.format(len(self.data[0]), len(self.data[1])))
+
+
+def load_batch_loader(model_name):
+    '''
+        BatchLoader from the vocabulary artifact saved with the model, or
+        built from the data files for models trained before artifacts.
+    '''
+    paths = [artifact_path(model_name)]
+    # generator weights of trainGAN.py carry the thousands of iterations,
+    # NAME_140, and share the artifact of NAME
+    match = re.match(r'(.+)_\d+$', model_name)
+    if match and os.path.exists('saved_models/trained_generator_' + model_name):
+        paths.append(artifact_path(match.group(1)))
+    for path in paths:
+        if os.path.exists(os.path.join(path, 'vocab.json')):
+            return BatchLoader.from_artifact(path)
+    return BatchLoader()
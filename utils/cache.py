@@ -0,0 +1,332 @@
+# -*- coding: utf-8 -*-
+"""
+    Result cache of the paraphrase service, in front of a
+    utils.serving.MicroBatcher.
+
+    Paraphrases are cached per sentence, keyed by the cleaned sentence, the
+    decoding options and a fingerprint of the served model, so new weights
+    never return old results. The memory tier holds at most max_entries
+    results and max_bytes of text, evicting the least recently used, and
+    every result expires ttl seconds after it was decoded. An optional
+    sqlite file in directory keeps results across restarts, with the same
+    ttl and at most max_disk_entries, the oldest evicted first.
+
+    Only the mean mode is deterministic. Results of the stochastic modes
+    either bypass the cache, or are cached in shards: every request draws
+    one of shards keys at random, so a sentence gets up to shards different
+    cached paraphrases instead of one.
+
+    Identical sentences requested while one of them is decoded wait for
+    that result instead of being decoded again, they count as coalesced
+    rather than as misses.
+
+    Results are cached per sentence since the MicroBatcher decodes every
+    sentence independently of the ones it is batched with, the padding
+    bucket of the batcher is part of the key.
+"""
+import collections
+import concurrent.futures
+import hashlib
+import json
+import os
+import random
+import sqlite3
+import threading
+import time
+
+from .serving import Request
+
+
+def file_fingerprint(*paths):
+    '''
+    :return: sha256 of the contents of the files at paths
+    '''
+    digest = hashlib.sha256()
+    for path in paths:
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(2 ** 20), b''):
+                digest.update(block)
+    return digest.hexdigest()
+
+
+class DiskCache:
+    """
+        Results in a sqlite file, safe to use from several threads.
+    """
+    def __init__(self, path, ttl, max_entries):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.puts = 0
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+        self.connection.execute('CREATE TABLE IF NOT EXISTS results (key TEXT PRIMARY KEY, value TEXT, created REAL)')
+        self.connection.execute('CREATE INDEX IF NOT EXISTS results_created ON results (created)')
+        self.connection.commit()
+
+    def get(self, key):
+        with self.lock:
+            row = self.connection.execute('SELECT value, created FROM results WHERE key = ?', (key,)).fetchone()
+        if row is None or time.time() - row[1] > self.ttl:
+            return None, None
+        return json.loads(row[0]), row[1]
+
+    def put(self, key, value, created):
+        with self.lock:
+            self.connection.execute('INSERT OR REPLACE INTO results VALUES (?, ?, ?)', (key, json.dumps(value), created))
+            # expired and surplus results are removed every 1000 results
+            self.puts += 1
+            if self.puts % 1000 == 0:
+                self.connection.execute('DELETE FROM results WHERE created < ?', (time.time() - self.ttl,))
+                self.connection.execute('DELETE FROM results WHERE key IN (SELECT key FROM results ORDER BY created DESC '
+                                        'LIMIT -1 OFFSET ?)', (self.max_entries,))
+            self.connection.commit()
+
+    def __len__(self):
+        with self.lock:
+            return self.connection.execute('SELECT COUNT(*) FROM results').fetchone()[0]
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
+
+class ResultCache:
+    """
+        LRU and TTL bounded results with an optional DiskCache below.
+
+        Keys are strings, values JSON serializable lists of paraphrases.
+    """
+    def __init__(self, max_entries=10000, max_bytes=64 * 2 ** 20, ttl=3600., directory=None, max_disk_entries=1000000):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        # key -> (value, created, size), least recently used first
+        self.entries = collections.OrderedDict()
+        self.bytes = 0
+        self.counters = collections.Counter()
+
+        self.disk = None
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+            self.disk = DiskCache(os.path.join(directory, 'results.sqlite'), ttl, max_disk_entries)
+
+    def get(self, key, count_miss=True):
+        '''
+        :param count_miss: count a missing key as a miss, else the caller
+            counts it
+        :return: the cached value of key, None if there is none
+        '''
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                if time.time() - entry[1] <= self.ttl:
+                    self.entries.move_to_end(key)
+                    self.counters['hits'] += 1
+                    return entry[0]
+                self.remove(key)
+                self.counters['expired'] += 1
+
+        if self.disk is not None:
+            value, created = self.disk.get(key)
+            if value is not None:
+                self.count('disk_hits')
+                self.insert(key, value, created)
+                return value
+        if count_miss:
+            self.count('misses')
+        return None
+
+    def put(self, key, value):
+        created = time.time()
+        self.insert(key, value, created)
+        if self.disk is not None:
+            self.disk.put(key, value, created)
+
+    def insert(self, key, value, created):
+        size = len(key) + sum(len(s) for s in value)
+        with self.lock:
+            if key in self.entries:
+                self.remove(key)
+            self.entries[key] = (value, created, size)
+            self.bytes += size
+            while self.entries and (len(self.entries) > self.max_entries or self.bytes > self.max_bytes):
+                self.remove(next(iter(self.entries)))
+                self.counters['evicted'] += 1
+
+    def count(self, name):
+        with self.lock:
+            self.counters[name] += 1
+
+    def remove(self, key):
+        _, _, size = self.entries.pop(key)
+        self.bytes -= size
+
+    def stats(self):
+        '''
+        :return: sizes and counters, hit_rate is the share of the lookups
+                 answered without decoding, from memory, disk or a coalesced
+                 decode
+        '''
+        with self.lock:
+            counters = dict(self.counters)
+            result = {'entries': len(self.entries), 'bytes': self.bytes}
+        answered = sum(counters.get(name, 0) for name in ['hits', 'disk_hits', 'coalesced'])
+        lookups = answered + counters.get('misses', 0)
+        result.update(counters)
+        result['hit_rate'] = answered / lookups if lookups else 0.
+        if self.disk is not None:
+            result['disk_entries'] = len(self.disk)
+        return result
+
+    def close(self):
+        if self.disk is not None:
+            self.disk.close()
+
+
+class CachedBatcher:
+    """
+        MicroBatcher behind a ResultCache, with the same submit, metrics,
+        sampler and close.
+
+        stochastic is 'bypass' or 'shard', what to do with the results of
+        the posterior and prior modes, see the module docstring.
+    """
+    def __init__(self, batcher, cache, fingerprint, stochastic='bypass', shards=8):
+        assert stochastic in ('bypass', 'shard')
+        self.batcher = batcher
+        self.cache = cache
+        self.fingerprint = fingerprint
+        self.stochastic = stochastic
+        self.shards = shards
+        self.lock = threading.Lock()
+        # key -> future of the result being decoded
+        self.inflight = {}
+
+    @property
+    def metrics(self):
+        return self.batcher.metrics
+
+    @property
+    def sampler(self):
+        return self.batcher.sampler
+
+    def key(self, sentence, request, shard):
+        '''
+        :return: cache key of sentence decoded with the options of request,
+                 None if it bypasses the cache
+        '''
+        if request.mode != 'mean' and self.stochastic == 'bypass':
+            return None
+        content = [self.fingerprint, sentence, request.mode, request.num_samples, request.beam_size, request.max_len,
+                   getattr(self.batcher, 'bucket', None), 0 if request.mode == 'mean' else shard]
+        return hashlib.sha256(json.dumps(content).encode('utf-8')).hexdigest()
+
+    def submit(self, request):
+        '''
+        :return: future of the paraphrases of every sentence of request,
+                 cached ones are not decoded again
+        '''
+        shard = random.randrange(self.shards)
+        results = [None] * len(request.sentences)
+        decode, owned, waits = [], {}, []
+
+        for i, sentence in enumerate(request.sentences):
+            key = self.key(sentence, request, shard)
+            if key is None:
+                self.cache.count('bypassed')
+                decode.append(i)
+                continue
+            value = self.cache.get(key, count_miss=False)
+            if value is not None:
+                results[i] = value
+                continue
+            with self.lock:
+                future = self.inflight.get(key)
+                if future is None:
+                    self.inflight[key] = concurrent.futures.Future()
+                    owned[i] = key
+                    decode.append(i)
+                else:
+                    waits.append((i, future))
+            self.cache.count('misses' if future is None else 'coalesced')
+
+        combined = concurrent.futures.Future()
+        remaining = [len(waits) + bool(decode)]
+        if not remaining[0]:
+            combined.set_result(results)
+            return combined
+
+        def finish(error=None):
+            with self.lock:
+                if combined.done():
+                    return
+                remaining[0] -= 1
+                if error is None and remaining[0]:
+                    return
+            if error is not None:
+                combined.set_exception(error)
+            else:
+                combined.set_result(results)
+
+        def decoded(future):
+            error = future.exception()
+            try:
+                if error is None:
+                    for j, i in enumerate(decode):
+                        results[i] = future.result()[j]
+                        if i in owned:
+                            self.store(owned[i], results[i])
+            except Exception as e:
+                error = e
+            finally:
+                # never leave later requests waiting on a dead future
+                with self.lock:
+                    pending = [(i, self.inflight.pop(key)) for i, key in owned.items()]
+                for i, waiter in pending:
+                    if error is None:
+                        waiter.set_result(results[i])
+                    else:
+                        waiter.set_exception(error)
+                finish(error)
+
+        def waited(i):
+            def callback(future):
+                error = future.exception()
+                if error is None:
+                    results[i] = future.result()
+                finish(error)
+            return callback
+
+        if decode:
+            subrequest = Request([request.sentences[i] for i in decode], request.mode,
+                                 request.num_samples, request.beam_size, request.max_len)
+            try:
+                future = self.batcher.submit(subrequest)
+            except RuntimeError as e:
+                with self.lock:
+                    pending = [self.inflight.pop(key) for key in owned.values()]
+                for future in pending:
+                    future.set_exception(e)
+                raise
+            future.add_done_callback(decoded)
+        for i, future in waits:
+            future.add_done_callback(waited(i))
+        return combined
+
+    def store(self, key, value):
+        '''
+            Cache value of key. A failing cache, e.g. a locked database or a
+            full disk, only costs decoding it again.
+        '''
+        try:
+            self.cache.put(key, value)
+        except Exception as e:
+            self.cache.count('put_errors')
+            print('result cache: {}: {}'.format(type(e).__name__, e))
+
+    def close(self):
+        self.batcher.close()
+        self.cache.close()
@@ -0,0 +1,183 @@
+# -*- coding: utf-8 -*-
+import glob
+import io
+import os
+import random
+import threading
+
+import numpy as np
+import torch as t
+import torch.distributed as dist
+
+from . import distributed, tensorfile
+
+
+def snapshot(obj, memo=None):
+    '''
+        Copy of obj with every tensor cloned to the cpu and every container
+        rebuilt, so that training can continue while the copy is written.
+        Tensors shared between several entries are copied once.
+    '''
+    memo = {} if memo is None else memo
+    if isinstance(obj, t.Tensor):
+        if id(obj) not in memo:
+            memo[id(obj)] = obj.detach().cpu().clone()
+        return memo[id(obj)]
+    if isinstance(obj, dict):
+        copy = type(obj)((k, snapshot(v, memo)) for k, v in obj.items())
+        # state_dict version information
+        if hasattr(obj, '_metadata'):
+            copy._metadata = obj._metadata
+        return copy
+    if isinstance(obj, (list, tuple)):
+        return type(obj)(snapshot(v, memo) for v in obj)
+    if isinstance(obj, np.ndarray):
+        return obj.copy()
+    if isinstance(obj, np.generic):
+        return obj.item()
+    return obj
+
+
+def encode_numpy_rng(state):
+    '''
+        np.random state with the key array as a tensor, checkpoints then hold
+        only tensors and python primitives and load with weights_only.
+    '''
+    kind, keys, pos, has_gauss, cached_gaussian = state
+    return (kind, t.from_numpy(keys.copy()), pos, has_gauss, cached_gaussian)
+
+
+def decode_numpy_rng(state):
+    kind, keys, pos, has_gauss, cached_gaussian = state
+    return (kind, keys.numpy(), pos, has_gauss, cached_gaussian)
+
+
+def get_rng_state():
+    state = {'python': random.getstate(),
+             'numpy': encode_numpy_rng(np.random.get_state()),
+             'torch': t.get_rng_state()}
+    if t.cuda.is_available():
+        state['cuda'] = t.cuda.get_rng_state_all()
+    return state
+
+
+def get_rng_states():
+    '''
+        get_rng_state() of every rank of the process group, in rank order.
+        Every rank has to call it.
+    '''
+    state = get_rng_state()
+    if not distributed.is_distributed():
+        return [state]
+    # serialized by torch.save, all_gather_object fails on pickled tensors
+    buffer = io.BytesIO()
+    t.save(state, buffer)
+    states = [None] * distributed.get_world_size()
+    dist.all_gather_object(states, buffer.getvalue())
+    return [t.load(io.BytesIO(state)) for state in states]
+
+
+def set_rng_state(state):
+    '''
+    state: get_rng_state(), or get_rng_states() of which the state of this
+        rank is restored. Ranks past the saved ones keep their own state.
+    '''
+    if isinstance(state, list):
+        if distributed.get_rank() >= len(state):
+            return
+        state = state[distributed.get_rank()]
+    random.setstate(state['python'])
+    np.random.set_state(decode_numpy_rng(state['numpy']))
+    t.set_rng_state(state['torch'])
+    if 'cuda' in state and t.cuda.is_available():
+        t.cuda.set_rng_state_all(state['cuda'])
+
+
+def atomic_save(obj, path):
+    '''
+        Write obj next to path and rename it into place, a crash never leaves
+        a truncated file behind. Arrays are written with np.save, state_dicts
+        to a .tensors path as a tensor file, anything else with torch.save.
+    '''
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        if isinstance(obj, np.ndarray):
+            np.save(f, obj)
+        elif path.endswith(tensorfile.SUFFIX):
+            tensorfile.write_tensors(f, obj)
+        else:
+            t.save(obj, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+class CheckpointManager:
+    """
+        Full training checkpoints written by a background thread.
+
+        save() snapshots the state to the cpu on the calling thread and returns,
+        the write happens in the background with an atomic rename. Only the
+        last `keep` checkpoints are kept. At most one write is in flight, a
+        new save() first waits for the previous one.
+    """
+    def __init__(self, directory, prefix, keep=3):
+        # the newest checkpoint is the one to resume from, it is always kept
+        if keep < 1:
+            raise ValueError('keep must be at least 1, got {}'.format(keep))
+        self.directory = directory
+        self.prefix = prefix
+        self.keep = keep
+        self.thread = None
+        self.error = None
+
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, iteration):
+        return os.path.join(self.directory, '{}_{:09d}.pt'.format(self.prefix, iteration))
+
+    def checkpoints(self):
+        return sorted(glob.glob(os.path.join(self.directory, self.prefix + '_*.pt')))
+
+    def latest(self):
+        checkpoints = self.checkpoints()
+        return checkpoints[-1] if checkpoints else None
+
+    def load(self, path=None, map_location=None):
+        path = self.latest() if path is None else path
+        if path is None:
+            return None
+        print('Resuming from {}'.format(path))
+        return t.load(path, map_location=map_location)
+
+    def save(self, state, iteration, files=None):
+        '''
+        state: checkpoint dictionary (model, optimizer, iteration, rng ...)
+        files: optional {path: object} written in the same background job,
+            e.g. the plain state_dict used by the sampling scripts
+        '''
+        memo = {}
+        state = snapshot(state, memo)
+        files = snapshot(files or {}, memo)
+
+        self.wait()
+        self.thread = threading.Thread(target=self._write, args=(state, iteration, files))
+        self.thread.start()
+
+    def _write(self, state, iteration, files):
+        try:
+            atomic_save(state, self.path(iteration))
+            for path, obj in files.items():
+                atomic_save(obj, path)
+            for path in self.checkpoints()[:-self.keep]:
+                os.remove(path)
+        except Exception as e:
+            self.error = e
+
+    def wait(self):
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise error
@@ -0,0 +1,142 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+import torch as t
+
+from .batch_loader import clean_str
+
+
+def output_embedding(batch_loader):
+    '''
+        [vocab_size, embed_size] tensor with the decoder input of every output
+        word, the same vector get_raw_input_from_sentences builds for it.
+    '''
+    null = batch_loader.word_vec['null']
+    embedding = np.stack([batch_loader.word_vec.get(word, null) for word in batch_loader.idx_to_word])
+    return t.from_numpy(embedding).float()
+
+
+def greedy_decode(model, batch_loader, source_input, seq_len, use_cuda, embedding, from_normal=False, noise=None,
+                  shortlist=None):
+    '''
+        Most likely continuation of every source sentence of a batch, decoded
+        step by step for the whole batch at once. Matches
+        sample_with_input / sample_from_normal with ml=True.
+
+    :param model: Paraphraser or Generator
+    :param source_input: embedded sources with end label, [batch_size, seq_len, embed_size]
+    :param embedding: output_embedding of batch_loader, on the model device
+    :param from_normal: draw z from the prior instead of the source posterior
+    :param noise: optional [batch_size, latent_variable_size] standard normal
+        draws of z instead of random ones
+    :param shortlist: optional utils.shortlist.ShortlistProjection of the
+        batch, the next word is chosen among its candidates only
+    :return: list of decoded sentences
+    '''
+    batch_size = source_input.size(0)
+    if use_cuda:
+        source_input = source_input.cuda()
+
+    if noise is None:
+        z = t.randn([batch_size, model.params.latent_variable_size], device=source_input.device)
+    else:
+        z = t.as_tensor(noise, dtype=t.float, device=source_input.device)
+    if not from_normal:
+        mu, logvar = model.encoder(source_input, None)
+        z = z * t.exp(0.5 * logvar) + mu
+
+    state = model.decoder.build_initial_state(source_input)
+    decoder_input = batch_loader.get_raw_input_from_sentences([batch_loader.go_label])
+    decoder_input = decoder_input.to(source_input.device).expand(batch_size, 1, -1)
+
+    unk_idx = batch_loader.get_idx_by_word(batch_loader.unk_label)
+    end_idx = batch_loader.get_idx_by_word(batch_loader.end_label)
+    finished = t.zeros(batch_size, dtype=t.bool, device=source_input.device)
+    words = []
+    for i in range(seq_len):
+        if shortlist is None:
+            logits, state = model.decoder(None, decoder_input, z, 0.0, state)
+            logits = logits[:, -1]
+            # never emit <unk>
+            logits[:, unk_idx] = -float('inf')
+            idx = logits.argmax(dim=-1)
+        else:
+            rnn_out, state = model.decoder.rnn_output(decoder_input, z, state)
+            idx = shortlist(rnn_out[:, -1])
+
+        words += [idx]
+        finished |= idx == end_idx
+        if bool(finished.all()):
+            break
+        decoder_input = embedding[idx].unsqueeze(1)
+
+    result = []
+    for row in t.stack(words, dim=1).tolist():
+        sentence = ''
+        for idx in row:
+            if idx == end_idx:
+                break
+            sentence += ' ' + batch_loader.get_word_by_idx(idx)
+        result += [sentence]
+    return result
+
+
+@t.no_grad()
+def decode_sentences(model, batch_loader, sentences, seq_len, use_cuda, batch_size=64, from_normal=False,
+                     shortlist=None, embedding=None):
+    '''
+        Greedy decoding of many source sentences in batches of similar length.
+        The sources of a batch are padded to the longest, the encoders run
+        over the padding, so the output equals decoding every sentence alone
+        only with batch_size 1.
+
+    :param shortlist: optional utils.shortlist.Shortlist, every batch is
+        decoded with the candidates of its sources
+    :param embedding: optional output_embedding of batch_loader on the device
+        of model, built here otherwise
+
+    :return: decoded sentences in the order of sentences
+    '''
+    if embedding is None:
+        embedding = output_embedding(batch_loader)
+        if use_cuda:
+            embedding = embedding.cuda()
+
+    tokens = [clean_str(s).split() for s in sentences]
+    order = np.argsort([len(s) for s in tokens], kind='stable')
+
+    result = [None] * len(tokens)
+    for start in range(0, len(order), batch_size):
+        idx = order[start:start + batch_size]
+        source_input = batch_loader.embed_batch([tokens[i] + [batch_loader.end_label] for i in idx])
+        source_input = t.from_numpy(source_input).float()
+        projection = None
+        if shortlist is not None:
+            projection = shortlist.projection(model.decoder.fc, [tokens[i] for i in idx], embedding.device)
+        decoded = greedy_decode(model, batch_loader, source_input, seq_len, use_cuda, embedding, from_normal,
+                                shortlist=projection)
+        for i, sentence in zip(idx, decoded):
+            result[i] = sentence
+    return result
+
+
+class EagerSampler:
+    """
+        Greedy decoding with decode_sentences behind the interface of
+        utils.scripting.ScriptedSampler, e.g. with a vocabulary shortlist.
+    """
+    def __init__(self, model, batch_loader, use_cuda=False, shortlist=None):
+        self.model = model.eval()
+        self.batch_loader = batch_loader
+        self.use_cuda = use_cuda
+        self.shortlist = shortlist
+        # built once, sample is called per sentence
+        self.embedding = output_embedding(batch_loader)
+        if use_cuda:
+            self.embedding = self.embedding.cuda()
+
+    def sample(self, sentences, seq_len=30, from_normal=False):
+        '''
+        :return: most likely paraphrase of every sentence
+        '''
+        return decode_sentences(self.model, self.batch_loader, sentences, seq_len, self.use_cuda,
+                                len(sentences), from_normal, self.shortlist, self.embedding)
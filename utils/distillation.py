@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+"""
+    Knowledge distillation of a trained Paraphraser into a smaller student.
+
+    The student is trained on the same batches as usual, but each decoder
+    path fits a mix of the target words and the temperature softened word
+    distributions of a frozen teacher, which carry how likely the teacher
+    finds every other word as well. Students have their own sizes, see
+    model.parameters.SIZES, which are saved next to their weights so the
+    sampling scripts build the same architecture.
+
+    Usage: python train.py --teacher-name NAME --model-name STUDENT
+        --encoder-rnn-size 256 --latent-variable-size 256 --decoder-rnn-size 256 --decoder-num-layers 1
+"""
+import json
+import os
+
+import torch as t
+import torch.nn.functional as F
+
+from .vocab import artifact_path, load_vocab
+
+
+SIZES_SUFFIX = '.sizes.json'
+
+
+def save_sizes(parameters, path):
+    '''
+        Write the architecture sizes of parameters and whether the second
+        path is trained next to the weights at path.
+    '''
+    with open(path + SIZES_SUFFIX + '.tmp', 'w') as f:
+        json.dump(dict(parameters.sizes(), use_two_path_loss=parameters.use_two_path_loss), f)
+    os.replace(path + SIZES_SUFFIX + '.tmp', path + SIZES_SUFFIX)
+
+
+def read_sizes(path):
+    if not os.path.exists(path + SIZES_SUFFIX):
+        return {}
+    with open(path + SIZES_SUFFIX) as f:
+        return json.load(f)
+
+
+def load_sizes(path):
+    '''
+    :return: the sizes saved next to the weights at path as keyword arguments
+             of Parameters, empty for weights of the default architecture
+    '''
+    from model.parameters import SIZES
+
+    return {name: value for name, value in read_sizes(path).items() if name in SIZES}
+
+
+def load_two_path_loss(path):
+    '''
+    :return: whether the weights at path were trained with the second path,
+             None if they were saved without saying so
+    '''
+    return read_sizes(path).get('use_two_path_loss')
+
+
+def distillation_loss(logits, teacher_logits, temperature):
+    '''
+        KL divergence of the softened student from the softened teacher
+        distributions, scaled by temperature ** 2 to keep the gradient
+        magnitude of the cross entropy.
+    :param logits, teacher_logits: [num_tokens, vocab_size]
+    :return: mean over tokens
+    '''
+    log_probs = F.log_softmax(logits / temperature, dim=-1)
+    teacher_probs = F.softmax(teacher_logits / temperature, dim=-1)
+    return F.kl_div(log_probs, teacher_probs, reduction='batchmean') * temperature ** 2
+
+
+def load_teacher(model_name, batch_loader, use_two_path_loss=False, use_cuda=False):
+    '''
+        Frozen Paraphraser saved as saved_models/trained_paraphraser_<model_name>,
+        its vocabulary must be the one of batch_loader.
+    :param use_two_path_loss: whether the teacher was trained with the second
+        path, if that was not saved with its sizes
+    '''
+    from model.parameters import Parameters
+    from model.paraphraser import Paraphraser
+    from .tensorfile import load_weights
+    from .vocab import describe, fingerprint
+
+    vocab = artifact_path(model_name)
+    if os.path.exists(os.path.join(vocab, 'vocab.json')):
+        load_vocab(vocab, expected_fingerprint=fingerprint(describe(batch_loader)))
+
+    path = 'saved_models/trained_paraphraser_' + model_name
+    if load_two_path_loss(path) is not None:
+        use_two_path_loss = load_two_path_loss(path)
+    teacher = Paraphraser(Parameters(batch_loader.max_seq_len, batch_loader.vocab_size,
+                                     use_two_path_loss, **load_sizes(path)))
+    load_weights(teacher, path, map_location='cpu')
+    for p in teacher.parameters():
+        p.requires_grad = False
+    return (teacher.cuda() if use_cuda else teacher).eval()
+
+
+class Distillation:
+    """
+        Soft targets of a frozen teacher for Paraphraser.trainer.
+
+        The loss of a decoder path becomes
+            (1 - weight) * cross_entropy + weight * distillation_loss
+        the teacher sees the same batch without dropout. With
+        use_two_path_loss the second path of the student learns from the
+        second path of the teacher, or from its first one if the teacher
+        was trained without it.
+    """
+    def __init__(self, teacher, temperature=2.0, weight=0.5):
+        assert temperature > 0 and 0 <= weight <= 1
+        self.teacher = teacher
+        self.temperature = temperature
+        self.weight = weight
+
+    @t.no_grad()
+    def targets(self, encoder_input, decoder_input, use_cuda):
+        '''
+        :return: teacher logits of both decoder paths, [num_tokens, vocab_size] each
+        '''
+        (logits, logits2), _, _ = self.teacher(0., encoder_input, decoder_input, z=None, use_cuda=use_cuda)
+        logits = logits.float().view(-1, logits.size(-1))
+        logits2 = logits if logits2 is None else logits2.float().view(-1, logits2.size(-1))
+        return logits, logits2
+
+    def loss(self, cross_entropy, logits, teacher_logits):
+        return (1 - self.weight) * cross_entropy \
+             + self.weight * distillation_loss(logits, teacher_logits, self.temperature)
@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+import os
+
+import torch as t
+import torch.distributed as dist
+import torch.multiprocessing as mp
+from torch.nn.parallel import DistributedDataParallel
+
+
+def is_distributed():
+    return dist.is_available() and dist.is_initialized()
+
+
+def get_rank():
+    return dist.get_rank() if is_distributed() else 0
+
+
+def get_world_size():
+    return dist.get_world_size() if is_distributed() else 1
+
+
+def is_master():
+    return get_rank() == 0
+
+
+def barrier():
+    if is_distributed():
+        dist.barrier()
+
+
+def wrap(module, use_cuda):
+    '''
+        Wrap module in DistributedDataParallel when running in a process group,
+        otherwise return it unchanged.
+    '''
+    if not is_distributed():
+        return module
+    if use_cuda:
+        return DistributedDataParallel(module, device_ids=[t.cuda.current_device()])
+    return DistributedDataParallel(module)
+
+
+def _run(rank, main, args, world_size, backend):
+    os.environ.setdefault('MASTER_ADDR', '127.0.0.1')
+    os.environ.setdefault('MASTER_PORT', '29500')
+    dist.init_process_group(backend, rank=rank, world_size=world_size)
+    if args.use_cuda:
+        t.cuda.set_device(rank % t.cuda.device_count())
+    try:
+        main(args)
+    finally:
+        dist.destroy_process_group()
+
+
+def launch(main, args, world_size, backend='gloo'):
+    '''
+        Run main(args) in world_size data-parallel processes.
+
+        Processes started by an external launcher (torch.distributed.launch --use_env,
+        torchrun) are detected through the RANK and WORLD_SIZE environment variables
+        and join that process group instead of spawning new ones.
+    '''
+    if 'RANK' in os.environ and 'WORLD_SIZE' in os.environ:
+        _run(int(os.environ['RANK']), main, args, int(os.environ['WORLD_SIZE']), backend)
+    elif world_size > 1:
+        mp.spawn(_run, args=(main, args, world_size, backend), nprocs=world_size)
+    else:
+        main(args)
@@ -0,0 +1,185 @@
+# -*- coding: utf-8 -*-
+import json
+import os
+import struct
+
+import numpy as np
+import torch as t
+
+
+class MetricsAccumulator:
+    """
+        Running sums of scalar losses kept on the training device.
+
+        update() only queues device-side additions, nothing is copied to the
+        host until means() is called at a logging interval, which synchronizes
+        once for all metrics and starts a new window.
+    """
+    def __init__(self, names, device='cpu'):
+        self.names = list(names)
+        self.device = device
+        self.sums = t.zeros(len(self.names), device=device)
+        self.count = 0
+
+    def update(self, weight=1, **values):
+        '''
+        :param weight: weight of the values in the mean, e.g. the batch size
+        '''
+        for i, name in enumerate(self.names):
+            value = values[name]
+            if isinstance(value, t.Tensor):
+                value = value.detach().float().reshape(())
+            self.sums[i] += weight * value
+        self.count += weight
+
+    def means(self):
+        '''
+        :return: dictionary of the mean of every metric since the last call
+        '''
+        means = (self.sums / max(self.count, 1)).tolist()
+        self.sums.zero_()
+        self.count = 0
+        return dict(zip(self.names, means))
+
+
+class MetricsLog:
+    """
+        Append-only binary log with one record per logging interval.
+
+        The file starts with a magic string, the header length and a json
+        header naming the columns, followed by fixed size little-endian
+        float64 records of the iteration and one value per column. Appending
+        a record never rewrites earlier ones, and a record cut short by a
+        crash is dropped by the reader and by the next writer.
+    """
+    magic = b'RVAELOG1'
+
+    def __init__(self, path, columns, append=False):
+        '''
+        :param path: path of the log file
+        :param columns: names of the logged values, the iteration is implicit
+        :param append: continue an existing log instead of starting a new one
+        '''
+        self.path = path
+        self.columns = list(columns)
+        self.record_size = 8 * (len(self.columns) + 1)
+
+        if append and os.path.exists(path):
+            header = read_header(path)
+            if header is None or header['columns'] != self.columns:
+                raise ValueError('metrics log {} does not have columns {}'.format(path, self.columns))
+            self.header_size = header['size']
+            # drop a partial record left by an interrupted run
+            size = os.path.getsize(path)
+            complete = self.header_size + (size - self.header_size) // self.record_size * self.record_size
+            if complete != size:
+                os.truncate(path, complete)
+        else:
+            header = json.dumps({'columns': self.columns}).encode('utf-8')
+            tmp_path = path + '.tmp'
+            with open(tmp_path, 'wb') as f:
+                f.write(self.magic + struct.pack('<I', len(header)) + header)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, path)
+            self.header_size = len(self.magic) + 4 + len(header)
+
+        self.file = open(path, 'ab')
+
+    def append(self, iteration, **values):
+        record = [iteration] + [values[name] for name in self.columns]
+        self.file.write(np.array(record, dtype='<f8').tobytes())
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+    def truncate(self, iteration):
+        '''
+            Drop every record logged after iteration, used when training
+            resumes from a checkpoint older than the end of the log.
+        '''
+        iterations = MetricsLogReader(self.path).read()['iteration']
+        keep = int(np.sum(iterations <= iteration))
+        self.file.truncate(self.header_size + keep * self.record_size)
+
+    def close(self):
+        self.file.close()
+
+
+def read_header(path):
+    '''
+    :return: dictionary with the columns and the header size in bytes,
+             None if the file does not hold a complete header yet
+    '''
+    with open(path, 'rb') as f:
+        prefix = f.read(len(MetricsLog.magic) + 4)
+        if len(prefix) < len(MetricsLog.magic) + 4:
+            return None
+        if prefix[:len(MetricsLog.magic)] != MetricsLog.magic:
+            raise ValueError('{} is not a metrics log'.format(path))
+        length, = struct.unpack('<I', prefix[len(MetricsLog.magic):])
+        header = f.read(length)
+        if len(header) < length:
+            return None
+    header = json.loads(header.decode('utf-8'))
+    header['size'] = len(prefix) + length
+    return header
+
+
+class MetricsLogReader:
+    """
+        Incremental reader of a MetricsLog.
+
+        poll() only reads the bytes appended since the previous call, so a
+        viewer can follow a running training cheaply. Partial records at the
+        end of the file are left for a later poll, and a log that was
+        truncated or started over is read again from the beginning.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.reset()
+
+    def reset(self):
+        self.columns = None
+        self.header_size = None
+        self.offset = 0
+        self.chunks = []
+
+    def poll(self):
+        '''
+        :return: number of new records
+        '''
+        if not os.path.exists(self.path):
+            self.reset()
+            return 0
+        size = os.path.getsize(self.path)
+        if self.columns is not None and size < self.offset:
+            self.reset()
+        if self.columns is None:
+            header = read_header(self.path)
+            if header is None:
+                return 0
+            self.columns = header['columns']
+            self.header_size = self.offset = header['size']
+
+        record_size = 8 * (len(self.columns) + 1)
+        count = (size - self.offset) // record_size
+        if count == 0:
+            return 0
+        with open(self.path, 'rb') as f:
+            f.seek(self.offset)
+            data = f.read(count * record_size)
+        count = len(data) // record_size
+        self.chunks += [np.frombuffer(data[:count * record_size], dtype='<f8').reshape(count, -1)]
+        self.offset += count * record_size
+        return count
+
+    def read(self):
+        '''
+        :return: dictionary of arrays, 'iteration' and one per column
+        '''
+        self.poll()
+        columns = ['iteration'] + (self.columns or [])
+        records = np.concatenate(self.chunks) if self.chunks else np.zeros((0, len(columns)))
+        result = {name: records[:, i] for i, name in enumerate(columns)}
+        result['iteration'] = result['iteration'].astype(np.int64)
+        return result
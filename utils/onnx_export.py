@@ -0,0 +1,267 @@
+# -*- coding: utf-8 -*-
+"""
+    ONNX export of the sampling path of Paraphraser and Generator and greedy
+    decoding with onnxruntime on the cpu.
+
+    export_onnx writes three graphs to a directory, with dynamic batch and
+    sequence axes and the LSTM state as explicit inputs and outputs:
+
+        encoder.onnx        input [batch, seq, embed] -> mu, logvar [batch, latent]
+        initial_state.onnx  input [batch, seq, embed] -> h, c [layers, batch, decoder_rnn_size]
+        decoder_step.onnx   input [batch, steps, embed], z, h, c -> logits [batch, steps, vocab], h_out, c_out
+
+    together with the vocabularies (vocab.json) and the input, output and go
+    embeddings as .npy files. The export is checked against the PyTorch
+    modules on random inputs, see check_parity. Exporting needs the onnx and
+    onnxruntime packages, OnnxSampler numpy and onnxruntime only, they are
+    imported on use.
+
+    Usage: python -m utils.onnx_export --model C-VAE* --model-name NAME
+        writes saved_models/onnx_paraphraser_NAME/
+"""
+import argparse
+import inspect
+import json
+import os
+
+import numpy as np
+
+
+GRAPHS = {
+    'encoder': (['input'], ['mu', 'logvar']),
+    'initial_state': (['input'], ['h', 'c']),
+    'decoder_step': (['input', 'z', 'h', 'c'], ['logits', 'h_out', 'c_out']),
+}
+
+DYNAMIC_AXES = {
+    'encoder': {'input': {0: 'batch', 1: 'seq'}, 'mu': {0: 'batch'}, 'logvar': {0: 'batch'}},
+    'initial_state': {'input': {0: 'batch', 1: 'seq'}, 'h': {1: 'batch'}, 'c': {1: 'batch'}},
+    'decoder_step': {'input': {0: 'batch', 1: 'steps'}, 'z': {0: 'batch'},
+                     'h': {1: 'batch'}, 'c': {1: 'batch'},
+                     'logits': {0: 'batch', 1: 'steps'}, 'h_out': {1: 'batch'}, 'c_out': {1: 'batch'}},
+}
+
+
+def modules(model):
+    '''
+    :return: the exported modules of model by graph name
+    '''
+    from model.inference import DecoderStep, InitialState, SourceEncoder, fused_highway
+
+    highway = fused_highway(model)
+    return {'encoder': SourceEncoder(model.encoder, highway).eval(),
+            'initial_state': InitialState(model.decoder, highway).eval(),
+            'decoder_step': DecoderStep(model.decoder).eval()}
+
+
+def example_inputs(model, batch_size, seq_len, generator=None):
+    import torch as t
+
+    params = model.params
+    input = t.randn(batch_size, seq_len, params.word_embed_size, generator=generator)
+    state = [t.randn(params.decoder_num_layers, batch_size, params.decoder_rnn_size, generator=generator)
+             for _ in range(2)]
+    z = t.randn(batch_size, params.latent_variable_size, generator=generator)
+    return {'encoder': (input,), 'initial_state': (input,), 'decoder_step': (input, z) + tuple(state)}
+
+
+def check_parity(model, directory, batch_size=3, seq_len=7, seed=0):
+    '''
+        Run the exported graphs and the PyTorch modules on the same random
+        inputs, with other batch and sequence sizes than the export.
+    :return: largest absolute difference of every output by graph name
+    '''
+    import onnxruntime
+    import torch as t
+
+    inputs = example_inputs(model, batch_size, seq_len, t.Generator().manual_seed(seed))
+    differences = {}
+    for name, module in modules(model).items():
+        session = onnxruntime.InferenceSession(os.path.join(directory, name + '.onnx'),
+                                               providers=['CPUExecutionProvider'])
+        input_names, output_names = GRAPHS[name]
+        outputs = session.run(None, {n: v.numpy() for n, v in zip(input_names, inputs[name])})
+        with t.no_grad():
+            expected = module(*inputs[name])
+        differences[name] = {n: float(np.abs(o - e.numpy()).max()) for n, o, e in zip(output_names, outputs, expected)}
+    return differences
+
+
+def export_onnx(model, batch_loader, directory, tolerance=1e-4, weights=None):
+    '''
+        Export encoder, initial state and decoder step of model with the
+        vocabularies of batch_loader to directory.
+    :param tolerance: largest absolute difference to the PyTorch modules
+        check_parity may find, ValueError otherwise
+    :param weights: optional weights_fingerprint of the files model was
+        loaded from, see utils.scripting.exported_weights
+    :return: the differences found by check_parity
+    '''
+    import torch as t
+    from utils.decoding import output_embedding
+    from utils.scripting import input_vocabulary
+
+    model = model.cpu().eval()
+    os.makedirs(directory, exist_ok=True)
+    if os.path.exists(os.path.join(directory, 'vocab.json')):
+        os.remove(os.path.join(directory, 'vocab.json'))
+
+    # the legacy exporter, the dynamo one of torch >= 2.5 needs onnxscript
+    options = {'dynamo': False} if 'dynamo' in inspect.signature(t.onnx.export).parameters else {}
+    inputs = example_inputs(model, 2, 5)
+    for name, module in modules(model).items():
+        input_names, output_names = GRAPHS[name]
+        t.onnx.export(module, inputs[name], os.path.join(directory, name + '.onnx'),
+                      input_names=input_names, output_names=output_names,
+                      dynamic_axes=DYNAMIC_AXES[name], opset_version=14, **options)
+
+    words, embedding = input_vocabulary(batch_loader)
+    np.save(os.path.join(directory, 'input_embedding.npy'), embedding.numpy())
+    np.save(os.path.join(directory, 'output_embedding.npy'), output_embedding(batch_loader).numpy())
+    np.save(os.path.join(directory, 'go_embedding.npy'),
+            batch_loader.get_raw_input_from_sentences([batch_loader.go_label])[0, 0].numpy())
+
+    differences = check_parity(model, directory)
+    worst = max(d for graph in differences.values() for d in graph.values())
+    if worst > tolerance:
+        raise ValueError('{}: exported graphs differ from the model by {:.2e}: {}'.format(directory, worst, differences))
+
+    # written last, the scripts take a directory without it for no export
+    vocabulary = {'input_words': words,
+                  'output_words': list(batch_loader.idx_to_word),
+                  'labels': {'unk': batch_loader.unk_label,
+                             'end': batch_loader.end_label,
+                             'go': batch_loader.go_label},
+                  'max_seq_len': int(batch_loader.max_seq_len)}
+    if weights is not None:
+        vocabulary['weights'] = weights
+    with open(os.path.join(directory, 'vocab.json'), 'w') as f:
+        json.dump(vocabulary, f)
+    return differences
+
+
+class OnnxSampler:
+    """
+        Greedy decoding with the graphs written by export_onnx on
+        onnxruntime, the same interface as utils.scripting.ScriptedSampler.
+
+        Sentences are split into words with tokenize, whitespace by default.
+    """
+    def __init__(self, directory, tokenize=None, num_threads=None):
+        import onnxruntime
+
+        options = onnxruntime.SessionOptions()
+        if num_threads is not None:
+            options.intra_op_num_threads = num_threads
+        self.sessions = {name: onnxruntime.InferenceSession(os.path.join(directory, name + '.onnx'), options,
+                                                            providers=['CPUExecutionProvider'])
+                         for name in GRAPHS}
+
+        with open(os.path.join(directory, 'vocab.json')) as f:
+            vocabulary = json.load(f)
+        self.input_index = {w: i for i, w in enumerate(vocabulary['input_words'])}
+        self.output_words = vocabulary['output_words']
+        self.max_seq_len = vocabulary['max_seq_len']
+        self.end_label = vocabulary['labels']['end']
+        self.end_idx = self.output_words.index(self.end_label)
+        self.unk_idx = self.output_words.index(vocabulary['labels']['unk'])
+        self.tokenize = str.split if tokenize is None else tokenize
+
+        self.input_embedding = np.load(os.path.join(directory, 'input_embedding.npy'), mmap_mode='r')
+        self.output_embedding = np.load(os.path.join(directory, 'output_embedding.npy'))
+        self.go_embedding = np.load(os.path.join(directory, 'go_embedding.npy'))
+
+    def run(self, name, *inputs):
+        input_names, _ = GRAPHS[name]
+        return self.sessions[name].run(None, dict(zip(input_names, inputs)))
+
+    def source(self, sentences, source_len=None):
+        '''
+        :param source_len: optional length of the padded sources, the
+            longest one is not truncated
+        :return: [batch_size, seq_len, embed_size] embedded sentences followed
+                 by the end label, zero padded
+        '''
+        null, end = self.input_index['null'], self.input_index[self.end_label]
+        ids = [[self.input_index.get(w, null) for w in self.tokenize(s)] + [end] for s in sentences]
+        max_len = max([len(s) for s in ids] + [source_len or 0])
+        ids = np.array([s + [end] * (max_len - len(s)) for s in ids])
+        return np.ascontiguousarray(self.input_embedding[ids.reshape(-1)].reshape(ids.shape + (-1,)), dtype=np.float32)
+
+    def words(self, ids):
+        sentence = ''
+        for idx in ids:
+            if idx == self.end_idx:
+                break
+            sentence += ' ' + self.output_words[idx]
+        return sentence
+
+    def sample(self, sentences, seq_len=30, from_normal=False, noise=None, from_mean=False, source_len=None):
+        '''
+        :param noise: optional [batch_size, latent_variable_size] standard
+            normal draws of z, e.g. for reproducible output
+        :param from_mean: decode from the mean of the source posterior,
+            deterministically
+        :param source_len: optional length of the padded sources, see source
+        :return: most likely paraphrase of every sentence
+        '''
+        source = self.source(sentences, source_len)
+        batch_size = source.shape[0]
+
+        mu, logvar = self.run('encoder', source)
+        z = np.random.randn(*mu.shape).astype(np.float32) if noise is None else np.asarray(noise, dtype=np.float32)
+        if not from_normal:
+            z = mu if from_mean else z * np.exp(0.5 * logvar) + mu
+        h_state, c_state = self.run('initial_state', source)
+
+        input = np.broadcast_to(self.go_embedding, (batch_size, 1, self.go_embedding.shape[-1])).astype(np.float32)
+        finished = np.zeros(batch_size, dtype=bool)
+        words = []
+        for i in range(seq_len):
+            logits, h_state, c_state = self.run('decoder_step', input, z, h_state, c_state)
+            logits = logits[:, -1]
+            # never emit <unk>
+            logits[:, self.unk_idx] = -np.inf
+            idx = logits.argmax(axis=-1)
+
+            words += [idx]
+            finished |= idx == self.end_idx
+            if finished.all():
+                break
+            input = self.output_embedding[idx][:, None, :]
+
+        return [self.words(row) for row in np.stack(words, axis=1).tolist()]
+
+
+if __name__ == "__main__":
+    import torch as t
+    from model.generator import Generator
+    from model.parameters import Parameters
+    from model.parametersGAN import Parameters as ParametersGAN
+    from model.paraphraser import Paraphraser
+    from utils.batch_loader import load_batch_loader
+    from utils.distillation import load_sizes
+    from utils.scripting import weights_fingerprint
+    from utils.tensorfile import load_weights
+
+    parser = argparse.ArgumentParser(description='Export the sampling path to ONNX')
+    parser.add_argument('--model-name', default='', help='name of the trained model (default: "")')
+    parser.add_argument('--model', default='C-VAE', choices=['C-VAE', 'C-VAE*', 'GAN'], help='model to export (default: C-VAE)')
+    args = parser.parse_args()
+
+    batch_loader = load_batch_loader(args.model_name)
+    if args.model == 'GAN':
+        weights = 'saved_models/trained_generator_' + args.model_name
+        model = Generator(ParametersGAN(batch_loader.max_seq_len, batch_loader.vocab_size))
+        load_weights(model, weights, map_location='cpu')
+        directory = 'saved_models/onnx_generator_' + args.model_name
+    else:
+        weights = 'saved_models/trained_paraphraser_' + args.model_name
+        model = Paraphraser(Parameters(batch_loader.max_seq_len, batch_loader.vocab_size,
+                                       use_two_path_loss=(args.model == 'C-VAE*'), **load_sizes(weights)))
+        load_weights(model, weights, map_location='cpu')
+        directory = 'saved_models/onnx_paraphraser_' + args.model_name
+
+    for name, difference in export_onnx(model, batch_loader, directory, weights=weights_fingerprint(weights)).items():
+        print('{}: {}'.format(name, ', '.join('{} {:.2e}'.format(k, v) for k, v in difference.items())))
+    print('exported to {}'.format(directory))
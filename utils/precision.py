@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+import contextlib
+
+import torch as t
+from torch.cuda import amp
+
+
+class PrecisionPolicy:
+    """
+        Numeric precision of the training forward passes.
+
+        'fp32' runs everything in float32, 'bf16' runs the forward passes
+        under bfloat16 autocast on the cpu or the GPU, 'fp16' under float16
+        autocast with dynamic loss scaling on the GPU. Losses are always
+        computed from float32 logits outside of autocast.
+
+        scaler follows the torch.cuda.amp.GradScaler interface in every mode,
+        it is a pass-through unless the policy is fp16.
+    """
+    def __init__(self, precision='fp32', use_cuda=False):
+        if precision not in ('fp32', 'bf16', 'fp16'):
+            raise ValueError('unknown precision {}, expected fp32, bf16 or fp16'.format(precision))
+        if precision == 'fp16' and not use_cuda:
+            raise ValueError('fp16 needs a GPU, use bf16 on the cpu')
+        if precision == 'bf16' and not hasattr(t, 'autocast'):
+            raise ValueError('bf16 autocast needs torch >= 1.10')
+
+        self.precision = precision
+        self.device_type = 'cuda' if use_cuda else 'cpu'
+        self.scaler = amp.GradScaler(enabled=(precision == 'fp16'))
+
+    @property
+    def dtype(self):
+        return {'fp32': t.float32, 'bf16': t.bfloat16, 'fp16': t.float16}[self.precision]
+
+    def autocast(self):
+        if self.precision == 'fp32':
+            return contextlib.nullcontext()
+        if hasattr(t, 'autocast'):
+            return t.autocast(self.device_type, dtype=self.dtype)
+        return amp.autocast()
+
+    def __repr__(self):
+        return 'PrecisionPolicy({}, {})'.format(self.precision, self.device_type)
@@ -0,0 +1,149 @@
+# -*- coding: utf-8 -*-
+import collections
+import contextlib
+import csv
+import json
+import os
+import time
+
+import torch as t
+
+
+class Profiler:
+    """
+        Named wall-clock timers and counters of the training stages.
+
+        Disabled by default, timer() then returns a shared no-op context and
+        count() returns at once, so instrumented code pays one attribute
+        lookup per call. Timers may nest, e.g. 'encoder' inside 'rollout',
+        each one reports its own inclusive time.
+
+        Optionally a torch profiler trace is captured for a window of
+        iterations, the timers then also label their ranges in the trace.
+    """
+    def __init__(self):
+        self.enabled = False
+        self.synchronize = False
+        self.trace = None
+        self.trace_window = None
+        self.trace_path = None
+        self.reset()
+
+    def enable(self, synchronize=False, trace_window=None, trace_path='trace.json'):
+        '''
+        :param synchronize: wait for the GPU at the end of every timer, slower
+            but attributes asynchronous kernels to the stage that launched them
+        :param trace_window: optional (start, stop) iterations of a torch
+            profiler capture, written as a chrome trace to trace_path
+        '''
+        self.enabled = True
+        self.synchronize = synchronize and t.cuda.is_available()
+        self.trace_window = trace_window
+        self.trace_path = trace_path
+        self.reset()
+
+    def reset(self):
+        self.seconds = collections.defaultdict(float)
+        self.calls = collections.defaultdict(int)
+        self.counters = collections.defaultdict(int)
+        self.start = time.perf_counter()
+
+    def exclude(self):
+        '''
+            Drop the timings since the last report, call after work that is
+            not part of the training steps, e.g. validation and sampling.
+        '''
+        self.reset()
+
+    def timer(self, name):
+        if not self.enabled:
+            return _null_timer
+        return self._timer(name)
+
+    @contextlib.contextmanager
+    def _timer(self, name):
+        start = time.perf_counter()
+        with t.autograd.profiler.record_function(name) if self.trace is not None else _null_timer:
+            yield
+        if self.synchronize:
+            t.cuda.synchronize()
+        self.seconds[name] += time.perf_counter() - start
+        self.calls[name] += 1
+
+    def count(self, name, value=1):
+        if self.enabled:
+            self.counters[name] += int(value)
+
+    def step(self, iteration):
+        '''
+            Start or stop the torch profiler capture, call once per iteration.
+        '''
+        if not self.enabled or self.trace_window is None:
+            return
+        start, stop = self.trace_window
+        if iteration == start and self.trace is None:
+            if hasattr(t, 'profiler') and hasattr(t.profiler, 'profile'):
+                activities = [t.profiler.ProfilerActivity.CPU]
+                if t.cuda.is_available():
+                    activities += [t.profiler.ProfilerActivity.CUDA]
+                self.trace = t.profiler.profile(activities=activities)
+            else:
+                self.trace = t.autograd.profiler.profile(use_cuda=t.cuda.is_available())
+            self.trace.__enter__()
+        elif iteration == stop and self.trace is not None:
+            self.trace.__exit__(None, None, None)
+            self.trace.export_chrome_trace(self.trace_path)
+            print('profiler trace of iterations {}-{} saved to {}'.format(start, stop, self.trace_path))
+            self.trace = None
+
+    def report(self):
+        '''
+        :return: dictionary of the stage times and counters since the last
+                 report, share is the fraction of the elapsed wall time
+        '''
+        elapsed = time.perf_counter() - self.start
+        stages = {name: {'seconds': seconds,
+                         'calls': self.calls[name],
+                         'mean_ms': 1000. * seconds / self.calls[name],
+                         'share': seconds / elapsed}
+                  for name, seconds in sorted(self.seconds.items(), key=lambda x: -x[1])}
+        report = {'elapsed': elapsed, 'stages': stages, 'counters': dict(self.counters)}
+        self.reset()
+        return report
+
+    def dump(self, path, iteration):
+        '''
+            Append the report of the last interval to a .csv file, one row per
+            stage and counter, or to a json lines file otherwise.
+        '''
+        report = self.report()
+        if path.endswith('.csv'):
+            new = not os.path.exists(path)
+            with open(path, 'a', newline='') as f:
+                writer = csv.writer(f)
+                if new:
+                    writer.writerow(['iteration', 'name', 'seconds', 'calls', 'mean_ms', 'share', 'count'])
+                for name, stage in report['stages'].items():
+                    writer.writerow([iteration, name, stage['seconds'], stage['calls'],
+                                     stage['mean_ms'], stage['share'], ''])
+                for name, value in report['counters'].items():
+                    writer.writerow([iteration, name, '', '', '', '', value])
+        else:
+            with open(path, 'a') as f:
+                f.write(json.dumps(dict(iteration=iteration, **report)) + '\n')
+        return report
+
+
+def print_report(report):
+    print('-----------PROFILE------------')
+    for name, stage in report['stages'].items():
+        print('{:<24}{:>7.1%}{:>10.2f}ms x {}'.format(name, stage['share'], stage['mean_ms'], stage['calls']))
+    for name, value in report['counters'].items():
+        print('{:<24}{:>7}'.format(name, value))
+    print('------------------------------')
+
+
+_null_timer = contextlib.nullcontext()
+
+# shared by the trainers, models and rollout, see Profiler.enable
+profiler = Profiler()
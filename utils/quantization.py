@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+"""
+    Dynamic int8 quantization of Paraphraser and Generator for inference on
+    the cpu.
+
+    The highway is fused into one Linear per layer, then the weights of every
+    LSTM and Linear are stored as int8 with a scale per tensor. Activations
+    stay float and are quantized on the fly, per batch, for each matrix
+    multiplication, so no calibration data is needed.
+
+    Usage: python -m utils.quantization --model C-VAE* --model-name NAME
+        writes saved_models/trained_paraphraser_NAME.int8 next to the fp32
+        weights, sample.py --int8 True picks it up.
+"""
+import argparse
+import copy
+import inspect
+import os
+
+import torch as t
+import torch.nn as nn
+
+from model.highway import FusedHighway
+from .checkpoint import atomic_save
+
+# torch.ao.quantization since torch 1.10
+quantization = t.ao.quantization if hasattr(t, 'ao') else t.quantization
+
+
+SUFFIX = '.int8'
+
+
+def fuse_highway(model):
+    '''
+        Replace the highway shared by encoder and decoder of model with one
+        FusedHighway, in place.
+    '''
+    highway = FusedHighway(model.highway)
+    model.highway = model.encoder.hw1 = model.decoder.hw1 = highway
+    return model
+
+
+def quantize(model, dtype=t.qint8):
+    '''
+        Copy of model for cpu inference, with a fused highway and dynamically
+        quantized LSTM and Linear layers. model itself is left unchanged.
+    '''
+    model = fuse_highway(copy.deepcopy(model).cpu().eval())
+    return quantization.quantize_dynamic(model, {nn.LSTM, nn.Linear}, dtype=dtype)
+
+
+def save_quantized(model, path):
+    '''
+        Quantize model and save its state_dict, e.g. to a path + '.int8'.
+    '''
+    atomic_save(quantize(model).state_dict(), path)
+
+
+def load_quantized(model, path):
+    '''
+    :param model: instance of the saved architecture, its weights are replaced
+    :return: quantized model with the weights saved by save_quantized
+    '''
+    model = quantize(model)
+    # packed int8 weights are script objects, which weights_only loading rejects
+    if 'weights_only' in inspect.signature(t.load).parameters:
+        model.load_state_dict(t.load(path, map_location='cpu', weights_only=False))
+    else:
+        model.load_state_dict(t.load(path, map_location='cpu'))
+    return model
+
+
+if __name__ == "__main__":
+    from model.generator import Generator
+    from model.parameters import Parameters
+    from model.parametersGAN import Parameters as ParametersGAN
+    from model.paraphraser import Paraphraser
+    from utils.batch_loader import load_batch_loader
+    from utils.distillation import load_sizes
+    from utils.tensorfile import load_weights
+
+    parser = argparse.ArgumentParser(description='Quantize trained weights to int8')
+    parser.add_argument('--model-name', default='', help='name of the trained model (default: "")')
+    parser.add_argument('--model', default='C-VAE', choices=['C-VAE', 'C-VAE*', 'GAN'], help='model to quantize (default: C-VAE)')
+    args = parser.parse_args()
+
+    batch_loader = load_batch_loader(args.model_name)
+    if args.model == 'GAN':
+        model = Generator(ParametersGAN(batch_loader.max_seq_len, batch_loader.vocab_size))
+        path = 'saved_models/trained_generator_' + args.model_name
+    else:
+        path = 'saved_models/trained_paraphraser_' + args.model_name
+        model = Paraphraser(Parameters(batch_loader.max_seq_len, batch_loader.vocab_size,
+                                       use_two_path_loss=(args.model == 'C-VAE*'), **load_sizes(path)))
+
+    load_weights(model, path, map_location='cpu')
+    save_quantized(model, path + SUFFIX)
+    print('{} ({:.0f} MB) -> {} ({:.0f} MB)'.format(path, os.path.getsize(path) / 2 ** 20,
+                                                    path + SUFFIX, os.path.getsize(path + SUFFIX) / 2 ** 20))
@@ -0,0 +1,15 @@
+# -*- coding: utf-8 -*-
+import inspect
+
+from torch.utils.checkpoint import checkpoint
+
+
+def recompute(function, *args):
+    '''
+        function(*args) without keeping its intermediate activations, they
+        are recomputed during the backward pass. args must be tensors, bind
+        anything else with functools.partial.
+    '''
+    if 'use_reentrant' in inspect.signature(checkpoint).parameters:
+        return checkpoint(function, *args, use_reentrant=False)
+    return checkpoint(function, *args)
@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+import torch as t
+
+from utils.checkpoint import encode_numpy_rng, decode_numpy_rng
+
+
+class ReplayBuffer:
+    """
+        Fixed capacity store of generated token id sequences.
+
+        Sequences live in a preallocated [capacity, max_seq_len] int64 array
+        together with their lengths, so adding and sampling never allocate
+        per sentence. Once full, new sequences either overwrite the oldest
+        ones ('fifo') or replace a random slot with probability
+        capacity / seen ('reservoir'), which keeps a uniform sample of
+        everything generated so far. Shorter sequences are padded with
+        pad_idx, which should be the end label so that padding embeds to
+        zeros like in BatchLoader.embed_batch_from_index.
+    """
+    def __init__(self, capacity, max_seq_len, pad_idx, eviction='fifo', seed=None):
+        if eviction not in ('fifo', 'reservoir'):
+            raise ValueError('Unknown eviction policy: {}'.format(eviction))
+
+        self.capacity = capacity
+        self.max_seq_len = max_seq_len
+        self.pad_idx = pad_idx
+        self.eviction = eviction
+        self.rng = np.random.RandomState(seed)
+
+        self.ids = np.full((capacity, max_seq_len), pad_idx, dtype=np.int64)
+        self.lengths = np.zeros(capacity, dtype=np.int64)
+        self.size = 0
+        self.position = 0
+        self.seen = 0
+
+    def __len__(self):
+        return self.size
+
+    def _next_slot(self):
+        self.seen += 1
+        if self.size < self.capacity:
+            self.size += 1
+            return self.size - 1
+        if self.eviction == 'fifo':
+            slot = self.position
+            self.position = (self.position + 1) % self.capacity
+            return slot
+        slot = self.rng.randint(self.seen)
+        return slot if slot < self.capacity else None
+
+    def add(self, samples):
+        """
+        :param samples: [batch_size, seq_len] tensor or array of token ids
+        """
+        if isinstance(samples, t.Tensor):
+            samples = samples.data.cpu().numpy()
+        seq_len = min(samples.shape[1], self.max_seq_len)
+
+        for row in samples:
+            slot = self._next_slot()
+            if slot is None:
+                continue
+            self.ids[slot, :seq_len] = row[:seq_len]
+            self.ids[slot, seq_len:] = self.pad_idx
+            self.lengths[slot] = seq_len
+
+    def sample(self, batch_size):
+        """
+        :return: [batch_size, seq_len] array of token ids, seq_len being the
+            longest sampled sequence
+        """
+        assert self.size > 0, 'cannot sample from an empty replay buffer'
+        idx = self.rng.randint(self.size, size=batch_size)
+        return self.ids[idx, :np.max(self.lengths[idx])]
+
+    def state_dict(self):
+        return {'ids': t.from_numpy(self.ids), 'lengths': t.from_numpy(self.lengths),
+                'size': self.size, 'position': self.position, 'seen': self.seen,
+                'rng': encode_numpy_rng(self.rng.get_state())}
+
+    def load_state_dict(self, state):
+        self.ids[:] = state['ids'].numpy()
+        self.lengths[:] = state['lengths'].numpy()
+        self.size = state['size']
+        self.position = state['position']
+        self.seen = state['seen']
+        self.rng.set_state(decode_numpy_rng(state['rng']))
@@ -7,6 +7,8 @@ import torch.nn.functional as F
 from torch.autograd import Variable
 
 import time
+
+from .profiler import profiler
 """
 	Code base taken from: https://github.com/HeroKillerEver/SeqGAN-Pytorch
 """
@@ -42,17 +44,17 @@ class Rollout(object):
 			# rewards = t.zeros([seq_len, batch_size])
 			# if use_cuda:
 				# rewards.cuda()
-			# time_s = 0
-			# time_d = 0
 			# idx = 0
 		for i in range(self.rollout_num):
 			for l in range(1, seq_len):
-				samples, next_initial_state = self.generator.sample(x[:, 0:l, :], seq_len, z, initial_states[l-1], use_cuda, batch_loader) # (batch_size, sequence_len)
+				with profiler.timer('rollout_sample'):
+					samples, next_initial_state = self.generator.sample(x[:, 0:l, :], seq_len, z, initial_states[l-1], use_cuda, batch_loader) # (batch_size, sequence_len)
 					# if use_cuda:
 					# 	samples = samples.cuda()
 
-				reward = t.sigmoid(self.discriminator(samples)) # (batch_size, 1)
-				reward = reward.data.cpu().numpy()
+				with profiler.timer('rollout_discriminator'):
+					reward = t.sigmoid(self.discriminator(samples).float()) # (batch_size, 1)
+					reward = reward.data.cpu().numpy()
 					# rewards[l] = reward
 				if i == 0:
 					initial_states.append(next_initial_state)
@@ -61,14 +63,14 @@ class Rollout(object):
 					# idx += 1
 				else:
 					rewards[l-1] += reward
-					# time_d += (time.time_ns() - t0)
 
 				# if use_cuda:
 					# x = x.cuda()
 
-			reward = t.sigmoid(self.discriminator(x))
-			# rewards[-1] = reward
-			reward = reward.data.cpu().numpy() # Detach from computational graph
+			with profiler.timer('rollout_discriminator'):
+				reward = t.sigmoid(self.discriminator(x).float())
+				# rewards[-1] = reward
+				reward = reward.data.cpu().numpy() # Detach from computational graph
 			if i == 0:
 				rewards.append(reward)
 			else:
@@ -76,8 +78,6 @@ class Rollout(object):
 
 		rewards = (np.array(rewards).squeeze().T) / (1. * self.rollout_num) # (batch_size, sequence_len)
 			# rewards = t.mean(rewards.view(batch_size, seq_len, rollout_num), dim=-1)
-		# print(f'Time spent sampling: {time_s /(10**6)}ms (avg. {time_s /(10**6)/(self.rollout_num)}/rollout)')
-		# print(f'Time spent in discriminator: {time_d /(10**6)}ms (avg. {time_d /(10**6)/(self.rollout_num)}/rollout)')
 
 		return rewards
 
@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+import torch.multiprocessing as mp
+
+from .batch_loader import clean_str
+from .bleu import compute_bleu
+from .checkpoint import snapshot
+from .decoding import decode_sentences
+
+
+def _run(build_model, batch_loader, model_name, use_cuda, seq_len, batch_size, from_normal, bleu, seed, requests):
+    model = build_model()
+    if use_cuda:
+        model = model.cuda()
+    model.eval()
+
+    # the same pairs for every snapshot, as next_batch_from_file('quora_test') draws them
+    question1, question2 = batch_loader.pairs(1)
+    rows = np.random.RandomState(seed).permutation(len(question1))[:6000]
+    source = [' '.join(clean_str(s).split()) for s in question1[rows]]
+    target = [' '.join(clean_str(s).split()) for s in question2[rows]]
+
+    while True:
+        request = requests.get()
+        if request is None:
+            break
+        iteration, state_dict = request
+        model.load_state_dict(state_dict)
+        result = decode_sentences(model, batch_loader, source, seq_len, use_cuda, batch_size, from_normal)
+
+        sampled_file_dst = 'logs/{}/intermediate/sampled_{}k.txt'.format(model_name, iteration//1000)
+        target_file_dst = 'logs/{}/intermediate/target_{}k.txt'.format(model_name, iteration//1000)
+        source_file_dst = 'logs/{}/intermediate/source_{}k.txt'.format(model_name, iteration//1000)
+
+        np.savetxt(sampled_file_dst, np.array(result), delimiter='\n', fmt='%s')
+        np.savetxt(target_file_dst, np.array(target), delimiter='\n', fmt='%s')
+        np.savetxt(source_file_dst, np.array(source), delimiter='\n', fmt='%s')
+
+        print('------------------------------')
+        print('results saved to: ')
+        print(sampled_file_dst)
+        print(target_file_dst)
+        print(source_file_dst)
+
+        if bleu:
+            score = compute_bleu([[s.split()] for s in target], [s.split() for s in result])[0]
+            with open('logs/{}/intermediate/bleu.txt'.format(model_name), 'a') as f:
+                f.write('{}\t{}\n'.format(iteration, score))
+            print('BLEU {}k: {}'.format(iteration//1000, score))
+
+
+class SamplingWorker:
+    """
+        Writes the intermediate samples of weight snapshots from a separate
+        process while training continues.
+
+        submit() only copies the weights to the cpu and queues them, the
+        worker decodes the test pairs in batches and writes the
+        sampled_/target_/source_{k}k.txt files. build_model must be
+        picklable, e.g. functools.partial(Paraphraser, parameters). The test
+        pairs are drawn with seed, the same for every run.
+
+        The sources of a batch are padded to the longest, which changes the
+        encoder states, so the samples match per-sentence decoding only with
+        batch_size 1.
+    """
+    def __init__(self, build_model, batch_loader, model_name, use_cuda,
+                 seq_len=30, batch_size=64, from_normal=False, bleu=False, seed=0):
+        context = mp.get_context('spawn')
+        self.requests = context.Queue()
+        self.process = context.Process(target=_run,
+                                       args=(build_model, batch_loader, model_name, use_cuda,
+                                             seq_len, batch_size, from_normal, bleu, seed, self.requests),
+                                       daemon=True)
+        self.process.start()
+
+    def submit(self, iteration, state_dict):
+        self.requests.put((iteration, snapshot(state_dict)))
+
+    def close(self):
+        '''
+            Wait for the queued snapshots to be sampled.
+        '''
+        self.requests.put(None)
+        self.process.join()
@@ -0,0 +1,230 @@
+# -*- coding: utf-8 -*-
+"""
+    TorchScript export of the sampling path of Paraphraser and Generator.
+
+    export_sampler compiles a model.inference.Sampler, encoder, initial state,
+    decoder step and the greedy and beam decoding loops over token ids, and
+    saves it together with its vocabularies into one file. ScriptedSampler
+    loads that file with torch and the standard library only, the decoding
+    loops run in the TorchScript interpreter without the GIL, so several
+    threads can sample at the same time. TokenSampler.from_model decodes
+    the same way with the uncompiled modules.
+
+    Exports record the fingerprint of the weight files they were made from,
+    see weights_fingerprint, so that the scripts export again after the
+    model was retrained under the same name.
+
+    Usage: python -m utils.scripting --model C-VAE* --model-name NAME
+        writes saved_models/scripted_paraphraser_NAME.pt, with --int8 True
+        saved_models/scripted_paraphraser_NAME.int8.pt
+"""
+import argparse
+import json
+import os
+import zipfile
+
+import torch as t
+
+
+def input_vocabulary(batch_loader):
+    '''
+    :return: input words of batch_loader and their [num_words, embed_size]
+             vectors as embed_batch uses them, zero for the labels
+    '''
+    words = list(batch_loader.word_vec.keys())
+    for label in [batch_loader.go_label, batch_loader.end_label]:
+        if label not in batch_loader.word_vec:
+            words.append(label)
+    null = batch_loader.word_vec['null']
+    embedding = t.stack([t.as_tensor(batch_loader.word_vec.get(w, null)).float() for w in words])
+    for label in [batch_loader.go_label, batch_loader.end_label]:
+        embedding[words.index(label)] = 0.
+    return words, embedding
+
+
+def build_sampler(model, batch_loader):
+    '''
+    :return: model.inference.Sampler of model on the cpu and the vocabularies
+             of batch_loader it decodes with
+    '''
+    from model.inference import Sampler
+    from utils.decoding import output_embedding
+
+    words, embedding = input_vocabulary(batch_loader)
+    go_embedding = batch_loader.get_raw_input_from_sentences([batch_loader.go_label])[0, 0]
+    sampler = Sampler(model.cpu().eval(), embedding, output_embedding(batch_loader), go_embedding,
+                      batch_loader.get_idx_by_word(batch_loader.unk_label),
+                      batch_loader.get_idx_by_word(batch_loader.end_label))
+
+    vocabulary = {'input_words': words,
+                  'output_words': list(batch_loader.idx_to_word),
+                  'labels': {'unk': batch_loader.unk_label,
+                             'end': batch_loader.end_label,
+                             'go': batch_loader.go_label},
+                  'max_seq_len': int(batch_loader.max_seq_len)}
+    return sampler, vocabulary
+
+
+def weights_fingerprint(*paths):
+    '''
+    :return: sha256 of the weight files at paths, a state_dict file that
+             only exists as its .tensors copy is read from that
+    '''
+    from utils.cache import file_fingerprint
+    from utils.tensorfile import SUFFIX
+
+    return file_fingerprint(*[path if os.path.exists(path) else path + SUFFIX for path in paths])
+
+
+def exported_weights(path):
+    '''
+    :return: weights fingerprint of the export_sampler file or export_onnx
+             directory at path, None if it is missing or has none
+    '''
+    try:
+        if os.path.isdir(path):
+            with open(os.path.join(path, 'vocab.json')) as f:
+                return json.load(f).get('weights')
+        with zipfile.ZipFile(path) as archive:
+            name = next(n for n in archive.namelist() if n.endswith('extra/vocab.json'))
+            return json.loads(archive.read(name)).get('weights')
+    except (OSError, StopIteration, zipfile.BadZipFile):
+        return None
+
+
+def export_sampler(model, batch_loader, path, weights=None):
+    '''
+        Compile the sampling path of model, e.g. a quantized one, and save it
+        with the vocabularies of batch_loader to path.
+    :param weights: optional weights_fingerprint of the files model was
+        loaded from, see exported_weights
+    '''
+    sampler, vocabulary = build_sampler(model, batch_loader)
+    if weights is not None:
+        vocabulary['weights'] = weights
+    t.jit.save(t.jit.script(sampler), path + '.tmp', _extra_files={'vocab.json': json.dumps(vocabulary)})
+    os.replace(path + '.tmp', path)
+    return path
+
+
+class TokenSampler:
+    """
+        Batched greedy and beam decoding of sentences with a
+        model.inference.Sampler, compiled or not, and its vocabularies.
+
+        Sentences are split into words with tokenize, whitespace by default.
+        Pass utils.batch_loader.clean_str followed by split, or clean the
+        sentences before, to get the words the model was trained on.
+    """
+    def __init__(self, module, vocabulary, tokenize=None, num_threads=None):
+        self.module = module
+        self.input_index = {w: i for i, w in enumerate(vocabulary['input_words'])}
+        self.output_words = vocabulary['output_words']
+        self.max_seq_len = vocabulary['max_seq_len']
+        self.end_label = vocabulary['labels']['end']
+        self.end_idx = self.output_words.index(self.end_label)
+        self.tokenize = str.split if tokenize is None else tokenize
+        if num_threads is not None:
+            t.set_num_threads(num_threads)
+
+    @classmethod
+    def from_model(cls, model, batch_loader, tokenize=None, num_threads=None):
+        '''
+            Eager sampler of model, e.g. a quantized one, without compiling it.
+        '''
+        sampler, vocabulary = build_sampler(model, batch_loader)
+        return cls(sampler, vocabulary, tokenize, num_threads)
+
+    def z_options(self, from_normal, from_mean):
+        # files exported before from_mean take from_normal only
+        return (from_normal, True) if from_mean else (from_normal,)
+
+    def source_ids(self, sentences, source_len=None):
+        '''
+        :param source_len: optional length of the padded sources, the
+            longest one is not truncated
+        :return: [batch_size, seq_len] input ids of the sentences followed by
+                 the end label, padded with it
+        '''
+        null, end = self.input_index['null'], self.input_index[self.end_label]
+        ids = [[self.input_index.get(w, null) for w in self.tokenize(s)] + [end] for s in sentences]
+        max_len = max([len(s) for s in ids] + [source_len or 0])
+        return t.tensor([s + [end] * (max_len - len(s)) for s in ids], dtype=t.long)
+
+    def words(self, ids):
+        '''
+            Output ids up to the first end label to a sentence, formatted as
+            the sampling methods of Paraphraser return it.
+        '''
+        sentence = ''
+        for idx in ids:
+            if idx == self.end_idx:
+                break
+            sentence += ' ' + self.output_words[idx]
+        return sentence
+
+    @t.no_grad()
+    def sample(self, sentences, seq_len=30, from_normal=False, from_mean=False, source_len=None):
+        '''
+        :param from_mean: decode from the mean of the source posterior,
+            deterministically
+        :param source_len: optional length of the padded sources, see source_ids
+        :return: most likely paraphrase of every sentence
+        '''
+        ids = self.module(self.source_ids(sentences, source_len), seq_len, *self.z_options(from_normal, from_mean))
+        return [self.words(row) for row in ids.tolist()]
+
+    @t.no_grad()
+    def beam_search(self, sentences, seq_len=30, beam_size=5, from_normal=False, from_mean=False, source_len=None):
+        '''
+        :return: beam_size paraphrases of every sentence, best first
+        '''
+        ids, _ = self.module.beam_search(self.source_ids(sentences, source_len), seq_len, beam_size,
+                                         *self.z_options(from_normal, from_mean))
+        return [[self.words(row) for row in beams] for beams in ids.tolist()]
+
+
+class ScriptedSampler(TokenSampler):
+    """
+        TokenSampler saved by export_sampler, independent of the training code.
+    """
+    def __init__(self, path, tokenize=None, num_threads=None):
+        extra_files = {'vocab.json': ''}
+        module = t.jit.load(path, map_location='cpu', _extra_files=extra_files)
+        super(ScriptedSampler, self).__init__(module, json.loads(extra_files['vocab.json']), tokenize, num_threads)
+
+
+if __name__ == "__main__":
+    from model.generator import Generator
+    from model.parameters import Parameters
+    from model.parametersGAN import Parameters as ParametersGAN
+    from model.paraphraser import Paraphraser
+    from utils.batch_loader import load_batch_loader
+    from utils.distillation import load_sizes
+    from utils.quantization import SUFFIX, quantize
+    from utils.tensorfile import load_weights
+
+    parser = argparse.ArgumentParser(description='Export the sampling path with TorchScript')
+    parser.add_argument('--model-name', default='', help='name of the trained model (default: "")')
+    parser.add_argument('--model', default='C-VAE', choices=['C-VAE', 'C-VAE*', 'GAN'], help='model to export (default: C-VAE)')
+    parser.add_argument('--int8', default=False, type=bool, help='export the dynamically int8 quantized model (default: False)')
+    args = parser.parse_args()
+
+    batch_loader = load_batch_loader(args.model_name)
+    if args.model == 'GAN':
+        weights = 'saved_models/trained_generator_' + args.model_name
+        model = Generator(ParametersGAN(batch_loader.max_seq_len, batch_loader.vocab_size))
+        load_weights(model, weights, map_location='cpu')
+        path = 'saved_models/scripted_generator_' + args.model_name + '.pt'
+    else:
+        weights = 'saved_models/trained_paraphraser_' + args.model_name
+        model = Paraphraser(Parameters(batch_loader.max_seq_len, batch_loader.vocab_size,
+                                       use_two_path_loss=(args.model == 'C-VAE*'), **load_sizes(weights)))
+        load_weights(model, weights, map_location='cpu')
+        path = 'saved_models/scripted_paraphraser_' + args.model_name + '.pt'
+
+    if args.int8:
+        model = quantize(model)
+        path = path[:-len('.pt')] + SUFFIX + '.pt'
+    weights = weights_fingerprint(weights)
+    print('{} ({:.0f} MB)'.format(export_sampler(model, batch_loader, path, weights), os.path.getsize(path) / 2 ** 20))
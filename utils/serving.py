@@ -0,0 +1,446 @@
+# -*- coding: utf-8 -*-
+"""
+    Paraphrase service: dynamic micro-batching of concurrent requests and a
+    JSON API over local HTTP or a Unix socket, see serve.py.
+
+    Every request is queued as one Request. A single decoding thread takes
+    the oldest one and waits at most max_wait seconds for more requests with
+    the same decoding options, until max_batch sentences are queued, then
+    decodes all of them as one batch. So a lone request waits max_wait at
+    most, and under load the batches fill up without waiting.
+
+    The encoders run over the padding of shorter sources, so the padded
+    length changes the paraphrases of a sentence. Sources are padded to the
+    next multiple of bucket words, and only the sentences of one bucket are
+    decoded together, so that the paraphrases of a sentence do not depend
+    on the requests it is batched with. Requests are batched with those of
+    the same bucket of their longest sentence.
+
+        POST /paraphrase  {"sentences": [...], "mode": "posterior", "num_samples": 1,
+                           "beam_size": 1, "max_len": 30}
+                          -> {"paraphrases": [[...], ...]}
+        GET  /metrics     queue depth, batch sizes, latency percentiles and
+                          cache hit rates
+        GET  /health
+
+    mode is posterior (z drawn from the source posterior), prior (z drawn
+    from the standard normal) or mean (the posterior mean, deterministic).
+    Every sentence gets num_samples * beam_size paraphrases, the beams of
+    every sample best first.
+"""
+import collections
+import concurrent.futures
+import http.client
+import http.server
+import json
+import os
+import socket
+import socketserver
+import threading
+import time
+
+import numpy as np
+
+from .batch_loader import clean_str
+
+
+MODES = ['posterior', 'prior', 'mean']
+
+
+class Request:
+    """
+        Sentences of one API call with their decoding options, answered
+        through future.
+    """
+    def __init__(self, sentences, mode, num_samples=1, beam_size=1, max_len=30):
+        self.sentences = sentences
+        self.mode = mode
+        self.num_samples = num_samples
+        self.beam_size = beam_size
+        self.max_len = max_len
+        self.future = concurrent.futures.Future()
+        self.arrival = time.perf_counter()
+
+    @property
+    def key(self):
+        '''
+            Decoding options, requests with different ones are never batched.
+        '''
+        return self.mode, self.beam_size, self.max_len
+
+    @property
+    def rows(self):
+        return len(self.sentences) * self.num_samples
+
+
+def parse_request(payload, default_mode, max_len=100, max_samples=16, beam_search=True):
+    '''
+        Validate the JSON body of a paraphrase call, ValueError if invalid.
+    :param beam_search: whether the sampler supports beam_size > 1
+    :return: Request with the cleaned sentences
+    '''
+    if not isinstance(payload, dict):
+        raise ValueError('expected a JSON object')
+    sentences = payload.get('sentences', [payload['sentence']] if 'sentence' in payload else None)
+    if not isinstance(sentences, list) or not sentences or not all(isinstance(s, str) for s in sentences):
+        raise ValueError('"sentences" must be a non-empty list of strings')
+    sentences = [' '.join(clean_str(s).split()) for s in sentences]
+
+    mode = payload.get('mode', default_mode)
+    if mode not in MODES:
+        raise ValueError('"mode" must be one of {}'.format(', '.join(MODES)))
+    options = {}
+    for name, upper in [('num_samples', max_samples), ('beam_size', 16), ('max_len', max_len)]:
+        value = payload.get(name, 30 if name == 'max_len' else 1)
+        if not isinstance(value, int) or isinstance(value, bool) or not 1 <= value <= upper:
+            raise ValueError('"{}" must be an integer from 1 to {}'.format(name, upper))
+        options[name] = value
+    if options['beam_size'] > 1 and not beam_search:
+        raise ValueError('this backend does not support beam search')
+    return Request(sentences, mode, **options)
+
+
+class ServingMetrics:
+    """
+        Counters and sliding windows of the latest requests and batches.
+
+        Per request the time it waited in the queue and its total time, per
+        batch its number of sentences and the decoding time, reduced to
+        p50/p95/p99 by summary().
+    """
+    def __init__(self, window=10000):
+        self.lock = threading.Lock()
+        self.started = time.time()
+        self.counters = collections.Counter()
+        self.windows = collections.defaultdict(lambda: collections.deque(maxlen=window))
+        self.queue_depth = 0
+        self.max_queue_depth = 0
+
+    def count(self, name, value=1):
+        with self.lock:
+            self.counters[name] += value
+
+    def record(self, name, value):
+        with self.lock:
+            self.windows[name].append(value)
+
+    def set_queue_depth(self, depth):
+        with self.lock:
+            self.queue_depth = depth
+            self.max_queue_depth = max(self.max_queue_depth, depth)
+
+    def summary(self):
+        with self.lock:
+            windows = {name: np.array(values) for name, values in self.windows.items()}
+            result = {'uptime_seconds': time.time() - self.started,
+                      'queue_depth': self.queue_depth,
+                      'max_queue_depth': self.max_queue_depth,
+                      'counters': dict(self.counters)}
+        for name, values in windows.items():
+            if len(values):
+                result[name] = {'mean': float(values.mean()),
+                                'p50': float(np.percentile(values, 50)),
+                                'p95': float(np.percentile(values, 95)),
+                                'p99': float(np.percentile(values, 99))}
+        return result
+
+
+class MicroBatcher:
+    """
+        Queue of Requests decoded by one thread in batches of up to
+        max_batch sentences, waiting at most max_wait seconds for a batch to
+        fill. A request larger than max_batch is decoded alone. Sources are
+        padded to a multiple of bucket words, bucket 1 decodes every sentence
+        unpadded as it would be alone.
+
+        sampler is a utils.scripting.TokenSampler, ScriptedSampler or a
+        utils.onnx_export.OnnxSampler, the last without beam search.
+    """
+    def __init__(self, sampler, max_batch=32, max_wait=0.005, max_queue=1024, metrics=None, bucket=32):
+        self.sampler = sampler
+        self.bucket = bucket
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.max_queue = max_queue
+        self.metrics = ServingMetrics() if metrics is None else metrics
+
+        self.pending = collections.deque()
+        self.condition = threading.Condition()
+        self.closed = False
+        self.thread = threading.Thread(target=self.run, name='micro-batcher', daemon=True)
+        self.thread.start()
+
+    def source_len(self, sentence):
+        '''
+        :return: padded length of sentence with its end label
+        '''
+        length = len(getattr(self.sampler, 'tokenize', str.split)(sentence)) + 1
+        return -(-length // self.bucket) * self.bucket
+
+    def key(self, request):
+        '''
+            Requests with the same key are decoded in one batch, the decoding
+            options and the bucket of the longest sentence.
+        '''
+        return request.key + (request.source_len,)
+
+    def submit(self, request):
+        '''
+        :return: future of the paraphrases of every sentence of request,
+                 RuntimeError if the queue is full or the batcher closed
+        '''
+        request.source_len = max(self.source_len(s) for s in request.sentences)
+        with self.condition:
+            if self.closed:
+                raise RuntimeError('the batcher is closed')
+            if len(self.pending) >= self.max_queue:
+                self.metrics.count('rejected')
+                raise RuntimeError('queue is full ({} requests)'.format(self.max_queue))
+            self.pending.append(request)
+            self.metrics.set_queue_depth(len(self.pending))
+            self.condition.notify()
+        self.metrics.count('requests')
+        return request.future
+
+    def next_batch(self):
+        '''
+            Wait for the oldest request and up to max_wait for requests with
+            its key, None once closed and drained.
+        '''
+        with self.condition:
+            while not self.pending:
+                if self.closed:
+                    return None
+                self.condition.wait()
+
+            first = self.pending[0]
+            key = self.key(first)
+            deadline = first.arrival + self.max_wait
+            while not self.closed:
+                rows = sum(r.rows for r in self.pending if self.key(r) == key)
+                remaining = deadline - time.perf_counter()
+                if rows >= self.max_batch or remaining <= 0:
+                    break
+                self.condition.wait(remaining)
+
+            batch, rows, rest = [], 0, collections.deque()
+            for request in self.pending:
+                if self.key(request) == key and (not batch or rows + request.rows <= self.max_batch):
+                    batch.append(request)
+                    rows += request.rows
+                else:
+                    rest.append(request)
+            self.pending = rest
+            self.metrics.set_queue_depth(len(self.pending))
+            return batch
+
+    def decode(self, batch):
+        '''
+        :return: paraphrases of every request of batch, which share their key
+        '''
+        mode, beam_size, max_len = batch[0].key
+        options = {'from_normal': mode == 'prior', 'from_mean': mode == 'mean'}
+        rows = [s for request in batch for s in request.sentences for _ in range(request.num_samples)]
+
+        buckets = collections.defaultdict(list)
+        for i, sentence in enumerate(rows):
+            buckets[self.source_len(sentence)].append(i)
+
+        decoded = [None] * len(rows)
+        for source_len, indexes in buckets.items():
+            sentences = [rows[i] for i in indexes]
+            if beam_size == 1:
+                paraphrases = [[s] for s in self.sampler.sample(sentences, max_len, source_len=source_len, **options)]
+            else:
+                paraphrases = self.sampler.beam_search(sentences, max_len, beam_size, source_len=source_len, **options)
+            for i, paraphrase in zip(indexes, paraphrases):
+                decoded[i] = paraphrase
+        self.metrics.record('buckets', len(buckets))
+
+        result, i = [], 0
+        for request in batch:
+            paraphrases = []
+            for _ in request.sentences:
+                paraphrases.append([s.strip() for sample in decoded[i:i + request.num_samples] for s in sample])
+                i += request.num_samples
+            result.append(paraphrases)
+        return result
+
+    def run(self):
+        while True:
+            batch = self.next_batch()
+            if batch is None:
+                return
+
+            start = time.perf_counter()
+            for request in batch:
+                self.metrics.record('queue_ms', 1000 * (start - request.arrival))
+            try:
+                results = self.decode(batch)
+            except Exception as e:
+                self.metrics.count('errors', len(batch))
+                for request in batch:
+                    request.future.set_exception(e)
+                continue
+
+            end = time.perf_counter()
+            self.metrics.count('batches')
+            self.metrics.count('sentences', sum(r.rows for r in batch))
+            self.metrics.record('batch_rows', sum(r.rows for r in batch))
+            self.metrics.record('decode_ms', 1000 * (end - start))
+            for request, result in zip(batch, results):
+                self.metrics.record('latency_ms', 1000 * (end - request.arrival))
+                request.future.set_result(result)
+
+    def close(self):
+        '''
+            Decode the queued requests and stop the thread.
+        '''
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+        self.thread.join()
+
+
+class ServingHandler(http.server.BaseHTTPRequestHandler):
+    """
+        JSON API of a MicroBatcher, the server carries batcher, default_mode,
+        max_len, request_timeout and verbose.
+    """
+    protocol_version = 'HTTP/1.1'
+
+    def send_json(self, status, body):
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        if self.path == '/health':
+            self.send_json(200, {'status': 'ok'})
+        elif self.path == '/metrics':
+            summary = self.server.batcher.metrics.summary()
+            # hit rates of a utils.cache.CachedBatcher
+            if getattr(self.server.batcher, 'cache', None) is not None:
+                summary['cache'] = self.server.batcher.cache.stats()
+            self.send_json(200, summary)
+        else:
+            self.send_json(404, {'error': 'not found: ' + self.path})
+
+    def do_POST(self):
+        if self.path != '/paraphrase':
+            self.send_json(404, {'error': 'not found: ' + self.path})
+            return
+
+        server = self.server
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+            request = parse_request(json.loads(self.rfile.read(length).decode('utf-8')), server.default_mode,
+                                    server.max_len, beam_search=hasattr(server.batcher.sampler, 'beam_search'))
+        except (ValueError, KeyError) as e:
+            self.send_json(400, {'error': str(e)})
+            return
+
+        try:
+            future = server.batcher.submit(request)
+        except RuntimeError as e:
+            self.send_json(503, {'error': str(e)})
+            return
+
+        try:
+            paraphrases = future.result(server.request_timeout)
+        except concurrent.futures.TimeoutError:
+            self.send_json(504, {'error': 'timed out after {} seconds'.format(server.request_timeout)})
+        except Exception as e:
+            self.send_json(500, {'error': '{}: {}'.format(type(e).__name__, e)})
+        else:
+            self.send_json(200, {'paraphrases': paraphrases})
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            http.server.BaseHTTPRequestHandler.log_message(self, format, *args)
+
+
+class ThreadingHTTPServer(socketserver.ThreadingMixIn, http.server.HTTPServer):
+    daemon_threads = True
+
+
+class UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def get_request(self):
+        # the handler expects a (host, port) client address
+        request, _ = self.socket.accept()
+        return request, ('unix', 0)
+
+
+def make_server(batcher, host='127.0.0.1', port=8000, socket_path=None, default_mode='posterior',
+                max_len=100, timeout=60., verbose=False):
+    '''
+        Threaded server of the API of batcher on host:port, or on the Unix
+        socket socket_path if given. port 0 binds a free port, see
+        server.server_address.
+    '''
+    if socket_path:
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+        server = UnixHTTPServer(socket_path, ServingHandler)
+    else:
+        server = ThreadingHTTPServer((host, port), ServingHandler)
+    server.batcher = batcher
+    server.default_mode = default_mode
+    server.max_len = max_len
+    server.request_timeout = timeout
+    server.verbose = verbose
+    return server
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, socket_path, timeout=60.):
+        http.client.HTTPConnection.__init__(self, 'localhost', timeout=timeout)
+        self.socket_path = socket_path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.socket_path)
+
+
+class Client:
+    """
+        Client of the API on host:port or a Unix socket, keeping one
+        connection open. Not thread-safe, use one per thread.
+    """
+    def __init__(self, host='127.0.0.1', port=8000, socket_path=None, timeout=60.):
+        if socket_path:
+            self.connection = UnixHTTPConnection(socket_path, timeout)
+        else:
+            self.connection = http.client.HTTPConnection(host, port, timeout=timeout)
+
+    def call(self, method, path, body=None):
+        '''
+        :return: HTTP status and decoded JSON response
+        '''
+        data = None if body is None else json.dumps(body).encode('utf-8')
+        headers = {} if data is None else {'Content-Type': 'application/json'}
+        self.connection.request(method, path, data, headers)
+        response = self.connection.getresponse()
+        return response.status, json.loads(response.read().decode('utf-8'))
+
+    def paraphrase(self, sentences, **options):
+        '''
+        :param options: mode, num_samples, beam_size and max_len
+        :return: paraphrases of every sentence, RuntimeError on an error status
+        '''
+        status, body = self.call('POST', '/paraphrase', dict(options, sentences=sentences))
+        if status != 200:
+            raise RuntimeError('{}: {}'.format(status, body.get('error')))
+        return body['paraphrases']
+
+    def metrics(self):
+        return self.call('GET', '/metrics')[1]
+
+    def close(self):
+        self.connection.close()
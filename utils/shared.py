@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+import json
+import os
+import re
+import tempfile
+import uuid
+import weakref
+
+import numpy as np
+
+from .vocab import EmbeddingStore
+
+
+ALIGNMENT = 64
+
+
+def _shared_directory():
+    # tmpfs, the file never reaches a disk
+    return '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir()
+
+
+def _remove(path):
+    if os.path.exists(path):
+        os.remove(path)
+
+
+def remove_stale(directory=None):
+    '''
+        Remove the files of owners that died without cleaning up, e.g.
+        killed training runs. Their pid is part of the file name.
+    '''
+    directory = _shared_directory() if directory is None else directory
+    for name in os.listdir(directory):
+        match = re.match(r'rvae-(\d+)-[0-9a-f]+$', name)
+        if match is None:
+            continue
+        try:
+            os.kill(int(match.group(1)), 0)
+        except ProcessLookupError:
+            _remove(os.path.join(directory, name))
+        except PermissionError:
+            pass
+
+
+class SharedArrays:
+    """
+        Named read-only numpy arrays in one shared memory file.
+
+        The creating process owns the file and removes it on close(), when it
+        is garbage collected or at exit. Pickling keeps only the path and the
+        layout, unpickling in another process maps the same pages without a
+        copy. Processes that attached keep their mapping after the owner
+        removed the file, new processes can only attach while it exists.
+    """
+    def __init__(self, arrays, directory=None):
+        '''
+        :param arrays: dictionary of name to numpy array, copied once into the file
+        '''
+        directory = _shared_directory() if directory is None else directory
+        remove_stale(directory)
+        path = os.path.join(directory, 'rvae-{}-{}'.format(os.getpid(), uuid.uuid4().hex))
+
+        layout, offset = {}, 0
+        for name, array in arrays.items():
+            array = np.ascontiguousarray(array)
+            layout[name] = {'dtype': array.dtype.str, 'shape': list(array.shape), 'offset': offset}
+            offset += array.nbytes + (-array.nbytes % ALIGNMENT)
+
+        memory = np.memmap(path, dtype=np.uint8, mode='w+', shape=(max(offset, 1),))
+        for name, array in arrays.items():
+            start = layout[name]['offset']
+            memory[start:start + array.nbytes] = np.ascontiguousarray(array).reshape(-1).view(np.uint8)
+        memory.flush()
+        del memory
+
+        self.owner = True
+        self._finalizer = weakref.finalize(self, _remove, path)
+        self._attach(path, layout)
+
+    def _attach(self, path, layout):
+        self.path = path
+        self.layout = layout
+        memory = np.memmap(path, dtype=np.uint8, mode='r')
+        self.arrays = {}
+        for name, entry in layout.items():
+            dtype = np.dtype(entry['dtype'])
+            count = int(np.prod(entry['shape'], dtype=np.int64))
+            array = memory[entry['offset']:entry['offset'] + count * dtype.itemsize]
+            self.arrays[name] = array.view(dtype).reshape(entry['shape'])
+
+    def __getitem__(self, name):
+        return self.arrays[name]
+
+    def keys(self):
+        return self.arrays.keys()
+
+    @property
+    def nbytes(self):
+        return sum(array.nbytes for array in self.arrays.values())
+
+    def close(self):
+        '''
+            Drop this process' mapping, the owner also removes the file.
+        '''
+        self.arrays = {}
+        if self.owner:
+            self._finalizer()
+
+    def __getstate__(self):
+        return {'path': self.path, 'layout': json.dumps(self.layout)}
+
+    def __setstate__(self, state):
+        self.owner = False
+        self._attach(state['path'], json.loads(state['layout']))
+
+
+class SharedEmbeddingStore(EmbeddingStore):
+    """
+        EmbeddingStore over the 'embeddings' array of SharedArrays, pickles
+        as the handle of the shared file.
+    """
+    def __init__(self, shared, words):
+        self.shared = shared
+        self.words = words
+        self.index = {w: i for i, w in enumerate(words)}
+        self.matrix = shared['embeddings']
+
+    def __getstate__(self):
+        return {'shared': self.shared, 'words': self.words}
+
+    def __setstate__(self, state):
+        self.__init__(state['shared'], state['words'])
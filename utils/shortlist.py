@@ -0,0 +1,183 @@
+# -*- coding: utf-8 -*-
+"""
+    Per-batch vocabulary shortlist for greedy decoding.
+
+    A paraphrase mostly reuses the words of its source and frequent function
+    words, so instead of projecting the decoder output onto all vocab_size
+    rows of Decoder.fc at every step, only the rows of a candidate list are
+    computed: the source words of the batch, the top_n most frequent output
+    words, the end label and, optionally, the words aligned to the source
+    words in the training pairs, see alignments.
+
+    A row whose most likely candidate has less than fallback probability
+    among the candidates is projected onto the full vocabulary instead, at
+    fallback=1 every row is, which decodes exactly as without a shortlist.
+
+    Usage: python -m utils.shortlist --model-name NAME --top-k 10
+        writes the alignments of the training pairs to
+        saved_models/shortlist_NAME.json, sample.py --shortlist N picks it up.
+"""
+import argparse
+import collections
+import json
+import os
+
+import torch as t
+import torch.nn.functional as F
+
+from .batch_loader import clean_str
+from .telemetry import telemetry
+
+
+def alignments_path(model_name):
+    return 'saved_models/shortlist_' + model_name + '.json'
+
+
+def alignments(sources, targets, batch_loader, top_k=10):
+    '''
+        Output words that most often appear in the target of a pair whose
+        source has a word, without the source words themselves.
+    :param sources, targets: sentences of the training pairs
+    :return: dict of source word to at most top_k output words
+    '''
+    counts = collections.defaultdict(collections.Counter)
+    for source, target in zip(sources, targets):
+        source, target = set(clean_str(source).split()), set(clean_str(target).split())
+        new = [w for w in target - source if w in batch_loader.word_to_idx]
+        for word in source:
+            counts[word].update(new)
+    return {word: [w for w, _ in c.most_common(top_k)] for word, c in counts.items()}
+
+
+def load_alignments(model_name):
+    '''
+    :return: the alignments saved for model_name, None if there are none
+    '''
+    path = alignments_path(model_name)
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+
+def fc_weights(fc):
+    '''
+    :return: float weight and bias of a Linear, also of a dynamically
+             quantized one
+    '''
+    weight, bias = fc.weight, fc.bias
+    if callable(weight):
+        weight, bias = weight(), bias()
+    if weight.is_quantized:
+        weight = weight.dequantize()
+    return weight, bias
+
+
+class Shortlist:
+    """
+        Candidate output words of a batch of source sentences.
+
+        steps and fallbacks count the decoded rows and the ones projected
+        onto the full vocabulary since construction.
+    """
+    def __init__(self, batch_loader, top_n=1000, alignments=None, fallback=0.):
+        self.word_to_idx = batch_loader.word_to_idx
+        self.unk_idx = batch_loader.get_idx_by_word(batch_loader.unk_label)
+        self.end_idx = batch_loader.get_idx_by_word(batch_loader.end_label)
+        self.fallback = fallback
+
+        # idx_to_word is sorted by frequency, the labels come last
+        self.frequent = set(range(min(top_n, batch_loader.vocab_size - 2))) | {self.end_idx}
+        self.aligned = {}
+        for word, words in (alignments or {}).items():
+            self.aligned[word] = [self.word_to_idx[w] for w in words if w in self.word_to_idx]
+
+        self.steps = 0
+        self.fallbacks = 0
+
+    def candidates(self, tokens):
+        '''
+        :param tokens: source sentences of the batch as lists of words
+        :return: sorted output ids of the candidates, never <unk>
+        '''
+        ids = set(self.frequent)
+        for sentence in tokens:
+            for word in sentence:
+                if word in self.word_to_idx:
+                    ids.add(self.word_to_idx[word])
+                ids.update(self.aligned.get(word, ()))
+        ids.discard(self.unk_idx)
+        return t.tensor(sorted(ids), dtype=t.long)
+
+    def projection(self, fc, tokens, device=None):
+        '''
+        :return: ShortlistProjection of fc onto the candidates of tokens
+        '''
+        candidates = self.candidates(tokens).to(device)
+        weight, bias = fc_weights(fc)
+        return ShortlistProjection(self, fc, candidates, weight[candidates], bias[candidates])
+
+
+class ShortlistProjection:
+    """
+        Greedy choice of the next word of a batch from the rows of the
+        decoder projection of its candidates.
+    """
+    def __init__(self, shortlist, fc, candidates, weight, bias):
+        self.shortlist = shortlist
+        self.fc = fc
+        self.candidates = candidates
+        self.weight = weight
+        self.bias = bias
+
+    def __call__(self, rnn_out):
+        '''
+        :param rnn_out: decoder rnn output of the last step, [batch_size, decoder_rnn_size]
+        :return: [batch_size] ids of the most likely output words
+        '''
+        shortlist = self.shortlist
+        with telemetry.timer('projection'):
+            shortlist.steps += rnn_out.size(0)
+            if shortlist.fallback >= 1:
+                # the probability test misses rows that round to 1
+                full = self.fc(rnn_out)
+                full[:, shortlist.unk_idx] = -float('inf')
+                shortlist.fallbacks += rnn_out.size(0)
+                return full.argmax(dim=-1)
+
+            logits = F.linear(rnn_out, self.weight, self.bias)
+            best, idx = logits.max(dim=-1)
+            idx = self.candidates[idx]
+
+            if shortlist.fallback > 0:
+                # probability of the best candidate among the candidates
+                rows = (best - logits.logsumexp(dim=-1)).exp() < shortlist.fallback
+                if bool(rows.any()):
+                    full = self.fc(rnn_out[rows])
+                    full[:, shortlist.unk_idx] = -float('inf')
+                    idx[rows] = full.argmax(dim=-1)
+                    shortlist.fallbacks += int(rows.sum())
+        return idx
+
+
+if __name__ == "__main__":
+    import pandas as pd
+    from utils.batch_loader import load_batch_loader
+
+    parser = argparse.ArgumentParser(description='Align source to target words of the training pairs')
+    parser.add_argument('--model-name', default='', help='name of the trained model (default: "")')
+    parser.add_argument('--top-k', default=10, type=int, help='output words kept per source word (default: 10)')
+    args = parser.parse_args()
+
+    batch_loader = load_batch_loader(args.model_name)
+    if getattr(batch_loader, 'data', None) is not None:
+        question1, question2 = batch_loader.pairs(0)
+    else:
+        df = pd.read_csv(batch_loader.quora_data_files[0])
+        question1, question2 = df['question1'].values, df['question2'].values
+
+    # both directions, the pairs are paraphrases of each other
+    result = alignments(list(question1) + list(question2), list(question2) + list(question1), batch_loader, args.top_k)
+    with open(alignments_path(args.model_name), 'w') as f:
+        json.dump(result, f)
+    print('{} source words -> {}'.format(len(result), alignments_path(args.model_name)))
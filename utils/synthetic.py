@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+import zlib
+
+import numpy as np
+import pandas as pd
+
+
+def min_train_size(num_words, min_len=4):
+    '''
+    :param num_words: number of distinct words of the corpus
+    :param min_len: lower bound of the sentence length in words
+    :return: least number of train pairs that always covers every word
+    '''
+    return -(-num_words // min_len)
+
+
+class SyntheticCorpus:
+    """
+        Deterministic stand-in for the quora csv files and the fastText vectors.
+
+        Sentences draw their words w0 ... wN from a Zipf distribution, the
+        paraphrase of a sentence replaces some of its words with new draws
+        and swaps a pair of neighbouring words. Every word of the vocabulary
+        occurs in the train pairs at least once, so the output vocabulary of
+        BatchLoader is always full. Word vectors are random unit-norm vectors
+        seeded by the word itself, the same word gets the same vector in
+        every process and for any vocabulary it is requested with.
+    """
+    def __init__(self, train_size=20000, test_size=1000, num_words=30000,
+                 min_len=4, max_len=20, zipf_exponent=1.1, replace_prob=0.2, seed=0):
+        '''
+        :param train_size: number of train pairs
+        :param test_size: number of test pairs
+        :param num_words: number of distinct words, should exceed the
+            vocab_size of BatchLoader to leave words for <unk>
+        :param min_len, max_len: bounds of the sentence length in words
+        :param zipf_exponent: exponent s of the word frequencies 1 / rank^s
+        :param replace_prob: probability of a word to be redrawn in the paraphrase
+        '''
+        if train_size < min_train_size(num_words, min_len):
+            raise ValueError('{} train pairs of at least {} words can not cover {} words'.format(
+                train_size, min_len, num_words))
+
+        self.num_words = num_words
+        self.seed = seed
+        self.embed_size = 300
+
+        rng = np.random.RandomState(seed)
+        ranks = np.arange(1, num_words + 1)
+        self.word_prob = ranks ** -float(zipf_exponent)
+        self.word_prob /= self.word_prob.sum()
+
+        train = self.pairs(rng, train_size, min_len, max_len, replace_prob, cover=True)
+        test = self.pairs(rng, test_size, min_len, max_len, replace_prob)
+        self.data = [train, test]
+
+    def pairs(self, rng, size, min_len, max_len, replace_prob, cover=False):
+        lengths = rng.randint(min_len, max_len + 1, size=size)
+        words = rng.choice(self.num_words, size=lengths.sum(), p=self.word_prob)
+        if cover:
+            missing = np.setdiff1d(np.arange(self.num_words), words)
+            # overwrite repeated occurrences, mostly of frequent words, with the words never drawn
+            order = np.argsort(words, kind='stable')
+            repeated = order[1:][words[order][1:] == words[order][:-1]]
+            words[rng.choice(repeated, size=len(missing), replace=False)] = missing
+
+        paraphrases = words.copy()
+        replace = rng.rand(len(words)) < replace_prob
+        paraphrases[replace] = rng.choice(self.num_words, size=replace.sum(), p=self.word_prob)
+
+        sources, targets = [], []
+        for end, length in zip(np.cumsum(lengths), lengths):
+            source = words[end - length:end]
+            target = paraphrases[end - length:end].copy()
+            i = rng.randint(length - 1)
+            target[i], target[i + 1] = target[i + 1], target[i]
+            sources += [' '.join('w{}'.format(w) for w in source)]
+            targets += [' '.join('w{}'.format(w) for w in target)]
+        return pd.DataFrame({'question1': sources, 'question2': targets})
+
+    def word_vector(self, word):
+        rng = np.random.RandomState((zlib.crc32(word.encode('utf-8')) + self.seed) % 2 ** 32)
+        vec = rng.randn(self.embed_size)
+        return vec / np.sqrt(np.sum(np.power(vec, 2)))
@@ -0,0 +1,168 @@
+# -*- coding: utf-8 -*-
+import collections
+import contextlib
+import functools
+import json
+import threading
+import time
+
+import numpy as np
+import torch as t
+
+
+class DecodeTelemetry:
+    """
+        Per-call latency records of the decoding paths.
+
+        Every instrumented call, e.g. sample_with_input, opens a record with
+        call() and its stages add their time to it with timer(). The stages
+        are 'encode', 'lstm' (decoder rnn steps), 'projection' (fc and
+        softmax) and 'transfer' (host to device and back). A record also
+        holds the decoder steps, the tokens generated and the position where
+        decoding stopped, seq_len when it never emitted the end label.
+
+        Closed records are kept in a sliding window per call name, summary()
+        reduces the window to p50/p95/p99 of every metric. Disabled by
+        default, call() and timer() then return a shared no-op context.
+    """
+    def __init__(self):
+        self.enabled = False
+        self.synchronize = False
+        self.window = 10000
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.reset()
+
+    def enable(self, synchronize=True, window=10000):
+        '''
+        :param synchronize: wait for the GPU at the end of every stage, so that
+            asynchronous kernels are attributed to the stage that launched them
+        :param window: number of most recent calls kept per call name
+        '''
+        self.enabled = True
+        self.synchronize = synchronize and t.cuda.is_available()
+        self.window = window
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.records = collections.defaultdict(lambda: collections.deque(maxlen=self.window))
+
+    def call(self, name):
+        if not self.enabled or getattr(self.local, 'record', None) is not None:
+            return _null_context
+        return self._call(name)
+
+    @contextlib.contextmanager
+    def _call(self, name):
+        record = self.local.record = collections.defaultdict(float)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.local.record = None
+        if self.synchronize:
+            t.cuda.synchronize()
+        record['total'] = time.perf_counter() - start
+        with self.lock:
+            self.records[name].append(dict(record))
+
+    def instrument(self, function):
+        '''
+            Decorator opening a record, named by the qualified name of
+            function, for every call of it.
+        '''
+        name = function.__qualname__
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with self.call(name):
+                return function(*args, **kwargs)
+        return wrapper
+
+    def timer(self, stage):
+        if not self.enabled or getattr(self.local, 'record', None) is None:
+            return _null_context
+        return self._timer(stage)
+
+    @contextlib.contextmanager
+    def _timer(self, stage):
+        start = time.perf_counter()
+        yield
+        if self.synchronize:
+            t.cuda.synchronize()
+        self.local.record[stage] += time.perf_counter() - start
+
+    def step(self):
+        '''
+            Count one decoder step of the open record.
+        '''
+        if self.enabled and getattr(self.local, 'record', None) is not None:
+            self.local.record['steps'] += 1
+
+    def finish(self, tokens, stop):
+        '''
+            Set the tokens generated and the early stop position of the open record.
+        '''
+        if self.enabled and getattr(self.local, 'record', None) is not None:
+            self.local.record['tokens'] = tokens
+            self.local.record['stop'] = stop
+
+    def summary(self):
+        '''
+        :return: dictionary of call name to metric to count, mean, p50, p95
+                 and p99, times in milliseconds. Rnn and projection times
+                 are per decoder step, other is the time of the call outside
+                 of the stages, e.g. word lookup and embedding on the host
+        '''
+        with self.lock:
+            records = {name: list(calls) for name, calls in self.records.items()}
+
+        summary = {}
+        for name, calls in records.items():
+            metrics = collections.defaultdict(list)
+            for record in calls:
+                steps = max(record.get('steps', 0), 1)
+                metrics['total_ms'].append(1000. * record['total'])
+                metrics['encode_ms'].append(1000. * record.get('encode', 0.))
+                metrics['lstm_step_ms'].append(1000. * record.get('lstm', 0.) / steps)
+                metrics['projection_step_ms'].append(1000. * record.get('projection', 0.) / steps)
+                metrics['transfer_ms'].append(1000. * record.get('transfer', 0.))
+                metrics['other_ms'].append(1000. * (record['total'] - sum(
+                    record.get(stage, 0.) for stage in ('encode', 'lstm', 'projection', 'transfer'))))
+                metrics['steps'].append(record.get('steps', 0))
+                metrics['tokens'].append(record.get('tokens', 0))
+                metrics['stop'].append(record.get('stop', 0))
+            summary[name] = {metric: _percentiles(values) for metric, values in metrics.items()}
+        return summary
+
+    def dump(self, path):
+        '''
+            Write the summary as json to path.
+        '''
+        summary = self.summary()
+        with open(path, 'w') as f:
+            json.dump(summary, f, indent=2)
+        return summary
+
+
+def _percentiles(values):
+    p50, p95, p99 = np.percentile(values, [50, 95, 99])
+    return {'count': len(values), 'mean': float(np.mean(values)),
+            'p50': float(p50), 'p95': float(p95), 'p99': float(p99)}
+
+
+def print_summary(summary):
+    for name, metrics in summary.items():
+        print('-----------{}------------'.format(name.upper()))
+        print('{:<22}{:>10}{:>10}{:>10}{:>10}'.format('', 'p50', 'p95', 'p99', 'n'))
+        for metric, stats in metrics.items():
+            print('{:<22}{:>10.3f}{:>10.3f}{:>10.3f}{:>10}'.format(
+                metric, stats['p50'], stats['p95'], stats['p99'], stats['count']))
+    print('------------------------------')
+
+
+_null_context = contextlib.nullcontext()
+
+# shared by the decoding paths of the models, see DecodeTelemetry.enable
+telemetry = DecodeTelemetry()
@@ -0,0 +1,156 @@
+# -*- coding: utf-8 -*-
+"""
+    Flat tensor files that can be memory-mapped read-only.
+
+    Layout: the magic RVAETEN1, the length of the header as little-endian
+    uint64, the json header and zero padding up to a multiple of ALIGNMENT,
+    then the raw bytes of every tensor, each one starting at a multiple of
+    ALIGNMENT. The header maps every name to dtype, shape and offset of its
+    bytes from the start of the data, tensors sharing memory (e.g. the
+    highway shared by encoder and decoder) are stored once.
+
+    Loading maps the file copy-on-write, pages are read on first use and are
+    shared through the page cache by every process loading the same file.
+
+    Usage: python -m utils.tensorfile saved_models/trained_paraphraser_NAME ...
+        writes saved_models/trained_paraphraser_NAME.tensors next to each
+        state_dict file.
+"""
+import argparse
+import inspect
+import json
+import os
+import struct
+
+import torch as t
+
+
+MAGIC = b'RVAETEN1'
+ALIGNMENT = 64
+SUFFIX = '.tensors'
+
+
+def _pad(n):
+    return -n % ALIGNMENT
+
+
+def write_tensors(f, tensors, metadata=None):
+    '''
+        Write a {name: tensor} dictionary, e.g. a state_dict, to the binary
+        file object f.
+    '''
+    header, blobs, offsets, offset = {}, [], {}, 0
+    for name, tensor in tensors.items():
+        tensor = tensor.detach()
+        key = (tensor.device, tensor.data_ptr(), tensor.dtype, tuple(tensor.size()), tuple(tensor.stride()))
+        if key not in offsets:
+            data = tensor.cpu().contiguous().reshape(-1).view(t.uint8).numpy().tobytes()
+            offsets[key] = offset
+            blobs.append(data)
+            offset += len(data) + _pad(len(data))
+        header[name] = {'dtype': str(tensor.dtype).replace('torch.', ''),
+                        'shape': list(tensor.size()),
+                        'offset': offsets[key],
+                        'nbytes': tensor.numel() * tensor.element_size()}
+
+    header = json.dumps({'tensors': header, 'metadata': metadata or {}}).encode('utf-8')
+    f.write(MAGIC)
+    f.write(struct.pack('<Q', len(header)))
+    f.write(header)
+    f.write(b'\0' * _pad(len(MAGIC) + 8 + len(header)))
+    for data in blobs:
+        f.write(data)
+        f.write(b'\0' * _pad(len(data)))
+
+
+def save_tensors(tensors, path, metadata=None):
+    '''
+        Write tensors to path through a temporary file and an atomic rename.
+    '''
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        write_tensors(f, tensors, metadata)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+class TensorFile:
+    """
+        Read-only view of a tensor file, tensors are created on access and
+        share the memory mapping of the file.
+    """
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                raise ValueError('{} is not a tensor file'.format(path))
+            header_size, = struct.unpack('<Q', f.read(8))
+            header = json.loads(f.read(header_size).decode('utf-8'))
+        self.header = header['tensors']
+        self.metadata = header['metadata']
+        self.data_start = len(MAGIC) + 8 + header_size + _pad(len(MAGIC) + 8 + header_size)
+
+        size = os.path.getsize(path)
+        # shared=False maps the file privately, writes never reach the file
+        self.buffer = t.from_file(path, shared=False, size=size, dtype=t.uint8)
+
+    def keys(self):
+        return self.header.keys()
+
+    def __contains__(self, name):
+        return name in self.header
+
+    def __len__(self):
+        return len(self.header)
+
+    def __getitem__(self, name):
+        entry = self.header[name]
+        start = self.data_start + entry['offset']
+        data = self.buffer[start:start + entry['nbytes']]
+        return data.view(getattr(t, entry['dtype'])).view(entry['shape'])
+
+    def state_dict(self):
+        return {name: self[name] for name in self.header}
+
+
+def load_weights(model, path, map_location=None):
+    '''
+        Load the state_dict file at path into model. When a converted
+        path + '.tensors' exists on the cpu, its mapped tensors become the
+        parameters of model instead of being copied into them. A converted
+        copy older than the state_dict file is stale and ignored.
+    '''
+    stale = os.path.exists(path) and os.path.exists(path + SUFFIX) \
+        and os.path.getmtime(path + SUFFIX) < os.path.getmtime(path)
+    if not os.path.exists(path + SUFFIX) or stale:
+        model.load_state_dict(t.load(path, map_location=map_location))
+        return model
+
+    state_dict = TensorFile(path + SUFFIX).state_dict()
+    device = t.device(map_location) if map_location is not None else t.device('cpu')
+    if device.type != 'cpu':
+        model.load_state_dict({name: tensor.to(device) for name, tensor in state_dict.items()})
+    elif 'assign' in inspect.signature(model.load_state_dict).parameters:
+        model.load_state_dict(state_dict, assign=True)
+    else:
+        model.load_state_dict(state_dict)
+    return model
+
+
+def convert(path, destination=None):
+    '''
+        Convert the torch.save'd state_dict at path to a tensor file.
+    '''
+    destination = path + SUFFIX if destination is None else destination
+    save_tensors(t.load(path, map_location='cpu'), destination, {'source': os.path.basename(path)})
+    return destination
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Convert state_dict files to tensor files')
+    parser.add_argument('paths', nargs='+', help='state_dict files, each one is written to PATH.tensors')
+    args = parser.parse_args()
+
+    for path in args.paths:
+        print('{} -> {}'.format(path, convert(path)))
@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+import queue
+
+import numpy as np
+import torch as t
+import torch.multiprocessing as mp
+
+from .batch_loader import clean_str
+from .checkpoint import snapshot
+
+
+class ValidationSet:
+    """
+        Fixed sample of test pairs embedded once into ready input tensors.
+
+        Every evaluation sees the same pairs, so validation losses of different
+        iterations are comparable, and no batch is tokenized or embedded again.
+        With bucket=True pairs of similar length share a batch, which keeps
+        padding low when evaluating in large batches.
+    """
+    def __init__(self, batch_loader, size, batch_size, bucket=True, seed=0):
+        rng = np.random.RandomState(seed)
+        question1, question2 = batch_loader.pairs(1)
+        rows = rng.permutation(len(question1))[:size]
+        question1, question2 = question1[rows], question2[rows]
+
+        # swap source and target of half of the pairs, as next_batch does
+        swap = rng.rand(len(rows)) < 0.5
+        source = np.where(swap, question2, question1)
+        target = np.where(swap, question1, question2)
+
+        order = np.arange(len(rows))
+        if bucket:
+            source_len = [len(clean_str(s).split()) for s in source]
+            target_len = [len(clean_str(s).split()) for s in target]
+            order = np.lexsort((source_len, target_len))
+
+        self.size = len(rows)
+        self.batches = []
+        for start in range(0, len(order), batch_size):
+            idx = order[start:start + batch_size]
+            self.batches += [batch_loader.input_from_sentences([source[idx], target[idx]])]
+
+    def to(self, device):
+        self.batches = [[var.to(device) for var in input] for input in self.batches]
+        return self
+
+    def __iter__(self):
+        return iter(self.batches)
+
+    def __len__(self):
+        return len(self.batches)
+
+
+def _run(build_model, validation_set, use_cuda, requests, results):
+    model = build_model()
+    if use_cuda:
+        model = model.cuda()
+        validation_set.to('cuda')
+
+    while True:
+        request = requests.get()
+        if request is None:
+            break
+        iteration, state_dict = request
+        model.load_state_dict(state_dict)
+        results.put((iteration, model.evaluate(validation_set, use_cuda)))
+
+
+class BackgroundValidator:
+    """
+        Evaluates weight snapshots on a ValidationSet in a separate process
+        while training continues.
+
+        build_model must be picklable and return a module with an
+        evaluate(validation_set, use_cuda) method, e.g.
+        functools.partial(Paraphraser, parameters).
+    """
+    def __init__(self, build_model, validation_set, use_cuda):
+        context = mp.get_context('spawn')
+        self.requests = context.Queue()
+        self.results = context.Queue()
+        self.pending = 0
+        self.process = context.Process(target=_run,
+                                       args=(build_model, validation_set, use_cuda, self.requests, self.results),
+                                       daemon=True)
+        self.process.start()
+
+    def submit(self, iteration, state_dict):
+        self.requests.put((iteration, snapshot(state_dict)))
+        self.pending += 1
+
+    def poll(self, wait=False):
+        '''
+        :param wait: block until every submitted snapshot is evaluated
+        :return: list of (iteration, dictionary of mean losses) of the
+                 evaluations finished since the last call
+        '''
+        finished = []
+        while self.pending > 0:
+            try:
+                finished += [self.results.get(block=wait, timeout=1. if wait else None)]
+            except queue.Empty:
+                if not wait:
+                    break
+                if not self.process.is_alive():
+                    raise RuntimeError('validation process exited with code {}'.format(self.process.exitcode))
+                continue
+            self.pending -= 1
+        return finished
+
+    def close(self):
+        finished = self.poll(wait=True)
+        self.requests.put(None)
+        self.process.join()
+        return finished
@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+import collections.abc
+import hashlib
+import json
+import os
+
+import numpy as np
+
+
+VOCAB_VERSION = 1
+
+
+def artifact_path(model_name):
+    return 'saved_models/vocab_' + model_name
+
+
+class EmbeddingStore(collections.abc.Mapping):
+    """
+        Read-only word to vector mapping over a memory-mapped .npy matrix,
+        a drop-in for the word_vec dictionary of BatchLoader.
+
+        Rows are paged in on first use and shared through the page cache by
+        every process that maps the same file. Pickling keeps only the path
+        and the words, so spawned workers map the file again instead of
+        receiving a copy of the matrix.
+    """
+    def __init__(self, path, words):
+        self.path = path
+        self.words = words
+        self.index = {w: i for i, w in enumerate(words)}
+        self.matrix = np.load(path, mmap_mode='r')
+
+    def __getitem__(self, word):
+        return self.matrix[self.index[word]]
+
+    def __contains__(self, word):
+        return word in self.index
+
+    def __iter__(self):
+        return iter(self.words)
+
+    def __len__(self):
+        return len(self.words)
+
+    def keys(self):
+        return self.index.keys()
+
+    def __getstate__(self):
+        return {'path': self.path, 'words': self.words}
+
+    def __setstate__(self, state):
+        self.__init__(state['path'], state['words'])
+
+
+def describe(batch_loader):
+    '''
+        Everything BatchLoader derives from the corpus, except the vectors.
+    '''
+    return {'version': VOCAB_VERSION,
+            'vocab_size': int(batch_loader.vocab_size),
+            'max_seq_len': int(batch_loader.max_seq_len),
+            'labels': {'unk': batch_loader.unk_label,
+                       'end': batch_loader.end_label,
+                       'go': batch_loader.go_label},
+            'idx_to_word': list(batch_loader.idx_to_word),
+            'input_words': list(batch_loader.word_vec.keys()),
+            'embed_size': len(next(iter(batch_loader.word_vec.values())))}
+
+
+def fingerprint(description):
+    '''
+    :return: sha256 of a description, without its own fingerprint
+    '''
+    content = {k: v for k, v in description.items() if k not in ('fingerprint', 'embeddings_sha256')}
+    return hashlib.sha256(json.dumps(content, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def save_vocab(batch_loader, path):
+    '''
+        Save vocabularies, max_seq_len and word vectors of batch_loader to
+        the directory path as vocab.json and embeddings.npy. An artifact
+        with the same fingerprint is kept as is.
+    :return: fingerprint of the vocabulary
+    '''
+    description = describe(batch_loader)
+    description['fingerprint'] = fingerprint(description)
+
+    json_path = os.path.join(path, 'vocab.json')
+    if os.path.exists(json_path):
+        with open(json_path) as f:
+            if json.load(f).get('fingerprint') == description['fingerprint']:
+                return description['fingerprint']
+
+    os.makedirs(path, exist_ok=True)
+    matrix = np.stack([batch_loader.word_vec[w] for w in description['input_words']]).astype(np.float32)
+    np.save(os.path.join(path, 'embeddings.npy'), matrix)
+    description['embeddings_sha256'] = hashlib.sha256(matrix.tobytes()).hexdigest()
+
+    # vocab.json is written last, an artifact without it is incomplete
+    with open(json_path + '.tmp', 'w') as f:
+        json.dump(description, f)
+    os.replace(json_path + '.tmp', json_path)
+    return description['fingerprint']
+
+
+def load_vocab(path, expected_fingerprint=None, verify=False):
+    '''
+        Read the artifact saved by save_vocab, the vectors are memory-mapped.
+    :param expected_fingerprint: optional fingerprint the vocabulary must
+        have, e.g. the one recorded in a training checkpoint
+    :param verify: also hash the whole embedding matrix, which reads it
+    :return: description of the vocabulary and its EmbeddingStore
+    '''
+    with open(os.path.join(path, 'vocab.json')) as f:
+        description = json.load(f)
+
+    if description.get('version') != VOCAB_VERSION:
+        raise ValueError('{}: vocabulary artifact version {}, expected {}'.format(
+            path, description.get('version'), VOCAB_VERSION))
+    if fingerprint(description) != description['fingerprint']:
+        raise ValueError('{}: vocabulary does not match its fingerprint'.format(path))
+    if expected_fingerprint is not None and description['fingerprint'] != expected_fingerprint:
+        raise ValueError('{}: vocabulary fingerprint {} does not match {}'.format(
+            path, description['fingerprint'][:12], expected_fingerprint[:12]))
+
+    store = EmbeddingStore(os.path.join(path, 'embeddings.npy'), description['input_words'])
+    if store.matrix.shape != (len(description['input_words']), description['embed_size']):
+        raise ValueError('{}: embedding matrix of shape {} for {} words'.format(
+            path, store.matrix.shape, len(description['input_words'])))
+    if verify and hashlib.sha256(np.ascontiguousarray(store.matrix).tobytes()).hexdigest() != description['embeddings_sha256']:
+        raise ValueError('{}: embedding matrix does not match its checksum'.format(path))
+
+    return description, store
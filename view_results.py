@@ -1,4 +1,6 @@
 import argparse
+import os
+import time
 import matplotlib
 import matplotlib.pyplot as plt
 import pylab
@@ -6,57 +8,78 @@ import pylab
 
 import numpy as np
 
-if __name__=="__main__":
-    parser = argparse.ArgumentParser(description='Paraphraser')
-    parser.add_argument('-m', '--model-name', default='', help='name of model to save (default: "")')
-    args = parser.parse_args()
+from utils.metrics import MetricsLogReader
+
+
+def load_npy_results(model_name):
+    '''
+        Loss arrays of runs from before the metrics log, one per 500 iterations.
+    '''
+    names = ['ce', 'kld']
+    if 'tpl' in model_name.lower() or 'gan' in model_name.lower():
+        names += ['ce2']
+    if 'gan' in model_name.lower():
+        names += ['dg', 'd']
+
+    results = {}
+    for name in names:
+        for split in ['train', 'valid']:
+            results[f'{name}_result_{split}'] = np.load(f'logs/{model_name}/{name}_result_{split}.npy')
+    results['iteration'] = np.arange(len(results['ce_result_valid'])) * 500
+    return results
+
 
-    ce_result_valid = list(np.load(f'logs/{args.model_name}/ce_result_valid.npy'))
-    ce_result_train = list(np.load(f'logs/{args.model_name}/ce_result_train.npy'))
-    kld_result_valid = list(np.load(f'logs/{args.model_name}/kld_result_valid.npy'))
-    kld_result_train = list(np.load(f'logs/{args.model_name}/kld_result_train.npy'))
-
-    if 'tpl' in args.model_name.lower():
-        ce2_result_valid = list(np.load(f'logs/{args.model_name}/ce2_result_valid.npy'))
-        ce2_result_train = list(np.load(f'logs/{args.model_name}/ce2_result_train.npy'))
-    if 'gan' in args.model_name.lower():
-        ce2_result_valid = list(np.load(f'logs/{args.model_name}/ce2_result_valid.npy'))
-        ce2_result_train = list(np.load(f'logs/{args.model_name}/ce2_result_train.npy'))
-        dg_result_valid = list(np.load(f'logs/{args.model_name}/dg_result_valid.npy'))
-        dg_result_train = list(np.load(f'logs/{args.model_name}/dg_result_train.npy'))
-        d_result_valid = list(np.load(f'logs/{args.model_name}/d_result_valid.npy'))
-        d_result_train = list(np.load(f'logs/{args.model_name}/d_result_train.npy'))
-
-    iter = np.arange(len(ce_result_valid)) * 500
-    plt.plot(iter, ce_result_train, iter, ce_result_valid)
+def plot_results(results, model_name):
+    iter = results['iteration']
+    plt.plot(iter, results['ce_result_train'], iter, results['ce_result_valid'])
     plt.legend(['Train', 'Validation'])
     plt.ylabel('Cross entropy loss')
-    plt.savefig('results/ce_{}.png'.format(args.model_name))
+    plt.savefig('results/ce_{}.png'.format(model_name))
     plt.clf()
 
-    print(np.min(ce_result_valid), np.argmin(ce_result_valid) * 500)
+    print(np.min(results['ce_result_valid']), iter[np.argmin(results['ce_result_valid'])])
 
-    plt.plot(iter, kld_result_train, iter, kld_result_valid)
+    plt.plot(iter, results['kld_result_train'], iter, results['kld_result_valid'])
     plt.legend(['Train', 'Validation'])
     plt.ylabel('KL-divergence loss')
     plt.ylim(0, 10)
-    plt.savefig('results/kld_{}.png'.format(args.model_name))
+    plt.savefig('results/kld_{}.png'.format(model_name))
     plt.clf()
 
-    train_loss = np.sum(np.stack([ce_result_train, kld_result_train], axis=0), axis=0)
-    valid_loss = np.sum(np.stack([ce_result_valid, kld_result_valid], axis=0), axis=0)
-    if 'tpl' in args.model_name.lower():
-        train_loss = np.sum(np.stack([ce_result_train, kld_result_train, ce2_result_train], axis=0), axis=0)
-        valid_loss = np.sum(np.stack([ce_result_valid, kld_result_valid, ce2_result_valid], axis=0), axis=0)
+    # the discriminator loss is not part of the paraphraser objective
+    names = [name for name in ['ce', 'kld', 'ce2', 'dg'] if f'{name}_result_train' in results]
+    train_loss = np.sum(np.stack([results[f'{name}_result_train'] for name in names], axis=0), axis=0)
+    valid_loss = np.sum(np.stack([results[f'{name}_result_valid'] for name in names], axis=0), axis=0)
 
-    if 'gan' in args.model_name.lower():
-        train_loss = np.sum(np.stack([ce_result_train, kld_result_train, ce2_result_train, dg_result_train], axis=0), axis=0)
-        valid_loss = np.sum(np.stack([ce_result_valid, kld_result_valid, ce2_result_valid, dg_result_valid], axis=0), axis=0)
-
-    print(np.min(valid_loss), np.argmin(valid_loss) * 500)
+    print(np.min(valid_loss), iter[np.argmin(valid_loss)])
 
     plt.plot(iter, train_loss, iter, valid_loss)
     plt.legend(['Train', 'Validation'])
     plt.ylabel('Total loss')
-    plt.savefig('results/total_{}.png'.format(args.model_name))
+    plt.savefig('results/total_{}.png'.format(model_name))
     plt.clf()
+
+
+if __name__=="__main__":
+    parser = argparse.ArgumentParser(description='Paraphraser')
+    parser.add_argument('-m', '--model-name', default='', help='name of model to save (default: "")')
+    parser.add_argument('--follow', default=False, type=bool, help='keep reading the log of a running training (default: False)')
+    parser.add_argument('--interval', default=30., type=float, help='seconds between reads when following (default: 30)')
+    args = parser.parse_args()
+
+    log_path = f'logs/{args.model_name}/metrics.log'
+    if not args.follow and not os.path.exists(log_path):
+        plot_results(load_npy_results(args.model_name), args.model_name)
+    else:
+        reader = MetricsLogReader(log_path)
+        while True:
+            if reader.poll() > 0:
+                results = reader.read()
+                print('----------ITERATION-----------')
+                print(results['iteration'][-1])
+                plot_results(results, args.model_name)
+            elif not args.follow:
+                print('no records in ' + log_path)
+            if not args.follow:
+                break
+            time.sleep(args.interval)